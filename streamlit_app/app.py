@@ -5,12 +5,19 @@ Version multi-commandes - Traite tous les contrats d'un fichier XML
 """
 
 import streamlit as st
-import requests
-import json
-from datetime import datetime
-import utils
-from lxml import etree
 import io
+import os
+from datetime import datetime
+import compaction
+import matching
+import metrics
+import sources
+from order_store import build_order_index, OrderIndex
+from metrics import METRICS
+
+# Modules de correction (lxml, pool de processus, service, mode borné) :
+# importés à la demande, le premier affichage n'attend que la base de
+# commandes
 
 # ============================================================================
 # CONFIGURATION
@@ -25,163 +32,430 @@ st.set_page_config(
 GITHUB_REPO = "younessemlali/VERALLIA_Modificator"
 GITHUB_RAW_URL = f"https://raw.githubusercontent.com/{GITHUB_REPO}/main/data/commandes_extraites.json"
 
+# Source des commandes : URL HTTP(S), chemin local ou file:// (tests, hors ligne)
+COMMANDES_SOURCE = os.environ.get("VERALLIA_COMMANDES_URL", GITHUB_RAW_URL)
+
+# Service de correction (service.py) utilisé à la place du moteur local
+SERVICE_URL = os.environ.get("VERALLIA_SERVICE_URL")
+
+# Budget du mode mémoire bornée (spool.py, importé seulement s'il est fixé)
+MEMORY_BUDGET_MB = os.environ.get("VERALLIA_MEMORY_BUDGET_MB")
+
+# Export des mesures au format Prometheus (fichier réécrit après chaque correction)
+METRICS_FILE = os.environ.get("VERALLIA_METRICS_FILE")
+
+# Aperçu des contrats : tailles de page proposées
+PREVIEW_PAGE_SIZES = (25, 50, 100, 250)
+
+# Plusieurs agences / usines : VERALLIA_COMMANDES_URLS (séparées par des virgules)
+COMMANDES_SOURCES = sources.sources_from_env(COMMANDES_SOURCE)
+
 # ============================================================================
 # FONCTIONS
 # ============================================================================
 
-@st.cache_data(ttl=300)  # Cache 5 minutes
-def load_commandes_from_github():
-    """Charge les commandes depuis GitHub"""
-    try:
-        response = requests.get(GITHUB_RAW_URL, timeout=10)
-        if response.status_code == 200:
-            data = json.loads(response.text)
-            # Filtrer les entrées null ou invalides
-            if isinstance(data, list):
-                return [c for c in data if c is not None and isinstance(c, dict)]
-            return []
-        else:
-            st.error(f"Erreur chargement GitHub: {response.status_code}")
-            return []
-    except Exception as e:
-        st.error(f"Erreur connexion GitHub: {str(e)}")
-        return []
+@st.cache_resource
+def get_order_snapshot() -> sources.MultiSourceSnapshot:
+    """Cache local des commandes (toutes sources), partagé par toutes les sessions"""
+    return sources.MultiSourceSnapshot(COMMANDES_SOURCES)
 
 
-def extract_all_order_numbers_from_xml(xml_content: bytes) -> list:
-    """Extrait TOUS les numéros de commande du XML"""
-    try:
-        parser = etree.XMLParser(encoding='iso-8859-1', remove_blank_text=False)
-        tree = etree.parse(io.BytesIO(xml_content), parser)
-        root = tree.getroot()
-        
-        # Chercher tous les OrderId
-        ns = {'hr': 'http://ns.hr-xml.org/2004-08-02'}
-        order_elements = root.findall('.//hr:OrderId/hr:IdValue', ns)
-        
-        orders = []
-        seen = set()
-        
-        for elem in order_elements:
-            if elem.text and elem.text.strip():
-                numero = elem.text.strip()
-                if numero not in seen:
-                    orders.append(numero)
-                    seen.add(numero)
-        
-        return orders
-    except Exception as e:
-        st.error(f"Erreur extraction numéros commande : {str(e)}")
-        return []
+@st.cache_resource
+def get_compacted_store() -> compaction.CompactedStore:
+    """Snapshots compactés de la base de commandes, sur disque"""
+    return compaction.CompactedStore()
+
+
+# Données de commandes par version : cache_resource, un seul exemplaire
+# partagé par toutes les sessions et non copié à chaque rerun (cache_data
+# désérialise une copie à chaque appel). Ces objets sont en lecture seule.
+
+@st.cache_resource(max_entries=4)
+def get_compaction_for_version(version: str) -> compaction.Compaction:
+    """État courant des commandes (suppressions et remplacements appliqués)"""
+    return get_compacted_store().load(version, get_order_snapshot().load_versioned)
+
 
+@st.cache_resource(max_entries=4)
+def build_index_for_version(version: str) -> OrderIndex:
+    """Construit l'index une seule fois par version (hash) des données"""
+    return build_order_index(get_compaction_for_version(version).commandes)
 
-def find_commande_by_number(commandes: list, numero_commande: str) -> dict:
-    """Trouve une commande par son numéro"""
-    for commande in commandes:
-        if commande is None:
-            continue
-        if commande.get('numeroCommande') == numero_commande:
-            return commande
-    return None
 
+@st.cache_resource(max_entries=4)
+def get_matcher_for_version(version: str) -> matching.OrderMatcher:
+    """Index de rapprochement (numéros normalisés, numéros de contrat) par version"""
+    return matching.OrderMatcher.from_commandes(build_index_for_version(version))
 
-def apply_corrections_multi(xml_content: bytes, commandes_map: dict) -> tuple:
+
+@st.cache_resource
+def get_result_cache() -> 'result_cache.ResultCache':
+    """Cache disque des XML corrigés, partagé par toutes les sessions"""
+    import result_cache
+    return result_cache.ResultCache()
+
+
+@st.cache_resource
+def get_download_server() -> 'spool.DownloadServer':
     """
-    Applique les corrections pour plusieurs commandes dans le même XML
-    
-    Args:
-        xml_content: Contenu XML original
-        commandes_map: Dict {numero_commande: {codePoste, codeCycle}}
-    
-    Returns:
-        (XML corrigé en bytes, nombre de corrections appliquées)
+    Téléchargements servis depuis le disque (mode mémoire bornée, archives ZIP)
+
+    Lève RuntimeError si le serveur ne peut pas démarrer (adresse publique
+    manquante, port déjà pris) : rien n'est mis en cache, offer_file se
+    replie sur st.download_button.
     """
-    parser = etree.XMLParser(encoding='iso-8859-1', remove_blank_text=False)
-    tree = etree.parse(io.BytesIO(xml_content), parser)
-    root = tree.getroot()
-    
-    ns = {'hr': 'http://ns.hr-xml.org/2004-08-02'}
+    import spool
+    spool.purge()
+    return spool.DownloadServer().start()
+
+
+@st.cache_resource
+def get_history_store() -> 'history.HistoryStore':
+    """Historique des corrections (SQLite), partagé par toutes les sessions"""
+    import history
+    return history.HistoryStore()
+
+
+@st.cache_resource
+def get_job_manager() -> 'jobs.JobManager':
+    """Pool de traitement des fichiers multiples, qui survit aux reruns"""
+    import jobs
+    return jobs.JobManager(results=get_result_cache(), history_store=get_history_store())
+
+
+def load_commandes_from_github() -> OrderIndex:
+    """
+    Charge les commandes et construit leur index
+
+    La dernière copie locale valide est servie immédiatement ; la source
+    (GitHub par défaut) est revalidée en arrière-plan toutes les 5 minutes,
+    ou de façon synchrone au tout premier lancement. La liste brute n'est
+    lue que si le snapshot compacté de cette version est absent du disque.
+    """
+    order_snapshot = get_order_snapshot()
+    order_snapshot.revalidate()
+
+    if order_snapshot.last_error:
+        if order_snapshot.version:
+            st.warning(
+                f"⚠️ Source des commandes injoignable ({order_snapshot.last_error}) — "
+                f"copie locale du {order_snapshot.fetched_at} utilisée"
+            )
+        else:
+            st.error(f"Erreur connexion GitHub: {order_snapshot.last_error}")
+
+    if not order_snapshot.version:
+        return build_order_index([])
+    return build_index_for_version(order_snapshot.version)
+
+
+def show_performance(placeholder):
+    """Panneau « Performance » : durées par étape, compteurs, tailles de fichiers"""
+    data = METRICS.snapshot()
+    with placeholder.container():
+        with st.expander("⏱️ Performance", expanded=False):
+            if not data['stages']:
+                st.caption("Aucune mesure pour le moment")
+                return
+            st.table([
+                {
+                    'Étape': stage,
+                    'Appels': count,
+                    'Total (ms)': round(total * 1000, 1),
+                    'Moyenne (ms)': round(total / count * 1000, 2),
+                    'Max (ms)': round(maximum * 1000, 1),
+                }
+                for stage in metrics.STAGES if stage in data['stages']
+                for count, total, maximum in [data['stages'][stage]]
+            ])
+            for name, labels, value in sorted(data['counters'], key=lambda c: (c[0], sorted(c[1].items()))):
+                detail = ', '.join(f"{k}={v}" for k, v in sorted(labels.items()))
+                st.markdown(f"- **{name}** ({detail}) : {value}")
+            st.caption(f"{sum(data['fileSizes'])} fichiers, {data['fileSizesSum'] / (1024 * 1024):.1f} Mo au total")
+            st.code(METRICS.to_prometheus(), language='text')
+
+
+def show_upload_progress(entries: list, polling: bool):
+    """Avancement des fichiers multiples (rafraîchi tant que des jobs tournent)"""
+    manager = get_job_manager()
+    upload_jobs = [(filename, manager.get(key)) for filename, key in entries]
+    upload_jobs = [(filename, job) for filename, job in upload_jobs if job is not None]
+    finished = sum(job.finished for _, job in upload_jobs)
     
-    corrections_applied = 0
+    st.progress(
+        sum(job.progress for _, job in upload_jobs) / max(1, len(upload_jobs)),
+        text=f"{finished}/{len(upload_jobs)} fichiers traités"
+    )
+    st.dataframe(
+        [{**job.summary(), 'Fichier': filename} for filename, job in upload_jobs],
+        hide_index=True,
+        use_container_width=True
+    )
     
-    # Trouver tous les blocs Assignment
-    assignments = root.findall('.//hr:Assignment', ns)
+    # Tous terminés : rerun complet pour afficher le téléchargement
+    if polling and finished == len(upload_jobs):
+        st.rerun()
+
+
+def show_contract_preview(uploaded_file, input_sha256: str, matcher: matching.OrderMatcher):
+    """
+    Aperçu paginé des contrats, affiché avant l'analyse complète
+
+    Les contrats sont lus à la demande (jusqu'à la page affichée) et
+    l'index de lecture est conservé d'un rerun à l'autre pour ce fichier.
+    La colonne « Base » suit le même rapprochement que la correction
+    (zéros en tête, numéro de contrat).
+    """
+    from lxml import etree
+    from streaming import ContractSummaryIndex
+
+    index = st.session_state.get('preview_index')
+    if st.session_state.get('preview_key') != input_sha256:
+        if index is not None:
+            index.close()
+        index = ContractSummaryIndex(io.BytesIO(uploaded_file.getvalue()))
+        st.session_state['preview_index'] = index
+        st.session_state['preview_key'] = input_sha256
     
-    for assignment in assignments:
-        # Trouver le OrderId de ce contrat
-        order_elem = assignment.find('.//hr:OrderId/hr:IdValue', ns)
-        if order_elem is None or not order_elem.text:
-            continue
-        
-        numero_commande = order_elem.text.strip()
+    with st.expander("👀 Aperçu des contrats", expanded=True):
+        col_size, col_page = st.columns(2)
+        size = col_size.selectbox("Contrats par page", PREVIEW_PAGE_SIZES, index=1, key='preview_size')
+        number = col_page.number_input("Page", min_value=1, value=1, step=1, key='preview_page')
         
-        # Vérifier si on a les données pour cette commande
-        if numero_commande not in commandes_map:
-            continue
-        
-        commande_data = commandes_map[numero_commande]
-        code_poste = commande_data['codePoste']
-        code_cycle = commande_data['codeCycle']
-        
-        # Corriger CustomerJobCode
-        job_code_elem = assignment.find('.//hr:CustomerJobCode', ns)
-        if job_code_elem is not None:
-            # La balise existe déjà, mettre à jour
-            old_value = job_code_elem.text
-            job_code_elem.text = code_poste
-            corrections_applied += 1
-            print(f"Commande {numero_commande}: CustomerJobCode '{old_value}' → '{code_poste}'")
-        else:
-            # La balise n'existe pas, il faut la CRÉER
-            cust_req = assignment.find('.//hr:CustomerReportingRequirements', ns)
-            if cust_req is not None:
-                # Chercher ExternalOrderNumber pour insérer AVANT
-                external_order = cust_req.find('hr:ExternalOrderNumber', ns)
-                
-                # CRÉER la balise CustomerJobCode
-                job_code_elem = etree.Element('{http://ns.hr-xml.org/2004-08-02}CustomerJobCode')
-                job_code_elem.text = code_poste
-                job_code_elem.tail = '\n          '  # Formatage avec indentation
-                
-                if external_order is not None:
-                    # Insérer AVANT ExternalOrderNumber
-                    index = list(cust_req).index(external_order)
-                    cust_req.insert(index, job_code_elem)
-                else:
-                    # Si pas de ExternalOrderNumber, ajouter à la fin
-                    cust_req.append(job_code_elem)
-                
-                corrections_applied += 1
-                print(f"Commande {numero_commande}: CustomerJobCode CRÉÉE → '{code_poste}'")
+        try:
+            rows = index.page(number, size)
+        except etree.XMLSyntaxError:
+            st.caption("Aperçu interrompu : fichier XML invalide")
+            return
+        if not rows:
+            st.caption(f"Aucun contrat sur cette page ({index.loaded} contrats au total)")
+            return
         
-        # Corriger Cycle horaire
-        staffing_shift = assignment.find('.//hr:StaffingShift[@shiftPeriod="weekly"]', ns)
-        if staffing_shift is not None:
-            id_value_elem = staffing_shift.find('.//hr:IdValue', ns)
-            if id_value_elem is not None:
-                old_name = id_value_elem.get('name', '')
-                old_value = id_value_elem.text
-                id_value_elem.set('name', 'CYCLE')
-                id_value_elem.text = code_cycle
-                corrections_applied += 1
-                print(f"Commande {numero_commande}: Cycle '{old_name}:{old_value}' → 'CYCLE:{code_cycle}'")
-    
-    # Convertir en bytes avec encodage ISO-8859-1
-    output = io.BytesIO()
-    tree.write(
-        output,
-        encoding='iso-8859-1',
-        xml_declaration=True,
-        pretty_print=False
+        st.dataframe(
+            [
+                {
+                    'N°': row['index'],
+                    'Commande': row['numeroCommande'],
+                    'Contrat': row['numeroContrat'],
+                    'Ressource': row['ressource'],
+                    'CustomerJobCode actuel': row['customerJobCodeActuel'],
+                    'Cycle actuel': row['cycleHoraireActuel'],
+                    'Base': '✅' if row['numeroCommande'] and matcher.match(row['numeroCommande']).found else '❌',
+                }
+                for row in rows
+            ],
+            hide_index=True,
+            use_container_width=True
+        )
+        total = f"{index.loaded} contrats" if index.complete else f"{index.loaded} premiers contrats lus"
+        st.caption(f"Contrats {rows[0]['index']} à {rows[-1]['index']} — {total}")
+
+
+def show_violations(violations: list):
+    """Rapport de validation HR-XML du fichier corrigé (une ligne par violation)"""
+    import validation
+
+    if violations is None:
+        return
+    if isinstance(violations, int):
+        # Service de correction ou mode mémoire bornée : nombre d'écarts seulement
+        violations_summary = f"{violations} écarts HR-XML" if violations else "aucun écart sur les blocs Assignment"
+        (st.warning if violations else st.success)(f"🧪 Validation : {violations_summary}")
+        return
+    if not violations:
+        st.success("✅ Validation HR-XML : aucun écart sur les blocs Assignment")
+        return
+    
+    errors = sum(1 for v in violations if v['severity'] == validation.SEVERITY_ERROR)
+    counts = validation.summarize(violations)
+    message = (
+        f"{len(violations)} écarts HR-XML ({errors} erreurs) — "
+        + ", ".join(f"{rule} × {count}" for rule, count in sorted(counts.items()))
     )
+    (st.error if errors else st.warning)(f"🧪 Validation : {message}")
+    with st.expander(f"🧪 Rapport de validation ({len(violations)} écarts)", expanded=False):
+        st.dataframe(
+            [
+                {
+                    'Contrat': v['assignment'],
+                    'Commande': v['numeroCommande'],
+                    'Chemin': v['path'],
+                    'Règle': v['rule'],
+                    'Gravité': v['severity'],
+                    'Message': v['message'],
+                }
+                for v in violations
+            ],
+            hide_index=True,
+            use_container_width=True
+        )
+
+
+def show_changes(changes: list, filename: str):
+    """Rapport des modifications (avant / après par contrat) et ses exports"""
+    import changeset
+
+    if changes is None:
+        return
+    if isinstance(changes, int):
+        # Service de correction ou mode mémoire bornée : nombre de contrats seulement
+        st.caption(f"📝 {changes} contrats modifiés (détail non affiché)")
+        return
+    if not changes:
+        st.caption("📝 Aucun contrat modifié lors de ce passage")
+        return
     
-    return output.getvalue(), corrections_applied
+    counts = changeset.summarize(changes)
+    with st.expander(f"📝 Rapport des modifications ({len(changes)} contrats)", expanded=False):
+        st.caption(" | ".join(
+            f"{field} {changeset.ACTION_LABELS[action]} : {count}"
+            for (field, action), count in sorted(counts.items())
+        ))
+        st.dataframe(changeset.to_dataframe(changes), hide_index=True, use_container_width=True)
+        
+        stem = os.path.splitext(filename)[0]
+        col_csv, col_json = st.columns(2)
+        col_csv.download_button(
+            "📄 Exporter en CSV",
+            data=changeset.to_csv(changes),
+            file_name=f"{stem}_modifications.csv",
+            mime="text/csv",
+            use_container_width=True
+        )
+        col_json.download_button(
+            "🧾 Exporter en JSON",
+            data=changeset.to_json(changes),
+            file_name=f"{stem}_modifications.json",
+            mime="application/json",
+            use_container_width=True
+        )
+
+
+@st.fragment
+def show_history():
+    """
+    Recherche dans l'historique des corrections, par pages (curseur de la
+    dernière ligne affichée : chaque page est une descente dans un index)
+
+    La base n'est ouverte qu'une fois l'historique affiché ; changer de
+    page ne réexécute que ce fragment.
+    """
+    if not st.toggle("🗂️ Historique des corrections", key='history_open'):
+        return
+    import history
+
+    col_order, col_contract, col_dates = st.columns(3)
+    numero = col_order.text_input("N° de commande", key='history_commande').strip()
+    contrat = col_contract.text_input("N° de contrat", key='history_contrat').strip()
+    dates = col_dates.date_input("Période", value=(), format="DD/MM/YYYY", key='history_dates')
+    since = dates[0] if len(dates) > 0 else None
+    until = dates[1] if len(dates) > 1 else since
+
+    # Curseurs des pages déjà vues (retour arrière), remis à zéro avec les filtres
+    filters = (numero, contrat, since, until)
+    if st.session_state.get('history_filters') != filters:
+        st.session_state['history_filters'] = filters
+        st.session_state['history_cursors'] = [None]
+    cursors = st.session_state['history_cursors']
+
+    rows, next_cursor = get_history_store().search(numero or None, contrat or None, since, until,
+                                                   cursor=cursors[-1])
+    if not rows:
+        st.caption("Aucun contrat corrigé ne correspond à cette recherche")
+        return
+    st.dataframe(history.to_dataframe(rows), hide_index=True, use_container_width=True)
+
+    # Boutons traités par callback, avant la réexécution du fragment
+    col_previous, col_page, col_next = st.columns([1, 2, 1])
+    col_previous.button("◀ Plus récents", disabled=len(cursors) == 1, key='history_previous',
+                        on_click=cursors.pop, use_container_width=True)
+    col_page.caption(f"Page {len(cursors)} — contrats {(len(cursors) - 1) * history.PAGE_SIZE + 1} "
+                     f"à {(len(cursors) - 1) * history.PAGE_SIZE + len(rows)}, du plus récent au plus ancien")
+    col_next.button("Plus anciens ▶", disabled=next_cursor is None, key='history_next',
+                    on_click=cursors.append, args=(next_cursor,), use_container_width=True)
+
+
+def offer_file(path: str, filename: str, label: str, mime: str, **kwargs):
+    """
+    Bouton de téléchargement d'un fichier sur disque : lien vers le serveur
+    de téléchargement, ou st.download_button (fichier relu en mémoire) si
+    ce serveur est indisponible
+    """
+    try:
+        url = get_download_server().publish(path, filename, mime)
+    except RuntimeError as e:
+        st.warning(f"⚠️ {e} — fichier transmis par Streamlit, en mémoire")
+        with open(path, 'rb') as f:
+            st.download_button(label=label, data=f.read(), file_name=filename, mime=mime, **kwargs)
+        return
+    st.link_button(label, url, **kwargs)
+
+
+def offer_download(corrected_xml, filename: str, label: str):
+    """
+    Bouton de téléchargement du XML corrigé ; en mode mémoire bornée,
+    corrected_xml est un chemin servi depuis le disque
+    """
+    if isinstance(corrected_xml, str):
+        offer_file(corrected_xml, filename, label, "application/xml", type="primary", use_container_width=True)
+        return
+    st.download_button(
+        label=label,
+        data=corrected_xml,
+        file_name=filename,
+        mime="application/xml",
+        type="primary",
+        use_container_width=True
+    )
+
+
+def analyze_upload(uploaded_file) -> dict:
+    """
+    État calculé pour le fichier chargé (empreinte, puis numéros de
+    commande), conservé d'un rerun à l'autre : la pagination de l'aperçu
+    ou un clic ne relisent pas le fichier
+    """
+    import result_cache
+
+    analysis = st.session_state.get('upload_analysis')
+    if analysis is None or analysis['fileId'] != uploaded_file.file_id:
+        analysis = {'fileId': uploaded_file.file_id, 'sha256': result_cache.sha256_file(uploaded_file)}
+        st.session_state['upload_analysis'] = analysis
+    return analysis
+
+
+def scan_upload_orders(uploaded_file, analysis: dict) -> list:
+    """
+    Numéros de commande du fichier chargé (lecture unique, qui tient aussi
+    lieu de validation), mémorisés dans analysis
+
+    Returns:
+        Liste des numéros, ou None si le XML est invalide (analysis['error'])
+    """
+    from lxml import etree
+    from streaming import extract_all_order_numbers_from_xml
+
+    if 'orders' not in analysis:
+        with st.spinner("Recherche de toutes les commandes dans le fichier..."):
+            try:
+                analysis['orders'], analysis['error'] = extract_all_order_numbers_from_xml(uploaded_file), None
+            except etree.XMLSyntaxError as e:
+                analysis['orders'], analysis['error'] = None, str(e)
+    return analysis['orders']
+
+
+def find_commande_by_number(commandes: OrderIndex, numero_commande: str) -> dict:
+    """Trouve une commande par son numéro (la plus récente en cas de doublon)"""
+    return commandes.get(numero_commande)
 
 
 # ============================================================================
 # INTERFACE
 # ============================================================================
 
+# Mesures du processus (toutes sessions), dans la barre latérale
+performance_panel = st.sidebar.empty()
+
 # En-tête
 st.title("🔧 VERALLIA Modificator")
 st.markdown("**Correction automatique multi-commandes des fichiers XML Osmose pour Pixid**")
@@ -202,6 +476,7 @@ with st.expander("ℹ️ À propos", expanded=False):
 
 # Chargement des commandes
 commandes = load_commandes_from_github()
+show_performance(performance_panel)
 
 if not commandes:
     st.warning("⚠️ Aucune commande disponible. Vérifiez que le script Google Apps Script fonctionne.")
@@ -209,11 +484,32 @@ if not commandes:
 
 st.success(f"✅ {len(commandes)} commandes disponibles dans la base de données")
 
+compacted = get_compaction_for_version(get_order_snapshot().version)
+st.caption(
+    f"🗜️ Base compactée : {compacted.stats['enregistrements']} enregistrements → "
+    f"{compacted.stats['commandes']} commandes ({compacted.stats['supprimees']} supprimées, "
+    f"{compacted.stats['remplacements']} remplacements, {compacted.stats['sansNumero']} sans numéro)"
+)
+
 # Bouton de rafraîchissement
 if st.button("🔄 Actualiser la base de commandes"):
-    st.cache_data.clear()
+    get_order_snapshot().refresh()
     st.rerun()
 
+# État des sources (plusieurs agences / usines)
+if len(COMMANDES_SOURCES) > 1:
+    with st.expander(f"🌐 Sources des commandes ({len(COMMANDES_SOURCES)})", expanded=False):
+        for source, entry in get_order_snapshot().report.items():
+            if entry['status'] is None:
+                st.markdown(f"- `{source}` — non revalidée")
+            elif entry['error']:
+                st.markdown(f"- ❌ `{source}` — {entry['error']} ({entry['latency'] * 1000:.0f} ms)")
+            else:
+                st.markdown(f"- ✅ `{source}` — {entry['commandes']} commandes ({entry['latency'] * 1000:.0f} ms)")
+
+# Corrections passées (fichiers, commandes, contrats, valeurs avant / après)
+show_history()
+
 st.divider()
 
 # ============================================================================
@@ -222,22 +518,136 @@ st.divider()
 
 st.header("📁 Charger le fichier XML Osmose")
 
-uploaded_file = st.file_uploader(
-    "Sélectionnez le fichier XML à corriger",
+uploaded_files = st.file_uploader(
+    "Sélectionnez le ou les fichiers XML à corriger",
     type=['xml'],
-    help="Fichier XML généré par Osmose (encodage ISO-8859-1). Peut contenir plusieurs contrats."
+    accept_multiple_files=True,
+    help="Fichiers XML générés par Osmose (encodage ISO-8859-1). Chacun peut contenir plusieurs contrats."
 )
+uploaded_file = uploaded_files[0] if len(uploaded_files) == 1 else None
 
-if uploaded_file is not None:
-    # Lire le contenu
-    xml_content = uploaded_file.read()
+if len(uploaded_files) > 1:
+    # ========================================================================
+    # PLUSIEURS FICHIERS : TRAITEMENT EN ARRIÈRE-PLAN
+    # ========================================================================
+    
+    import jobs
+    
+    version = get_order_snapshot().version
+    matcher = get_matcher_for_version(version)
+    manager = get_job_manager()
+    
+    # Un job par fichier et par version de la base ; un rerun (clic,
+    # rafraîchissement) retrouve les jobs lancés sans relire les fichiers
+    known_jobs = st.session_state.setdefault('upload_jobs', {})
+    entries = []
+    for f in uploaded_files:
+        key = known_jobs.get((f.file_id, version))
+        if key is None or manager.get(key) is None:
+            key = manager.submit(f.name, f.getvalue(), matcher, version).key
+            known_jobs[(f.file_id, version)] = key
+        entries.append((f.name, key))
+    
+    st.header(f"⚙️ Traitement de {len(entries)} fichiers")
+    st.caption(f"{manager.workers} processus de correction en parallèle")
+    
+    polling = not all(manager.get(key).finished for _, key in entries)
+    st.fragment(run_every=1 if polling else None)(show_upload_progress)(entries, polling)
+    
+    if not polling:
+        upload_jobs = [(filename, manager.get(key)) for filename, key in entries]
+        done = [(filename, job) for filename, job in upload_jobs if job.status == jobs.STATUS_DONE]
+        failed = [(filename, job) for filename, job in upload_jobs if job.status == jobs.STATUS_ERROR]
+        
+        show_performance(performance_panel)
+        if METRICS_FILE:
+            METRICS.write_prometheus(METRICS_FILE)
+        
+        if failed:
+            st.warning(f"⚠️ {len(failed)} fichiers non corrigés : " + ", ".join(f"`{f}`" for f, _ in failed))
+        
+        if done:
+            st.success(
+                f"✅ **{len(done)} fichiers corrigés, "
+                f"{sum(job.corrections for _, job in done)} modifications appliquées !**"
+            )
+            
+            # Archive construite une fois par lot de résultats, sur disque :
+            # servie comme en mode mémoire bornée, la session n'en garde
+            # que le chemin
+            import spool
+            
+            archive_key = tuple(job.key for _, job in done)
+            archive_path = st.session_state.get('upload_zip_path')
+            if (st.session_state.get('upload_zip_key') != archive_key
+                    or archive_path is None or not os.path.exists(archive_path)):
+                if archive_path is not None and os.path.exists(archive_path):
+                    os.remove(archive_path)
+                spool.purge()
+                archive_path = spool.temp_path('.zip')
+                with open(archive_path, 'wb') as archive:
+                    jobs.write_zip(((filename, job.result) for filename, job in done), archive)
+                st.session_state['upload_zip_path'] = archive_path
+                st.session_state['upload_zip_key'] = archive_key
+            
+            offer_file(
+                archive_path, f"VERALLIA_corriges_{datetime.now():%Y%m%d_%H%M}.zip",
+                f"📥 Télécharger les {len(done)} fichiers corrigés (ZIP)", "application/zip",
+                type="primary", use_container_width=True
+            )
+            st.info("💾 Les fichiers de l'archive gardent leur nom d'origine")
+
+elif uploaded_file is not None:
+    import changeset
+    import history
+    import incremental
+    import result_cache
+    import rules
+    
     original_filename = uploaded_file.name
     
-    # Validation
-    is_valid, error_msg = utils.validate_xml(xml_content)
+    # Résultat déjà calculé pour ce fichier et cette version de la base ?
+    analysis = analyze_upload(uploaded_file)
+    input_sha256 = analysis['sha256']
+    snapshot_version = get_order_snapshot().version
+    result_key = result_cache.make_key(input_sha256, snapshot_version)
+    # Mode mémoire bornée : sortie et rapports sur disque, jamais en mémoire
+    if MEMORY_BUDGET_MB:
+        import spool
+        spooling = spool.needs_spooling(uploaded_file.size)
+    else:
+        spooling = False
+    cached_result = get_result_cache().get(result_key, as_path=spooling)
+    
+    if cached_result is not None:
+        corrected_xml, cached_stats = cached_result
+        nb_trouvees = len(cached_stats['commandesTrouvees'])
+        nb_manquantes = len(cached_stats['commandesManquantes'])
+        
+        st.success(f"✅ Fichier chargé : `{original_filename}`")
+        st.info("⚡ **Cache : HIT** — fichier déjà corrigé avec cette version de la base de commandes, aucun retraitement nécessaire")
+        st.success(f"✅ **{nb_trouvees} contrats traités, {cached_stats['corrections']} modifications appliquées !**")
+        
+        if nb_manquantes:
+            st.warning(f"⚠️ {nb_manquantes} contrats non corrigés (commandes manquantes dans la base)")
+        
+        show_violations(cached_stats.get('violations'))
+        show_changes(cached_stats.get('changes'), original_filename)
+        
+        offer_download(corrected_xml, original_filename, f"📥 Télécharger le XML corrigé ({nb_trouvees} contrats)")
+        
+        st.info(f"💾 Le fichier téléchargé aura le même nom : `{original_filename}`")
+        st.stop()
+    
+    st.caption("Cache : MISS — fichier jamais corrigé avec cette version de la base de commandes")
+    
+    # Premiers contrats affichés immédiatement, avant la lecture complète
+    show_contract_preview(uploaded_file, input_sha256, get_matcher_for_version(snapshot_version))
     
-    if not is_valid:
-        st.error(f"❌ Fichier XML invalide : {error_msg}")
+    # Lecture unique du fichier : détection des commandes + validation
+    all_orders = scan_upload_orders(uploaded_file, analysis)
+    if all_orders is None:
+        st.error(f"❌ Fichier XML invalide : {analysis['error']}")
         st.stop()
     
     st.success(f"✅ Fichier chargé : `{original_filename}`")
@@ -248,23 +658,23 @@ if uploaded_file is not None:
     
     st.header("🔍 Analyse du fichier XML")
     
-    with st.spinner("Recherche de toutes les commandes dans le fichier..."):
-        # Extraire tous les numéros de commande
-        all_orders = extract_all_order_numbers_from_xml(xml_content)
-        
-        if not all_orders:
-            st.error("❌ Aucun numéro de commande trouvé dans le XML")
-            st.stop()
-        
-        st.info(f"📋 **{len(all_orders)} commandes détectées** dans le fichier XML")
-        
-        # Chercher les correspondances
-        commandes_trouvees = {}
-        commandes_manquantes = []
-        
-        for numero in all_orders:
-            commande = find_commande_by_number(commandes, numero)
-            if commande:
+    if not all_orders:
+        st.error("❌ Aucun numéro de commande trouvé dans le XML")
+        st.stop()
+    
+    st.info(f"📋 **{len(all_orders)} commandes détectées** dans le fichier XML")
+    
+    # Chercher les correspondances
+    commandes_trouvees = {}
+    commandes_manquantes = []
+    
+    rapprochements = {}
+    
+    with METRICS.stage('match'):
+        matches = get_matcher_for_version(get_order_snapshot().version).resolve(all_orders)
+        for numero, match in matches.items():
+            if match.found:
+                commande = find_commande_by_number(commandes, match.base)
                 commandes_trouvees[numero] = {
                     'codePoste': commande.get('codePoste'),
                     'codeCycle': commande.get('codeCycle'),
@@ -272,6 +682,8 @@ if uploaded_file is not None:
                 }
             else:
                 commandes_manquantes.append(numero)
+            if match.explanation:
+                rapprochements[numero] = match.explanation
     
     # Affichage des résultats
     col1, col2 = st.columns(2)
@@ -295,13 +707,21 @@ if uploaded_file is not None:
         with st.expander(f"✅ Détails des {len(commandes_trouvees)} commandes trouvées", expanded=True):
             for numero, info in commandes_trouvees.items():
                 st.markdown(f"**Commande {numero}** → Poste: `{info['codePoste']}` | Cycle: `{info['codeCycle']}`")
+                if numero in rapprochements:
+                    st.caption(f"↪️ {rapprochements[numero]}")
     
     # Détails des commandes manquantes
     if commandes_manquantes:
         with st.expander(f"⚠️ Commandes manquantes ({len(commandes_manquantes)})", expanded=False):
             st.warning("Ces commandes ne seront PAS corrigées car elles n'existent pas dans la base de données :")
             for numero in commandes_manquantes:
-                st.markdown(f"- Commande **{numero}**")
+                deletion = compacted.deleted.get(numero)
+                if deletion:
+                    st.markdown(f"- Commande **{numero}** — supprimée (email du {deletion.get('dateExtraction')})")
+                elif numero in rapprochements:
+                    st.markdown(f"- Commande **{numero}** — {rapprochements[numero]}")
+                else:
+                    st.markdown(f"- Commande **{numero}**")
             st.info("""
             **Pour corriger ces commandes :**
             1. Vérifiez que les emails sont dans votre label Gmail VERALLIA
@@ -327,22 +747,108 @@ if uploaded_file is not None:
         with st.spinner(f"Correction de {len(commandes_trouvees)} contrats en cours..."):
             try:
                 # Préparer le mapping pour les corrections
-                corrections_map = {}
-                for numero, info in commandes_trouvees.items():
-                    corrections_map[numero] = {
-                        'codePoste': info['codePoste'],
-                        'codeCycle': info['codeCycle']
-                    }
+                corrections_map = {
+                    numero: rules.order_values(info['data']) for numero, info in commandes_trouvees.items()
+                }
                 
-                # Appliquer les corrections
-                corrected_xml, nb_corrections = apply_corrections_multi(xml_content, corrections_map)
+                # Fichier déjà corrigé avec une version antérieure de la base :
+                # seuls les contrats des commandes modifiées sont retouchés
+                previous = get_result_cache().latest_for_input(input_sha256, as_path=spooling)
+                manifest = incremental.Manifest.from_dict(previous[1].get('manifest')) if previous else None
+                changes_csv = None
+                started_at = history.now()
+                applied_version = snapshot_version
                 
-                # Validation du XML corrigé
-                is_valid, error_msg = utils.validate_xml(corrected_xml)
+                if SERVICE_URL and not spooling:
+                    import service
+                    
+                    # Le service applique sa propre copie de la base (même source)
+                    with METRICS.stage('service'):
+                        corrected_xml, stats, applied_version = service.correct_remote(
+                            SERVICE_URL, uploaded_file.getvalue(), validate=True, changes=True
+                        )
+                    if applied_version != snapshot_version:
+                        st.warning(
+                            "⚠️ Le service de correction applique une autre version de la base de commandes "
+                            f"({applied_version or 'inconnue'}) : résultat non mémorisé"
+                        )
+                    # Sans manifeste : le prochain passage repartira de l'original
+                    manifest = new_manifest = None
+                elif manifest is not None and not manifest.dirty_orders(corrections_map):
+                    corrected_xml = previous[0]
+                    stats = manifest.unchanged_stats(corrections_map)
+                    stats['violations'] = previous[1].get('violations')
+                    stats['changes'] = []
+                    new_manifest = manifest
+                elif spooling:
+                    st.caption(
+                        f"💾 Mode mémoire bornée ({spool.MEMORY_BUDGET_MB} Mo) : "
+                        "correction en flux, résultat et rapports sur disque"
+                    )
+                    corrected_xml = spool.temp_path('.xml')
+                    stats, new_manifest = spool.correct_file(
+                        previous[0] if manifest is not None else uploaded_file,
+                        corrected_xml, corrections_map, manifest, validate=True, changes=True
+                    )
+                    changes_csv = spool.temp_path('.csv')
+                    with open(changes_csv, 'w', encoding='utf-8-sig', newline='') as f:
+                        changeset.write_csv(stats['changes'], f)
+                else:
+                    # Validation HR-XML et rapport des modifications pendant la
+                    # correction (aucune relecture)
+                    output = io.BytesIO()
+                    stats, new_manifest = incremental.correct_incremental(
+                        io.BytesIO(previous[0]) if manifest is not None else uploaded_file,
+                        output, corrections_map, manifest, validate=True, changes=True
+                    )
+                    corrected_xml = output.getvalue()
+                nb_corrections = stats['corrections']
                 
-                if not is_valid:
-                    st.error(f"❌ XML corrigé invalide : {error_msg}")
-                    st.stop()
+                # Historique : la correction et ses contrats, en une transaction
+                try:
+                    get_history_store().record(
+                        original_filename, input_sha256, applied_version, stats,
+                        stats.get('changes'), started_at
+                    )
+                except Exception as e:
+                    st.warning(f"⚠️ Correction non enregistrée dans l'historique : {e}")
+                if changes_csv:
+                    # Rapports relus en flux : seuls leurs effectifs restent en mémoire
+                    for name in ('violations', 'changes'):
+                        stats[name].close()
+                        stats[name] = stats[name].count
+                
+                # Mémoriser le résultat pour les prochains envois du même fichier
+                meta = {
+                    'filename': original_filename,
+                    'inputSha256': input_sha256,
+                    'commandes': all_orders,
+                    'commandesTrouvees': corrections_map,
+                    'commandesManquantes': commandes_manquantes,
+                    'corrections': nb_corrections,
+                    'manifest': new_manifest.to_dict() if new_manifest is not None else None,
+                    'violations': stats.get('violations'),
+                    'changes': stats.get('changes')
+                }
+                # Résultat du service sur une autre version de la base : non mémorisé
+                if applied_version == snapshot_version:
+                    if isinstance(corrected_xml, str):
+                        # Un résultat inchangé reste aussi dans son entrée d'origine
+                        corrected_xml = get_result_cache().put_file(
+                            result_key, corrected_xml, meta, move=previous is None or corrected_xml != previous[0]
+                        )
+                    else:
+                        get_result_cache().put(result_key, corrected_xml, meta)
+                
+                show_performance(performance_panel)
+                if METRICS_FILE:
+                    METRICS.write_prometheus(METRICS_FILE)
+                
+                if manifest is not None:
+                    st.info(
+                        f"♻️ **Correction incrémentale** — {stats['contratsCorriges']} contrats réécrits, "
+                        f"{stats['contratsIgnores']} ignorés (commandes inchangées depuis la dernière correction)"
+                    )
                 
                 # Afficher les résultats
                 st.success(f"✅ **{len(commandes_trouvees)} contrats traités, {nb_corrections} modifications appliquées !**")
@@ -350,14 +856,17 @@ if uploaded_file is not None:
                 if commandes_manquantes:
                     st.warning(f"⚠️ {len(commandes_manquantes)} contrats non corrigés (commandes manquantes dans la base)")
                 
+                show_violations(stats.get('violations'))
+                show_changes(stats.get('changes'), original_filename)
+                if changes_csv:
+                    offer_file(
+                        changes_csv, f"{os.path.splitext(original_filename)[0]}_modifications.csv",
+                        "📄 Rapport des modifications (CSV)", "text/csv", use_container_width=True
+                    )
+                
                 # Bouton de téléchargement
-                st.download_button(
-                    label=f"📥 Télécharger le XML corrigé ({len(commandes_trouvees)} contrats)",
-                    data=corrected_xml,
-                    file_name=original_filename,
-                    mime="application/xml",
-                    type="primary",
-                    use_container_width=True
+                offer_download(
+                    corrected_xml, original_filename, f"📥 Télécharger le XML corrigé ({len(commandes_trouvees)} contrats)"
                 )
                 
                 st.info(f"💾 Le fichier téléchargé aura le même nom : `{original_filename}`")
@@ -368,7 +877,7 @@ if uploaded_file is not None:
                 st.exception(e)
 
 else:
-    st.info("👆 Uploadez votre fichier XML pour démarrer le traitement automatique multi-commandes")
+    st.info("👆 Uploadez un ou plusieurs fichiers XML pour démarrer le traitement automatique multi-commandes")
 
 # ============================================================================
 # FOOTER
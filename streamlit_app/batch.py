@@ -0,0 +1,398 @@
+"""
+VERALLIA Modificator - Correction en lot (ligne de commande)
+Corrige des répertoires entiers de fichiers XML Osmose en parallèle
+
+Usage:
+    python batch.py exports/ -o corriges/ -j 8
+    python batch.py "exports/*.xml" --in-place
+    python batch.py exports/ -o corriges/ --incremental
+    python batch.py exports/ -o corriges/ --validate
+"""
+
+import argparse
+import glob
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import compaction
+import history
+import incremental
+import metrics
+import result_cache
+import rules
+import shards
+import snapshot
+from metrics import METRICS
+import streaming
+import validation
+from matching import OrderMatcher
+from order_db import FIELDS as DB_FIELDS, OrderDB
+from order_store import build_order_index
+
+
+# ============================================================================
+# CONFIGURATION
+# ============================================================================
+
+DEFAULT_COMMANDES = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), '..', 'data', 'commandes_extraites.json'
+)
+
+
+# ============================================================================
+# CHARGEMENT DES COMMANDES
+# ============================================================================
+
+def load_commandes(source: str) -> list:
+    """
+    Charge commandes_extraites.json depuis un chemin local ou une URL
+
+    Une URL passe par le cache local (snapshot) : revalidation
+    conditionnelle, et dernière copie valide si la source est injoignable.
+
+    Returns:
+        Liste brute des commandes
+    """
+    if source.startswith(('http://', 'https://')):
+        cache = snapshot.SnapshotCache(source)
+        cache.refresh()
+        commandes = cache.load()
+        if commandes is None:
+            raise RuntimeError(f"Commandes indisponibles : {cache.last_error}")
+        if cache.last_error:
+            print(f"⚠️ {cache.last_error} — copie locale du {cache.fetched_at} utilisée", file=sys.stderr)
+        return commandes
+
+    with open(source, 'rb') as f:
+        return snapshot.parse_commandes(f.read())
+
+
+def commandes_version(source: str) -> str:
+    """Version de la base de commandes (hash SHA-256 du contenu, comme l'application)"""
+    if source.startswith(('http://', 'https://')):
+        return snapshot.SnapshotCache(source).version
+    with open(source, 'rb') as f:
+        return result_cache.sha256_file(f)
+
+
+def build_corrections_map(commandes: list) -> OrderMatcher:
+    """
+    Mapping {numero_commande: {codePoste, codeCycle}} pour les workers
+    (champs des règles actives, voir rules.order_values)
+
+    Les numéros des fichiers sont rapprochés par clé normalisée (zéros en
+    tête) et par numeroContrat (voir matching.py). Les commandes supprimées
+    (emails « Suppression de Commande ») n'y figurent pas.
+    """
+    index = build_order_index(compaction.compact(commandes).commandes)
+    return OrderMatcher.from_commandes(index, rules.order_values)
+
+
+def load_corrections_db(db_path: str) -> OrderMatcher:
+    """
+    Même mapping que build_corrections_map, depuis une base compilée .vmdb
+    (déjà compactée : une commande par numéro)
+
+    Les champs absents du format (order_db.FIELDS) sont omis : les règles
+    qui les lisent laissent leur balise telle quelle.
+    """
+    def value(commande: dict) -> dict:
+        return {field: v for field, v in rules.order_values(commande).items() if field in DB_FIELDS}
+
+    with OrderDB.open(db_path) as db:
+        records = db.records()
+    return OrderMatcher.from_commandes({c['numeroCommande']: c for c in records}, value)
+
+
+# ============================================================================
+# FICHIERS À TRAITER
+# ============================================================================
+
+def collect_input_files(inputs: list) -> list:
+    """
+    Résout les entrées (fichiers, répertoires, motifs glob) en
+    (chemin, chemin_relatif) triés et dédoublonnés
+    """
+    files = {}
+    for item in inputs:
+        if os.path.isdir(item):
+            for dirpath, _, filenames in os.walk(item):
+                for name in filenames:
+                    if name.lower().endswith('.xml'):
+                        path = os.path.join(dirpath, name)
+                        files[os.path.abspath(path)] = os.path.relpath(path, item)
+        elif os.path.isfile(item):
+            files[os.path.abspath(item)] = os.path.basename(item)
+        else:
+            for path in glob.glob(item, recursive=True):
+                if os.path.isfile(path):
+                    files[os.path.abspath(path)] = os.path.basename(path)
+    return sorted(files.items())
+
+
+# ============================================================================
+# WORKERS
+# ============================================================================
+
+_corrections_map = None
+_manifests = None
+_patch = True
+_validate = False
+_changes = False
+
+
+def _init_worker(corrections_map: dict, db_path: str = None, manifest_dir: str = None,
+                 patch: bool = True, validate: bool = False, changes: bool = False):
+    global _corrections_map, _manifests, _patch, _validate, _changes
+    # Une base compilée est lue par chaque worker plutôt que sérialisée
+    # vers lui, puis indexée comme le JSON (numéros normalisés, contrats)
+    _corrections_map = load_corrections_db(db_path) if db_path else corrections_map
+    _manifests = incremental.ManifestStore(manifest_dir) if manifest_dir else None
+    _patch = patch
+    _validate = validate
+    _changes = changes
+
+
+def correct_file(source: str, destination: str, workers: int = 1) -> dict:
+    """
+    Corrige un fichier XML (exécuté dans un worker, ou dans le processus
+    principal avec workers > 1 : le fichier est alors réparti par portions
+    entre workers processus, voir shards.py)
+
+    La sortie est écrite dans un fichier temporaire du répertoire cible puis
+    renommée : un fichier corrigé n'est jamais laissé à moitié écrit, et
+    l'original peut être remplacé sur place. Le fichier corrigé reprend les
+    droits de la source.
+
+    En mode incrémental, si le fichier corrigé et sa source n'ont pas bougé
+    depuis le passage précédent, seuls les contrats des commandes modifiées
+    sont réécrits, à partir du fichier déjà corrigé ; sans commande
+    modifiée, le fichier n'est pas réécrit du tout.
+    """
+    started = time.perf_counter()
+    # Mesures de ce fichier seulement, fusionnées ensuite par le processus principal
+    METRICS.reset()
+    result = {
+        'source': source,
+        'destination': destination,
+        'size': os.path.getsize(source),
+        'error': None,
+    }
+    if _changes:
+        # Avant correction : en mode --in-place, la source est remplacée
+        with open(source, 'rb') as f:
+            result['inputSha256'] = result_cache.sha256_file(f)
+        result['startedAt'] = history.now()
+
+    manifest = None
+    if _manifests is not None:
+        manifest = _manifests.load(destination)
+        if manifest is not None and (
+            not os.path.exists(destination)
+            or manifest.source != incremental.fingerprint(source)
+            or manifest.destination != incremental.fingerprint(destination)
+        ):
+            manifest = None
+        if manifest is not None and not manifest.dirty_orders(_corrections_map):
+            result.update(manifest.unchanged_stats(_corrections_map))
+            METRICS.incr('files', result='skipped')
+            METRICS.incr('assignments', manifest.assignments, result='ignored')
+            result['duration'] = time.perf_counter() - started
+            result['metrics'] = METRICS.snapshot()
+            return result
+
+    os.makedirs(os.path.dirname(destination) or '.', exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(suffix='.xml.tmp', dir=os.path.dirname(destination) or '.')
+    try:
+        with os.fdopen(fd, 'wb') as output:
+            if _manifests is None and _patch:
+                stats = shards.correct_document(source, output, _corrections_map, workers, validate=_validate,
+                                                 changes=_changes)
+            elif _manifests is None:
+                stats = streaming.correct_stream(source, output, _corrections_map, validate=_validate,
+                                                changes=_changes)
+            else:
+                # Le fichier déjà corrigé sert de base : les contrats des
+                # commandes inchangées y sont déjà à jour
+                stats, new_manifest = incremental.correct_incremental(
+                    destination if manifest is not None else source,
+                    output, _corrections_map, manifest, patch=_patch, validate=_validate, changes=_changes,
+                )
+        # mkstemp crée le fichier en 0600 : la sortie reprend les droits de la source
+        shutil.copymode(source, tmp_path)
+        os.replace(tmp_path, destination)
+        result.update(stats)
+    except Exception as e:
+        os.unlink(tmp_path)
+        result['error'] = str(e)
+        METRICS.incr('files', result='error')
+    else:
+        if _manifests is not None:
+            new_manifest.source = incremental.fingerprint(source)
+            new_manifest.destination = incremental.fingerprint(destination)
+            _manifests.save(destination, new_manifest)
+
+    result['duration'] = time.perf_counter() - started
+    result['metrics'] = METRICS.snapshot()
+    return result
+
+
+# ============================================================================
+# POINT D'ENTRÉE
+# ============================================================================
+
+def print_result(result: dict):
+    if result['error']:
+        print(f"❌ {result['source']} : {result['error']}")
+        return
+    print(
+        f"✅ {result['source']} → {result['destination']} : "
+        f"{result['contratsCorriges']}/{result['assignments']} contrats, "
+        f"{result['contratsIgnores']} ignorés, "
+        f"{result['corrections']} modifications, "
+        f"{len(result['commandesManquantes'])} commandes manquantes "
+        f"({result['duration']:.2f}s)"
+    )
+    if result.get('violations'):
+        first = result['violations'][0]
+        print(f"   🧪 {len(result['violations'])} écarts HR-XML, dont {first['path']} : {first['message']}")
+
+
+def record_history(store: history.HistoryStore, result: dict, version: str):
+    """Enregistre un fichier corrigé dans l'historique (fichiers sautés ou en erreur exclus)"""
+    # Le rapport n'est plus utile ensuite : libéré au fil du lot
+    changes = result.pop('changes', None)
+    if result['error'] or changes is None:
+        return
+    try:
+        store.record(os.path.basename(result['source']), result['inputSha256'], version, result,
+                     changes, result['startedAt'], origin=history.ORIGIN_BATCH)
+    except sqlite3.Error as e:
+        print(f"⚠️ Historique non enregistré pour {result['source']} : {e}", file=sys.stderr)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Corrige en lot les fichiers XML Osmose (CustomerJobCode et cycle horaire)"
+    )
+    parser.add_argument('inputs', nargs='+', help="Fichiers, répertoires ou motifs glob")
+    target = parser.add_mutually_exclusive_group(required=True)
+    target.add_argument('-o', '--output', help="Répertoire de sortie (arborescence conservée)")
+    target.add_argument('--in-place', action='store_true', help="Remplace les fichiers originaux")
+    parser.add_argument('-j', '--workers', type=int, default=os.cpu_count() or 1,
+                        help="Nombre de processus (défaut : nombre de cœurs)")
+    parser.add_argument('--commandes', default=DEFAULT_COMMANDES,
+                        help="Chemin ou URL de commandes_extraites.json, ou base compilée .vmdb")
+    parser.add_argument('--incremental', action='store_true',
+                        help="Ne retouche que les contrats dont la commande a changé depuis le dernier passage")
+    parser.add_argument('--manifests', default=incremental.DEFAULT_MANIFEST_DIR,
+                        help="Répertoire des manifestes du mode incrémental")
+    parser.add_argument('--lxml', action='store_true',
+                        help="Re-sérialise tout le document avec lxml au lieu de patcher les octets modifiés")
+    parser.add_argument('--validate', action='store_true',
+                        help="Vérifie les contrats corrigés (règles HR-XML de validation.py) pendant la correction")
+    parser.add_argument('--metrics', help="Fichier où écrire les mesures (format texte Prometheus)")
+    parser.add_argument('--history', nargs='?', const=history.DEFAULT_HISTORY_PATH, metavar='FICHIER',
+                        help="Enregistre les contrats corrigés dans l'historique SQLite (history.py)")
+    return parser.parse_args(argv)
+
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+
+    files = collect_input_files(args.inputs)
+    if not files:
+        print("❌ Aucun fichier XML trouvé", file=sys.stderr)
+        return 1
+
+    corrections_map, db_path = None, None
+    try:
+        if args.commandes.endswith('.vmdb'):
+            db_path = args.commandes
+            with OrderDB.open(db_path) as db:
+                count = len(db)
+        else:
+            corrections_map = build_corrections_map(load_commandes(args.commandes))
+            count = len(corrections_map)
+        version = commandes_version(args.commandes) if args.history else None
+    except Exception as e:
+        print(f"❌ {e}", file=sys.stderr)
+        return 1
+    print(f"📋 {count} commandes chargées, {len(files)} fichiers à traiter")
+
+    jobs = []
+    for path, relative in files:
+        destination = path if args.in_place else os.path.join(args.output, relative)
+        jobs.append((path, destination))
+
+    started = time.perf_counter()
+    results = []
+    store = history.HistoryStore(args.history) if args.history else None
+    initargs = (corrections_map, db_path, args.manifests if args.incremental else None, not args.lxml, args.validate,
+                store is not None)
+    if len(jobs) == 1 and args.workers > 1:
+        # Un seul fichier : ses blocs <Assignment> sont répartis entre les
+        # processus (shards.py). correct_file remet METRICS à zéro : les
+        # mesures déjà prises (chargement des commandes) sont reportées
+        _init_worker(*initargs)
+        before = METRICS.snapshot()
+        result = correct_file(*jobs[0], workers=args.workers)
+        METRICS.reset()
+        METRICS.merge(before)
+        METRICS.merge(result.pop('metrics'))
+        results.append(result)
+        print_result(result)
+        if store is not None:
+            record_history(store, result, version)
+    else:
+        with ProcessPoolExecutor(max_workers=max(1, args.workers), initializer=_init_worker,
+                                 initargs=initargs) as pool:
+            futures = [pool.submit(correct_file, source, destination) for source, destination in jobs]
+            for future in as_completed(futures):
+                result = future.result()
+                results.append(result)
+                METRICS.merge(result.pop('metrics'))
+                print_result(result)
+                if store is not None:
+                    record_history(store, result, version)
+    elapsed = time.perf_counter() - started
+
+    failed = [r for r in results if r['error']]
+    if args.incremental:
+        done = [r for r in results if not r['error']]
+        print(
+            f"\n♻️ Mode incrémental : {sum(r['contratsCorriges'] for r in done)} contrats réécrits, "
+            f"{sum(r['contratsIgnores'] for r in done)} ignorés"
+        )
+    if args.validate:
+        # Fichiers sautés en mode incrémental : non revérifiés
+        counts = validation.summarize([v for r in results for v in r.get('violations') or []])
+        print(
+            f"\n🧪 Validation : {sum(counts.values())} écarts HR-XML"
+            + (" — " + ", ".join(f"{rule} × {count}" for rule, count in sorted(counts.items())) if counts else "")
+        )
+    total_mb = sum(r['size'] for r in results) / (1024 * 1024)
+    print(
+        f"\n📊 {len(results) - len(failed)}/{len(results)} fichiers corrigés en {elapsed:.2f}s "
+        f"— {len(results) / elapsed:.1f} fichiers/s, {total_mb / elapsed:.1f} Mo/s"
+    )
+
+    if args.metrics:
+        # Durées cumulées sur tous les workers
+        stages = METRICS.snapshot()['stages']
+        if stages:
+            print("⏱️ " + ", ".join(
+                f"{stage} {stages[stage][1]:.2f}s" for stage in metrics.STAGES if stage in stages
+            ))
+        METRICS.write_prometheus(args.metrics)
+        print(f"💾 Mesures écrites dans {args.metrics}")
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
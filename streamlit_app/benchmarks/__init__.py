@@ -0,0 +1,4 @@
+"""
+VERALLIA Modificator - Benchmarks
+À lancer depuis streamlit_app/ : python -m benchmarks.<module>
+"""
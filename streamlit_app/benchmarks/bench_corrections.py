@@ -0,0 +1,232 @@
+"""
+Benchmark des chemins critiques de correction XML
+
+Mesure, pour des fichiers synthétiques de 1 à 100 000 contrats, le temps
+(wall), le pic de mémoire (RSS) et le coût par contrat de :
+parse_xml, get_contract_info, update_customer_job_code,
+update_cycle_horaire, apply_corrections et apply_corrections_multi.
+
+Chaque mesure tourne dans un processus neuf pour que le pic RSS ne soit pas
+pollué par les mesures précédentes. Les résultats sont écrits en JSON pour
+comparer deux versions (--compare).
+
+Usage (depuis streamlit_app/):
+    python -m benchmarks.bench_corrections --output bench.json
+    python -m benchmarks.bench_corrections --sizes 1 1000 --compare bench.json
+"""
+
+import argparse
+import contextlib
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+from benchmarks import xmlgen
+
+
+# ============================================================================
+# CONFIGURATION
+# ============================================================================
+
+DEFAULT_SIZES = [1, 10, 100, 1000, 10000, 100000]
+
+FUNCTIONS = [
+    'parse_xml',
+    'get_contract_info',
+    'update_customer_job_code',
+    'update_cycle_horaire',
+    'apply_corrections',
+    'apply_corrections_multi',
+]
+
+CODE_POSTE = '4FACO2'
+CODE_CYCLE = 'VA EQUIPE B 5X8'
+
+
+# ============================================================================
+# MESURE (PROCESSUS ENFANT)
+# ============================================================================
+
+def _peak_rss_kb() -> int:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss est en octets sur macOS, en Ko ailleurs
+    return peak // 1024 if sys.platform == 'darwin' else peak
+
+
+def _prepare(function: str, path: str):
+    """Prépare les entrées (hors mesure) et retourne l'appel à chronométrer"""
+    import utils
+    import streaming
+
+    with open(path, 'rb') as f:
+        data = f.read()
+
+    if function == 'parse_xml':
+        return lambda: utils.parse_xml(data)
+    if function == 'apply_corrections':
+        return lambda: utils.apply_corrections(data, CODE_POSTE, CODE_CYCLE)
+    if function == 'apply_corrections_multi':
+        numeros = [f'{n:06d}' for n in range(1800, 2400)]
+        commandes_map = {n: {'codePoste': CODE_POSTE, 'codeCycle': CODE_CYCLE} for n in numeros}
+        return lambda: streaming.apply_corrections_multi(data, commandes_map)
+
+    # Fonctions opérant sur un arbre déjà parsé : un arbre neuf par appel
+    # pour que les mises à jour ne deviennent pas des no-op
+    target = {
+        'get_contract_info': utils.get_contract_info,
+        'update_customer_job_code': lambda tree: utils.update_customer_job_code(tree, CODE_POSTE),
+        'update_cycle_horaire': lambda tree: utils.update_cycle_horaire(tree, CODE_CYCLE),
+    }[function]
+    trees = []
+    used = []
+
+    def call():
+        tree = trees.pop() if trees else utils.parse_xml(data)
+        target(tree)
+        # Garder l'arbre en vie : sa libération ne fait pas partie de la mesure
+        used.append(tree)
+
+    def refill(count):
+        trees.extend(utils.parse_xml(data) for _ in range(count))
+
+    call.refill = refill
+    return call
+
+
+def run_case(function: str, path: str, repeat: int) -> dict:
+    """Exécute une mesure dans le processus courant (processus enfant)"""
+    call = _prepare(function, path)
+    if hasattr(call, 'refill'):
+        call.refill(repeat)
+    baseline = _peak_rss_kb()
+
+    timings = []
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        for _ in range(repeat):
+            started = time.perf_counter()
+            call()
+            timings.append(time.perf_counter() - started)
+
+    return {
+        'wall_min_s': min(timings),
+        'wall_median_s': statistics.median(timings),
+        'peak_rss_kb': _peak_rss_kb(),
+        'peak_rss_delta_kb': _peak_rss_kb() - baseline,
+    }
+
+
+# ============================================================================
+# ORCHESTRATION
+# ============================================================================
+
+def _repeat_for(size: int) -> int:
+    return max(1, min(20, 2000 // size))
+
+
+def _metadata() -> dict:
+    from lxml import etree
+
+    try:
+        revision = subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        revision = None
+
+    return {
+        'date': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+        'revision': revision,
+        'python': platform.python_version(),
+        'lxml': '.'.join(map(str, etree.LXML_VERSION)),
+        'platform': platform.platform(),
+    }
+
+
+def run_benchmarks(sizes: list, functions: list, workdir: str) -> list:
+    context = multiprocessing.get_context('spawn')
+    results = []
+
+    for size in sizes:
+        path = os.path.join(workdir, f'export_{size}.xml')
+        with open(path, 'wb') as f:
+            file_size = xmlgen.generate(f, size)
+
+        for function in functions:
+            repeat = _repeat_for(size)
+            with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+                measure = pool.submit(run_case, function, path, repeat).result()
+
+            result = {
+                'function': function,
+                'assignments': size,
+                'file_bytes': file_size,
+                'repeat': repeat,
+                **measure,
+                'per_assignment_us': measure['wall_min_s'] / size * 1e6,
+            }
+            results.append(result)
+            print(
+                f"{function:<26}{size:>8}{measure['wall_min_s'] * 1000:>12.2f}"
+                f"{result['per_assignment_us']:>14.2f}{measure['peak_rss_kb'] / 1024:>12.1f}"
+                f"{measure['peak_rss_delta_kb'] / 1024:>12.1f}",
+                flush=True,
+            )
+    return results
+
+
+def compare(results: list, baseline_path: str):
+    """Affiche le ratio de temps (courant / référence) par mesure"""
+    with open(baseline_path, 'r', encoding='utf-8') as f:
+        baseline = json.load(f)
+    reference = {(r['function'], r['assignments']): r for r in baseline['results']}
+
+    print(f"\nComparaison avec {baseline_path} (révision {baseline['meta'].get('revision')})")
+    print(f"{'fonction':<26}{'contrats':>8}{'réf ms':>12}{'actuel ms':>12}{'ratio':>8}")
+    for r in results:
+        ref = reference.get((r['function'], r['assignments']))
+        if ref is None:
+            continue
+        ratio = r['wall_min_s'] / ref['wall_min_s'] if ref['wall_min_s'] else float('inf')
+        flag = '  ⚠️' if ratio > 1.2 else ''
+        print(
+            f"{r['function']:<26}{r['assignments']:>8}{ref['wall_min_s'] * 1000:>12.2f}"
+            f"{r['wall_min_s'] * 1000:>12.2f}{ratio:>8.2f}{flag}"
+        )
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark des fonctions de correction XML")
+    parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES,
+                        help="Nombres de contrats à générer")
+    parser.add_argument('--functions', nargs='+', choices=FUNCTIONS, default=FUNCTIONS)
+    parser.add_argument('--output', help="Fichier JSON de résultats")
+    parser.add_argument('--compare', help="Résultats JSON de référence")
+    args = parser.parse_args(argv)
+
+    print(f"{'fonction':<26}{'contrats':>8}{'wall ms':>12}{'µs/contrat':>14}{'RSS Mo':>12}{'Δ RSS Mo':>12}")
+    with tempfile.TemporaryDirectory() as workdir:
+        results = run_benchmarks(args.sizes, args.functions, workdir)
+
+    report = {'meta': _metadata(), 'results': results}
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+        print(f"\n💾 Résultats écrits dans {args.output}")
+
+    if args.compare:
+        compare(results, args.compare)
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
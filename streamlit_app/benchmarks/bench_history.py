@@ -0,0 +1,198 @@
+"""
+Benchmark : historique des corrections (history.py)
+
+Remplit une base SQLite neuve de corrections synthétiques (contrats
+corrigés répartis sur plusieurs jours, commandes de popularité inégale)
+en mesurant le débit d'écriture au fil de la croissance, puis mesure la
+latence d'une page de recherche par filtre (aucun, commande, contrat,
+jour), en tête de résultats et en profondeur : pagination par curseur
+(HistoryStore.search) contre LIMIT / OFFSET. Vérifie au passage que les
+deux paginations renvoient les mêmes lignes.
+
+Usage (depuis streamlit_app/):
+    python -m benchmarks.bench_history
+    python -m benchmarks.bench_history --rows 5000000 --run-size 20000
+"""
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+from contextlib import closing
+from datetime import date, datetime, timedelta
+
+import history
+
+
+ORDERS = 2000
+DAYS = 60
+
+
+# ============================================================================
+# DONNÉES
+# ============================================================================
+
+def synthetic_changes(first_contract: int, count: int, rng: random.Random) -> list:
+    """Contrats corrigés : quelques commandes très fréquentes, beaucoup de rares"""
+    changes = []
+    for i in range(count):
+        numero = f'{int(rng.paretovariate(1.2)) % ORDERS:06d}'
+        changes.append({
+            'assignment': i + 1,
+            'numeroCommande': numero,
+            'numeroContrat': f'C{first_contract + i:08d}',
+            'numeroCommandeExterne': f'E{numero}',
+            'codePosteAvant': 'OLD',
+            'customerJobCodeAvant': 'OLD',
+            'customerJobCodeApres': '4FACO2',
+            'cycleAvant': '35H',
+            'cycleApres': 'VA EQUIPE B 5X8',
+            'statut': 'corrigé',
+        })
+    return changes
+
+
+def fill(store: history.HistoryStore, rows: int, run_size: int, seed: int = 0) -> list:
+    """
+    Écrit rows contrats en corrections de run_size contrats
+
+    Returns:
+        Liste de (lignes en base, lignes/s de la dernière tranche)
+    """
+    rng = random.Random(seed)
+    start = datetime(2026, 1, 1, 8)
+    step = timedelta(days=DAYS) / max(1, rows // run_size)
+    progress = []
+    written, window_rows, window_started = 0, 0, time.perf_counter()
+    report_every = max(run_size, rows // 10)
+    while written < rows:
+        count = min(run_size, rows - written)
+        changes = synthetic_changes(written, count, rng)
+        finished_at = (start + step * (written // run_size)).strftime(history.TIMESTAMP_FORMAT)
+        store.record(f'export_{written // run_size:05d}.xml', f'{written:064x}', 'v1',
+                     {'assignments': count, 'contratsCorriges': count, 'corrections': count * 2},
+                     changes, origin=history.ORIGIN_BATCH, finished_at=finished_at)
+        written += count
+        window_rows += count
+        if written % report_every < run_size or written == rows:
+            elapsed = time.perf_counter() - window_started
+            progress.append((written, window_rows / elapsed))
+            window_rows, window_started = 0, time.perf_counter()
+    return progress
+
+
+# ============================================================================
+# MESURE
+# ============================================================================
+
+def _where(filters: dict) -> tuple:
+    conditions, parameters = [], []
+    for column, key in (('numeroCommande', 'numero_commande'), ('numeroContrat', 'numero_contrat')):
+        if filters.get(key):
+            conditions.append(f'c.{column} = ?')
+            parameters.append(filters[key])
+    if filters.get('since'):
+        conditions.append('c.correctedAt >= ?')
+        parameters.append(filters['since'].isoformat())
+    if filters.get('until'):
+        conditions.append('c.correctedAt < ?')
+        parameters.append((filters['until'] + timedelta(days=1)).isoformat())
+    return ('WHERE ' + ' AND '.join(conditions) if conditions else ''), parameters
+
+
+def offset_page(store: history.HistoryStore, filters: dict, offset: int, limit: int) -> list:
+    """Même page qu'avec le curseur, en LIMIT / OFFSET (référence)"""
+    where, parameters = _where(filters)
+    query = (f"SELECT c.id FROM changes c JOIN runs r ON r.id = c.run {where} "
+             f"ORDER BY c.correctedAt DESC, c.id DESC LIMIT ? OFFSET ?")
+    with closing(store._connect()) as connection:
+        return [row[0] for row in connection.execute(query, [*parameters, limit, offset])]
+
+
+def count_matches(store: history.HistoryStore, filters: dict) -> int:
+    where, parameters = _where(filters)
+    with closing(store._connect()) as connection:
+        return connection.execute(f"SELECT COUNT(*) FROM changes c {where}", parameters).fetchone()[0]
+
+
+def cursor_at(store: history.HistoryStore, filters: dict, offset: int) -> tuple:
+    """Curseur de la page commençant à offset (obtenu sans parcourir les pages précédentes)"""
+    if not offset:
+        return None
+    ids = offset_page(store, filters, offset - 1, 1)
+    if not ids:
+        return None
+    with closing(store._connect()) as connection:
+        corrected_at = connection.execute('SELECT correctedAt FROM changes WHERE id = ?', ids).fetchone()[0]
+    return corrected_at, ids[0]
+
+
+def best(run, repeat: int = 5) -> float:
+    durations = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        run()
+        durations.append(time.perf_counter() - started)
+    return min(durations)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--rows', type=int, default=1000000, help="Contrats corrigés écrits dans l'historique")
+    parser.add_argument('--run-size', type=int, default=5000, help="Contrats par correction")
+    parser.add_argument('--db', help="Base existante à réutiliser (sinon base temporaire)")
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = args.db or os.path.join(tmp, 'history.sqlite3')
+        store = history.HistoryStore(path)
+        if not os.path.exists(path) or not store.runs(limit=1):
+            started = time.perf_counter()
+            progress = fill(store, args.rows, args.run_size)
+            elapsed = time.perf_counter() - started
+            print(f"📦 {args.rows} contrats en {args.rows // args.run_size} corrections : {elapsed:.1f}s, "
+                  f"{args.rows / elapsed:,.0f} lignes/s, {os.path.getsize(path) / (1024 * 1024):.0f} Mo")
+            print("✍️ débit d'écriture : " + ", ".join(f"{rows // 1000}k → {rate / 1000:.0f}k/s"
+                                                        for rows, rate in progress))
+
+        with closing(store._connect()) as connection:
+            total, first_day, popular = connection.execute(
+                "SELECT COUNT(*), MIN(correctedAt), "
+                "(SELECT numeroCommande FROM changes GROUP BY numeroCommande ORDER BY COUNT(*) DESC LIMIT 1) "
+                "FROM changes"
+            ).fetchone()
+            contract = connection.execute('SELECT numeroContrat FROM changes WHERE id = ?',
+                                          (total // 2,)).fetchone()[0]
+        day = date.fromisoformat(first_day[:10]) + timedelta(days=DAYS // 2)
+        scenarios = {
+            'aucun filtre': {},
+            f'commande {popular}': {'numero_commande': popular},
+            f'contrat {contract}': {'numero_contrat': contract},
+            f'jour {day}': {'since': day, 'until': day},
+        }
+
+        ok = True
+        limit = history.PAGE_SIZE
+        print(f"\n{'':<28}{'lignes':>9}{'page 1':>9}{'profondeur':>12}{'curseur':>10}{'OFFSET':>10}")
+        for label, filters in scenarios.items():
+            matches = count_matches(store, filters)
+            depth = max(0, (matches - 1) // limit * limit)
+            cursor = cursor_at(store, filters, depth)
+            rows, _ = store.search(cursor=cursor, limit=limit, **filters)
+            if [row['id'] for row in rows] != offset_page(store, filters, depth, limit):
+                print(f"❌ {label} : pages différentes (curseur / OFFSET) à la ligne {depth}")
+                ok = False
+            first = best(lambda: store.search(limit=limit, **filters))
+            deep = best(lambda: store.search(cursor=cursor, limit=limit, **filters))
+            offset = best(lambda: offset_page(store, filters, depth, limit), repeat=3)
+            print(f"⏱️ {label:<26}{matches:>9}{first * 1000:>7.2f}ms{depth:>12}"
+                  f"{deep * 1000:>8.2f}ms{offset * 1000:>8.1f}ms")
+
+    print("\n✅ Curseur ≡ OFFSET" if ok else "\n❌ Écarts détectés")
+    return 0 if ok else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,201 @@
+"""
+Benchmark : ingestion des emails de commande (ingest.py)
+
+Reconstitue des emails Pixid (.eml et mbox au format Google Takeout) à
+partir des enregistrements de commandes_extraites.json, multipliés jusqu'au
+nombre demandé (corps texte, HTML, quoted-printable ou base64), puis :
+- ingestion complète séquentielle et parallèle (emails/s) ;
+- comparaison des champs extraits avec les enregistrements d'origine ;
+- ingestion incrémentale après ajout de nouveaux emails, et sans nouveauté.
+Le code de sortie est non nul si un champ extrait diffère.
+
+Usage (depuis streamlit_app/):
+    python -m benchmarks.bench_ingest
+    python -m benchmarks.bench_ingest --emails 20000 -j 8
+"""
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime
+from email.message import EmailMessage
+from email.utils import format_datetime
+
+import ingest
+from benchmarks.bench_matching import DEFAULT_JSON
+from snapshot import parse_commandes
+
+
+# Champs comparés aux enregistrements d'origine
+COMPARED = ('numeroCommande', 'codeCycle', 'dateDebut', 'dateExtraction', 'emailSubject', 'emailId')
+
+BODY = (
+    "Bonjour,\n\n"
+    "{intro}\n\n"
+    "{numero}"
+    "Client : VERALLIA France\n"
+    "Code poste : {code_poste}\n"
+    "{date_debut}"
+    "Cycle horaire : {code_cycle}\n\n"
+    "Cordialement,\n"
+    "La plateforme Pixid\n"
+)
+
+HTML_BODY = (
+    "<html><head><style>td {{ padding: 2px; }}</style></head><body>"
+    "<p>Bonjour,</p><p>{intro}</p><table>"
+    "{numero}"
+    "<tr><td>Code poste :</td><td>{code_poste}</td></tr>"
+    "{date_debut}"
+    "<tr><td>Cycle horaire :</td><td>{code_cycle}</td></tr>"
+    "</table><p>Cordialement,<br>La plateforme Pixid</p></body></html>"
+)
+
+
+# ============================================================================
+# GÉNÉRATION
+# ============================================================================
+
+def variants(commandes: list, count: int) -> list:
+    """count enregistrements : ceux d'origine, puis des copies aux emailId distincts"""
+    result = []
+    for i in range(count):
+        commande = dict(commandes[i % len(commandes)])
+        copy = i // len(commandes)
+        if copy:
+            commande['emailId'] = format(int(commande['emailId'], 16) + copy * 7919, 'x')
+        result.append(commande)
+    return result
+
+
+def make_message(commande: dict, rng: random.Random) -> EmailMessage:
+    message = EmailMessage()
+    message['From'] = commande['emailFrom']
+    message['To'] = 'commandes@randstad.fr'
+    message['Subject'] = commande['emailSubject']
+    date = datetime.strptime(commande['dateExtraction'], '%Y-%m-%d %H:%M:%S').astimezone()
+    message['Date'] = format_datetime(date)
+    message['Message-ID'] = f"<{commande['emailId']}@pixid.fr>"
+
+    values = {
+        'intro': "Une nouvelle demande a été émise sur la plateforme Pixid.",
+        'code_poste': commande['codePoste'],
+        'code_cycle': commande['codeCycle'],
+    }
+    kind = rng.random()
+    if kind < 0.3:
+        row = "<tr><td>{}</td><td>{}</td></tr>"
+        values['numero'] = row.format("N° de commande :", commande['numeroCommande']) if commande['numeroCommande'] else ''
+        values['date_debut'] = row.format("Date de début :", commande['dateDebut']) if commande['dateDebut'] else ''
+        message.set_content(HTML_BODY.format(**values), subtype='html', cte='quoted-printable')
+    else:
+        values['numero'] = f"N° de commande : {commande['numeroCommande']}\n" if commande['numeroCommande'] else ''
+        values['date_debut'] = f"Date de début : {commande['dateDebut']}\n" if commande['dateDebut'] else ''
+        message.set_content(BODY.format(**values), cte='base64' if kind < 0.5 else 'quoted-printable')
+    return message
+
+
+def write_eml(directory: str, commandes: list, seed: int = 0):
+    rng = random.Random(seed)
+    os.makedirs(directory, exist_ok=True)
+    for commande in commandes:
+        with open(os.path.join(directory, f"{commande['emailId']}.eml"), 'wb') as f:
+            f.write(bytes(make_message(commande, rng)))
+
+
+def write_mbox(path: str, commandes: list, seed: int = 0, mode: str = 'wb'):
+    rng = random.Random(seed)
+    with open(path, mode) as f:
+        for commande in commandes:
+            date = datetime.strptime(commande['dateExtraction'], '%Y-%m-%d %H:%M:%S')
+            f.write(f"From {int(commande['emailId'], 16)}@xxx {date:%a %b %d %H:%M:%S +0000 %Y}\n".encode())
+            data = bytes(make_message(commande, rng)).replace(b'\r\n', b'\n')
+            f.write(data.replace(b'\nFrom ', b'\n>From '))
+            f.write(b'\n')
+
+
+# ============================================================================
+# MESURES
+# ============================================================================
+
+def compare(store_path: str, commandes: list, eml: bool) -> int:
+    """Nombre d'enregistrements ingérés différents de l'original"""
+    expected = {}
+    for commande in commandes:
+        email_id = ingest.hash_id(f"<{commande['emailId']}@pixid.fr>".encode()) if eml else commande['emailId']
+        expected[email_id] = dict(commande, emailId=email_id)
+    ingested = {record['emailId']: record for record in ingest.IngestStore(store_path).commandes}
+    errors = 0
+    for email_id, commande in expected.items():
+        record = ingested.get(email_id)
+        fields = [f for f in COMPARED if record is None or record.get(f) != commande.get(f)]
+        # Commandes : code poste du corps (consultations : celui du sujet)
+        if record is not None and commande['numeroCommande'] and record['codePoste'] != commande['codePoste']:
+            fields.append('codePoste')
+        if fields:
+            errors += 1
+            if errors <= 5:
+                print(f"   ❌ {email_id} : {', '.join(fields)}")
+    return errors
+
+
+def run(label: str, inputs: list, store_path: str, workers: int, expected_new: int = None, full: bool = False):
+    started = time.perf_counter()
+    totals = ingest.ingest(inputs, store_path, workers=workers, full=full)
+    elapsed = time.perf_counter() - started
+    rate = f"{totals['lus'] / elapsed:8.0f} emails/s" if totals['lus'] else " " * 17
+    print(f"⏱️ {label:<34}{elapsed:7.2f}s {rate}  {totals['nouveaux']:>6} nouveaux / {totals['lus']} lus")
+    if expected_new is not None and totals['nouveaux'] != expected_new:
+        print(f"   ❌ {expected_new} nouveaux attendus")
+        return False
+    return True
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--json', default=DEFAULT_JSON)
+    parser.add_argument('--emails', type=int, default=10000, help="Nombre d'emails générés")
+    parser.add_argument('-j', '--workers', type=int, default=os.cpu_count() or 1)
+    args = parser.parse_args(argv)
+
+    with open(args.json, 'rb') as f:
+        originals = parse_commandes(f.read())
+    everything = variants(originals, args.emails + args.emails // 10)
+    commandes, extra = everything[:args.emails], everything[args.emails:]
+
+    ok = True
+    with tempfile.TemporaryDirectory() as tmp:
+        emails_dir = os.path.join(tmp, 'emails')
+        mbox = os.path.join(tmp, 'Pixid.mbox')
+        started = time.perf_counter()
+        write_eml(emails_dir, commandes)
+        write_mbox(mbox, commandes)
+        print(f"📦 {len(commandes)} emails (.eml et mbox) générés en {time.perf_counter() - started:.1f}s")
+
+        for source, eml in ((emails_dir, True), (mbox, False)):
+            name = '.eml' if eml else 'mbox'
+            for workers in sorted({1, args.workers}):
+                store = os.path.join(tmp, f'store_{name[-4:]}_{workers}.json')
+                ok &= run(f"{name} complet, {workers} processus", [source], store, workers, len(commandes))
+            errors = compare(store, commandes, eml)
+            print(f"{'✅' if not errors else '❌'} {name} : {len(commandes) - errors}/{len(commandes)} "
+                  f"enregistrements identiques à l'original")
+            ok &= not errors
+
+            if eml:
+                write_eml(source, extra, seed=1)
+            else:
+                write_mbox(source, extra, seed=1, mode='ab')
+            ok &= run(f"{name} + {len(extra)} nouveaux", [source], store, args.workers, len(extra))
+            ok &= run(f"{name} sans nouveauté", [source], store, args.workers, 0)
+            ok &= run(f"{name} relu (--full)", [source], store, args.workers, 0, full=True)
+
+    print("\n✅ Ingestion conforme" if ok else "\n❌ Écarts détectés")
+    return 0 if ok else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,90 @@
+"""
+Benchmark : rapprochement des numéros de commande (matching.py)
+
+Construit l'index multi-clés sur la base de commandes, puis résout un lot
+de numéros tels qu'ils apparaissent dans les exports Osmose (zéros en tête
+perdus, espaces, numéros de contrat, numéros inconnus) : taux de commandes
+manquantes en recherche exacte et avec l'index, coût de construction et de
+résolution.
+
+Usage (depuis streamlit_app/):
+    python -m benchmarks.bench_matching [--json ../data/commandes_extraites.json] [--numbers 100000]
+"""
+
+import argparse
+import json
+import os
+import random
+import time
+
+import matching
+from order_store import build_order_index
+
+
+DEFAULT_JSON = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), '..', '..', 'data', 'commandes_extraites.json'
+)
+
+
+def variants(index, count: int, seed: int = 0) -> list:
+    """Numéros « tels que saisis » : exacts, sans zéros, espacés, contrats, inconnus"""
+    rng = random.Random(seed)
+    numeros = list(index.by_numero)
+    contrats = [c['numeroContrat'] for c in index.by_numero.values() if c.get('numeroContrat')]
+    result = []
+    for _ in range(count):
+        numero = rng.choice(numeros)
+        kind = rng.random()
+        if kind < 0.6:
+            result.append(numero)
+        elif kind < 0.75:
+            result.append(numero.lstrip('0') or numero)
+        elif kind < 0.85:
+            result.append(f" {numero} ")
+        elif kind < 0.9 and contrats:
+            result.append(rng.choice(contrats).lower())
+        else:
+            result.append(f"X{rng.randrange(10 ** 6):06d}")
+    return result
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--json', default=DEFAULT_JSON)
+    parser.add_argument('--numbers', type=int, default=100000, help="Numéros à résoudre")
+    args = parser.parse_args(argv)
+
+    with open(args.json, 'rb') as f:
+        index = build_order_index(json.loads(f.read()))
+    numeros = variants(index, args.numbers)
+
+    started = time.perf_counter()
+    matcher = matching.OrderMatcher.from_commandes(index)
+    build = time.perf_counter() - started
+
+    started = time.perf_counter()
+    exact_missing = sum(1 for numero in numeros if index.get(numero) is None)
+    exact = time.perf_counter() - started
+
+    started = time.perf_counter()
+    matches = matcher.resolve(numeros)
+    resolve = time.perf_counter() - started
+    # resolve déduplique : compter sur la liste complète
+    counts = {}
+    for numero in numeros:
+        kind = matches[numero].kind
+        counts[kind] = counts.get(kind, 0) + 1
+    missing = counts.get(matching.MATCH_MISSING, 0) + counts.get(matching.MATCH_AMBIGUOUS, 0)
+
+    print(f"📦 {len(index)} commandes, {len(numeros)} numéros ({len(matches)} distincts)")
+    print(f"🏗️ Construction de l'index : {build * 1000:.2f} ms")
+    print(f"🔎 Exact     : {exact_missing / len(numeros):6.1%} manquantes, "
+          f"{exact / len(numeros) * 1e6:.2f} µs/numéro")
+    print(f"🔎 Rapproché : {missing / len(numeros):6.1%} manquantes, "
+          f"{resolve / len(matches) * 1e6:.2f} µs/numéro distinct")
+    print(f"   {counts}")
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
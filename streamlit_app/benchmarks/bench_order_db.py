@@ -0,0 +1,112 @@
+"""
+Benchmark : chargement de la base de commandes, JSON vs format compilé
+
+Les deux formats portent les mêmes commandes : la liste brute est d'abord
+compactée (une commande par numéro, suppressions retirées, comme
+order_db.compile_commandes), puis écrite en JSON et compilée en .vmdb.
+
+Usage (depuis streamlit_app/):
+    python -m benchmarks.bench_order_db [--json ../data/commandes_extraites.json] [--repeat 50]
+"""
+
+import argparse
+import json
+import os
+import tempfile
+import time
+import tracemalloc
+
+from compaction import compact
+from order_db import OrderDB, compile_commandes
+from order_store import build_order_index
+
+
+DEFAULT_JSON = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), '..', '..', 'data', 'commandes_extraites.json'
+)
+
+
+def load_json(path: str):
+    with open(path, 'rb') as f:
+        return build_order_index(json.loads(f.read()))
+
+
+def load_db(path: str):
+    return OrderDB.open(path)
+
+
+def release(db):
+    """Ferme la projection d'une base compilée (OrderIndex : rien à faire)"""
+    if isinstance(db, OrderDB):
+        db.close()
+
+
+def measure(label: str, loader, path: str, repeat: int, numeros: list) -> dict:
+    """Temps de chargement (meilleur / médian), pic mémoire et coût des lookups"""
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        db = loader(path)
+        timings.append(time.perf_counter() - started)
+        release(db)
+    timings.sort()
+
+    tracemalloc.start()
+    db = loader(path)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    started = time.perf_counter()
+    found = sum(db.get(numero) is not None for numero in numeros)
+    lookup = (time.perf_counter() - started) / max(1, len(numeros))
+    release(db)
+
+    return {
+        'format': label,
+        'taille_octets': os.path.getsize(path),
+        'chargement_min_ms': timings[0] * 1000,
+        'chargement_median_ms': timings[len(timings) // 2] * 1000,
+        'pic_memoire_ko': peak / 1024,
+        'lookup_us': lookup * 1e6,
+        'trouvees': found,
+    }
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--json', default=DEFAULT_JSON)
+    parser.add_argument('--repeat', type=int, default=50)
+    args = parser.parse_args(argv)
+
+    with open(args.json, 'rb') as f:
+        commandes = json.loads(f.read())
+    records = list(build_order_index(compact(commandes).commandes).by_numero.values())
+    numeros = [c['numeroCommande'] for c in records] * 10
+
+    with tempfile.TemporaryDirectory() as tmp:
+        json_path = os.path.join(tmp, 'commandes.json')
+        with open(json_path, 'w', encoding='utf-8') as f:
+            json.dump(records, f, ensure_ascii=False)
+        db_path = os.path.join(tmp, 'commandes.vmdb')
+        with open(db_path, 'wb') as f:
+            f.write(compile_commandes(records))
+
+        results = [
+            measure('json', load_json, json_path, args.repeat, numeros),
+            measure('vmdb', load_db, db_path, args.repeat, numeros),
+        ]
+
+    print(f"{len(records)} commandes (compactées depuis {len(commandes)} enregistrements)")
+
+    print(f"{'format':<8}{'taille':>12}{'min ms':>10}{'médian ms':>12}{'pic Ko':>10}{'lookup µs':>12}")
+    for r in results:
+        print(
+            f"{r['format']:<8}{r['taille_octets']:>12}{r['chargement_min_ms']:>10.2f}"
+            f"{r['chargement_median_ms']:>12.2f}{r['pic_memoire_ko']:>10.0f}{r['lookup_us']:>12.2f}"
+        )
+    print(json.dumps(results, indent=2))
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
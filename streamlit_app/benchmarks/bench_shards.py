@@ -0,0 +1,171 @@
+"""
+Benchmark : correction d'un fichier par portions parallèles (shards.py)
+
+Vérifie d'abord que la sortie découpée est identique octet pour octet à
+celle du passage unique (patcher.patch_stream), statistiques comprises
+(violations et rapport des modifications), sur les cas limites de
+check_patcher, des fichiers xmlgen découpés en petites portions et des
+documents dont une frontière tombe dans un commentaire, une section CDATA
+ou un Assignment imbriqué. Mesure ensuite le temps de correction d'un gros
+fichier de 1 à N processus.
+
+Usage (depuis streamlit_app/):
+    python -m benchmarks.bench_shards
+    python -m benchmarks.bench_shards --contracts 400000 -j 8
+"""
+
+import argparse
+import io
+import os
+import sys
+import tempfile
+import time
+
+import patcher
+import shards
+from benchmarks import xmlgen
+from benchmarks.check_patcher import EDGE_CASES, EDGE_ORDERS, HR_NS
+
+
+# Blocs cachés dans un commentaire ou une section CDATA, à l'endroit où
+# tomberait une frontière, et Assignment imbriqué
+ASSIGNMENT = '''  <Assignment>
+    <ReferenceInformation><OrderId><IdValue>{numero}</IdValue></OrderId></ReferenceInformation>
+    <CustomerReportingRequirements><CustomerJobCode>AVANT</CustomerJobCode></CustomerReportingRequirements>
+    <StaffingShift shiftPeriod="weekly"><Id><IdValue name="H">35H</IdValue></Id></StaffingShift>
+  </Assignment>
+'''
+
+TRAPS = {
+    'Assignment en commentaire': (
+        "  <!-- ancien contrat :\n" + ASSIGNMENT.format(numero='001815') * 40 + "  -->\n"
+    ),
+    'Assignment en CDATA': (
+        "  <Note><![CDATA[<!-- -->\n" + ASSIGNMENT.format(numero='001816') * 40 + "]]></Note>\n"
+    ),
+    'Assignment imbriqué': (
+        "  <Assignment>\n" + ASSIGNMENT.format(numero='001815') * 40 + "  </Assignment>\n"
+    ),
+}
+
+
+def trap_document(trap: str) -> bytes:
+    blocks = ''.join(ASSIGNMENT.format(numero=f'{1815 + i % 3:06d}') for i in range(20))
+    text = (f'<?xml version="1.0" encoding="ISO-8859-1"?>\n<Envelope xmlns="{HR_NS}">\n'
+            + blocks + trap + blocks + '</Envelope>\n')
+    return text.encode('iso-8859-1')
+
+
+# ============================================================================
+# IDENTITÉ
+# ============================================================================
+
+def check(name: str, data: bytes, commandes_map: dict, shard_bytes: int, workers: int = 3, **options) -> bool:
+    expected = io.BytesIO()
+    try:
+        expected_stats = patcher.patch_stream(data, expected, commandes_map, **options)
+    except patcher.PatchUnsupported:
+        expected_stats = None
+    output = io.BytesIO()
+    try:
+        stats = shards.patch_stream_sharded(data, output, commandes_map, workers, shard_bytes=shard_bytes, **options)
+    except patcher.PatchUnsupported as e:
+        # Découpage refusé : correct_document repasse en un seul passage
+        print(f"↩️ {name} : passage unique ({e})")
+        output = io.BytesIO()
+        stats = shards.correct_document(data, output, commandes_map, 1, **options)
+        if expected_stats is None:
+            expected = io.BytesIO()
+            expected_stats = patcher.correct_document(data, expected, commandes_map, **options)
+    target = min(workers * shards.SHARDS_PER_WORKER, max(1, len(data) // shard_bytes))
+    count = len(shards.split_ranges(data, frozenset([None, b'hr']), target))
+
+    errors = []
+    if output.getvalue() != expected.getvalue():
+        errors.append("sorties différentes")
+    if stats != expected_stats:
+        errors.append("statistiques différentes")
+    if errors:
+        print(f"❌ {name} : {', '.join(errors)}")
+        return False
+    print(f"✅ {name} : {count} portions, sortie identique ({len(data)} octets)")
+    return True
+
+
+# ============================================================================
+# MESURE
+# ============================================================================
+
+def timing(contracts: int, max_workers: int):
+    commandes_map = {f'{n:06d}': {'codePoste': '4FACO2', 'codeCycle': 'VA EQUIPE B 5X8'} for n in range(1800, 2400)}
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'export.xml')
+        with open(path, 'wb') as f:
+            size = xmlgen.generate(f, contracts)
+        print(f"\n📦 {contracts} contrats, {size / (1024 * 1024):.0f} Mo (cœurs disponibles : {os.cpu_count()})")
+
+        def best(run) -> float:
+            durations = []
+            for _ in range(3):
+                started = time.perf_counter()
+                run(os.path.join(tmp, 'sortie.xml'))
+                durations.append(time.perf_counter() - started)
+            return min(durations)
+
+        reference = best(lambda out: patcher.patch_stream(path, out, commandes_map))
+        print(f"⏱️ {'passage unique':<16}{reference:7.2f}s {size / reference / (1024 * 1024):7.1f} Mo/s")
+        with open(os.path.join(tmp, 'sortie.xml'), 'rb') as f:
+            expected = f.read()
+        workers = 1
+        while True:
+            elapsed = best(lambda out: shards.patch_stream_sharded(path, out, commandes_map, workers))
+            with open(os.path.join(tmp, 'sortie.xml'), 'rb') as f:
+                same = f.read() == expected
+            print(f"⏱️ {f'{workers} processus':<16}{elapsed:7.2f}s {size / elapsed / (1024 * 1024):7.1f} Mo/s"
+                  f"  ×{reference / elapsed:.2f}{'' if same else '  ❌ sortie différente'}")
+            if workers >= max_workers:
+                break
+            workers = min(workers * 2, max_workers)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--seeds', type=int, default=10, help="Nombre de fichiers synthétiques vérifiés")
+    parser.add_argument('--contracts', type=int, default=200000, help="Contrats du fichier de mesure (0 : aucune)")
+    parser.add_argument('-j', '--workers', type=int, default=os.cpu_count() or 1, help="Nombre maximal de processus")
+    args = parser.parse_args(argv)
+
+    ok = True
+    for name, text in EDGE_CASES.items():
+        data = text.encode('iso-8859-1')
+        ok &= check(name, data, EDGE_ORDERS, 64)
+        ok &= check(f"{name} (validation, modifications)", data, EDGE_ORDERS, 64, validate=True, changes=True)
+
+    for name, trap in TRAPS.items():
+        data = trap_document(trap)
+        ok &= check(name, data, EDGE_ORDERS, len(data) // 3)
+
+    numeros = [f'{n:06d}' for n in range(1800, 2400)]
+    for seed in range(args.seeds):
+        data = xmlgen.generate_bytes(
+            200 + seed * 50,
+            seed=seed,
+            missing_job_code=(seed % 4) / 4,
+            missing_external_order=(seed % 3) / 3,
+            missing_staffing_shift=(seed % 5) / 5,
+            missing_order_id=(seed % 2) / 10,
+        )
+        commandes_map = {n: {'codePoste': f'P{n}', 'codeCycle': f'CYCLE {n}'} for n in numeros[::2]}
+        only_orders = set(numeros[::6]) if seed % 3 == 2 else None
+        ok &= check(f"xmlgen graine {seed}", data, commandes_map, 4096, only_orders=only_orders,
+                    validate=seed % 2 == 1, changes=True)
+
+    if args.contracts:
+        timing(args.contracts, max(1, args.workers))
+
+    print("\n✅ Sorties identiques au passage unique" if ok else "\n❌ Écarts détectés")
+    return 0 if ok else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
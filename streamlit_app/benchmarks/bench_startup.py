@@ -0,0 +1,168 @@
+"""
+Benchmark : démarrage et reruns de l'application (app.py)
+
+Chaque scénario tourne dans un processus neuf (streamlit.testing AppTest)
+avec une base synthétique de commandes servie en file:// :
+- premier lancement : cache disque vide (lecture, compaction, index) ;
+- démarrage : copies locales présentes, délai jusqu'au premier affichage
+  d'un nouveau processus, puis coût d'un rerun sans fichier ;
+- fichier chargé : premier affichage (aperçu, analyse) et coût d'un rerun
+  (pagination, clic).
+Avec plusieurs --app, les versions sont mesurées côte à côte (ex. une copie
+de la version précédente obtenue avec git worktree).
+
+Usage (depuis streamlit_app/):
+    python -m benchmarks.bench_startup
+    python -m benchmarks.bench_startup --orders 50000 --app /tmp/avant/streamlit_app/app.py --app app.py
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks import xmlgen
+from benchmarks.bench_matching import DEFAULT_JSON
+
+
+APP = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'app.py')
+
+# Script exécuté par AppTest : file_uploader renvoie le fichier du scénario
+WRAPPER = '''
+import io, os, runpy, sys
+sys.path.insert(0, {app_dir!r})
+import streamlit as st
+
+
+class UploadedFile(io.BytesIO):
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            super().__init__(f.read())
+        self.name = self.file_id = os.path.basename(path)
+        self.size = len(self.getvalue())
+
+
+FILES = [UploadedFile(os.environ['BENCH_XML'])] if os.environ.get('BENCH_XML') else []
+st.file_uploader = lambda *args, **kwargs: list(FILES)
+runpy.run_path({app!r}, run_name='__main__')
+'''
+
+
+# ============================================================================
+# DONNÉES
+# ============================================================================
+
+def write_orders(path: str, count: int, source: str = DEFAULT_JSON):
+    """Base synthétique : count commandes distinctes (numéros 000000 à count - 1)"""
+    with open(source, 'r', encoding='utf-8') as f:
+        base = json.load(f)
+    commandes = []
+    for i in range(count):
+        commande = dict(base[i % len(base)])
+        commande['numeroCommande'] = f'{i:06d}'
+        commande['emailId'] = f'{i:016x}'
+        commande['emailSubject'] = commande['emailSubject'].replace('Suppression de ', '')
+        commande['dateExtraction'] = f'2026-06-{1 + i % 28:02d} {i % 24:02d}:{i % 60:02d}:{i % 59:02d}'
+        commandes.append(commande)
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(commandes, f, ensure_ascii=False)
+
+
+# ============================================================================
+# MESURE (PROCESSUS NEUF)
+# ============================================================================
+
+def child(app: str, reruns: int) -> dict:
+    app = os.path.abspath(app)
+    os.chdir(os.path.dirname(app))
+    fd, wrapper = tempfile.mkstemp(suffix='.py')
+    with os.fdopen(fd, 'w', encoding='utf-8') as f:
+        f.write(WRAPPER.format(app_dir=os.path.dirname(app), app=app))
+
+    started = time.perf_counter()
+    from streamlit.testing.v1 import AppTest
+    imported = time.perf_counter()
+    at = AppTest.from_file(wrapper, default_timeout=600).run()
+    first = time.perf_counter()
+    if at.exception:
+        raise RuntimeError(at.exception[0].message)
+
+    durations = []
+    for _ in range(reruns):
+        rerun_started = time.perf_counter()
+        at.run()
+        durations.append(time.perf_counter() - rerun_started)
+    os.remove(wrapper)
+    return {
+        'import_streamlit': imported - started,
+        'premier_affichage': first - imported,
+        'rerun': statistics.median(durations) if durations else None,
+    }
+
+
+def measure(app: str, env: dict, reruns: int) -> dict:
+    completed = subprocess.run(
+        [sys.executable, '-m', 'benchmarks.bench_startup', '--child', app, '--reruns', str(reruns)],
+        env=dict(os.environ, **env), capture_output=True, text=True,
+        cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    )
+    if completed.returncode:
+        raise RuntimeError(completed.stderr.strip().splitlines()[-1] if completed.stderr.strip() else 'échec')
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--app', action='append', help="app.py à mesurer (plusieurs : côte à côte)")
+    parser.add_argument('--orders', type=int, default=20000, help="Commandes de la base synthétique")
+    parser.add_argument('--contracts', type=int, default=2000, help="Contrats du fichier chargé")
+    parser.add_argument('--reruns', type=int, default=5)
+    parser.add_argument('--child', metavar='APP', help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.child:
+        print(json.dumps(child(args.child, args.reruns)))
+        return 0
+
+    apps = args.app or [APP]
+    with tempfile.TemporaryDirectory() as tmp:
+        orders = os.path.join(tmp, 'commandes.json')
+        write_orders(orders, args.orders)
+        xml = os.path.join(tmp, 'export.xml')
+        with open(xml, 'wb') as f:
+            xmlgen.generate(f, args.contracts)
+        print(f"📦 {args.orders} commandes, fichier de {args.contracts} contrats")
+
+        results = []
+        for number, app in enumerate(apps):
+            env = {
+                'VERALLIA_COMMANDES_URL': f'file://{orders}',
+                'VERALLIA_CACHE_DIR': os.path.join(tmp, f'cache{number}'),
+                'VERALLIA_SPOOL_DIR': os.path.join(tmp, f'spool{number}'),
+            }
+            cold = measure(app, env, 0)
+            warm = measure(app, env, args.reruns)
+            loaded = measure(app, dict(env, BENCH_XML=xml), args.reruns)
+            results.append((cold, warm, loaded))
+
+        rows = [
+            ("Premier lancement (cache vide)", lambda r: r[0]['premier_affichage']),
+            ("Démarrage : premier affichage", lambda r: r[1]['premier_affichage']),
+            ("Rerun sans fichier", lambda r: r[1]['rerun']),
+            ("Fichier chargé : premier affichage", lambda r: r[2]['premier_affichage']),
+            ("Fichier chargé : rerun", lambda r: r[2]['rerun']),
+            ("(import de streamlit)", lambda r: r[1]['import_streamlit']),
+        ]
+        width = max(12, *(len(app) for app in apps))
+        print(f"\n{'':<36}" + ''.join(f"{app:>{width + 2}}" for app in apps))
+        for label, value in rows:
+            print(f"⏱️ {label:<34}" + ''.join(f"{value(r) * 1000:>{width}.0f}ms" for r in results))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
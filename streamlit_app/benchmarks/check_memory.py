@@ -0,0 +1,138 @@
+"""
+Vérification : mode mémoire bornée (spool.py)
+
+Génère un gros fichier synthétique (500 Mo par défaut) sur disque, puis le
+corrige dans un processus neuf avec spool.correct_file (validation et
+rapport des modifications sur disque), exporte le rapport CSV et télécharge
+le résultat depuis le serveur de téléchargement. Le pic de mémoire
+résidente de ce processus doit rester sous le budget ; le code de sortie
+est non nul sinon.
+
+Seul le moteur du mode borné est mesuré : le chemin de app.py (upload
+reçu par Streamlit, session, repli sur st.download_button) ne l'est pas.
+
+Usage (depuis streamlit_app/):
+    python -m benchmarks.check_memory
+    python -m benchmarks.check_memory --size-mb 100 --budget-mb 96
+"""
+
+import argparse
+import http.client
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from urllib.parse import urlsplit
+
+from benchmarks import xmlgen
+
+
+DEFAULT_COMMANDES = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), '..', '..', 'data', 'commandes_extraites.json'
+)
+
+# Taille moyenne d'un bloc <Assignment> généré par xmlgen
+BYTES_PER_ASSIGNMENT = 1290
+
+
+def child(source: str, commandes: str) -> dict:
+    """Correction, rapport et téléchargement mesurés (processus neuf)"""
+    import batch
+    import changeset
+    import spool
+
+    corrections_map = batch.build_corrections_map(batch.load_commandes(commandes))
+    baseline = spool.peak_rss()
+
+    started = time.perf_counter()
+    destination = spool.temp_path('.xml')
+    stats, _ = spool.correct_file(source, destination, corrections_map, validate=True, changes=True)
+    report = spool.temp_path('.csv')
+    with open(report, 'w', encoding='utf-8-sig', newline='') as f:
+        changeset.write_csv(stats['changes'], f)
+    elapsed = time.perf_counter() - started
+
+    server = spool.DownloadServer(port=0).start(local_only=True)
+    url = urlsplit(server.publish(destination, 'corrige.xml'))
+    connection = http.client.HTTPConnection(url.hostname, url.port)
+    connection.request('GET', url.path)
+    response = connection.getresponse()
+    downloaded = 0
+    for chunk in iter(lambda: response.read(spool.CHUNK_SIZE), b''):
+        downloaded += len(chunk)
+    connection.close()
+    server.stop()
+
+    result = {
+        'assignments': stats['assignments'],
+        'corrections': stats['corrections'],
+        'violations': stats['violations'].count,
+        'modifications': stats['changes'].count,
+        'sortie_octets': os.path.getsize(destination),
+        'telecharge_octets': downloaded,
+        'duree_s': elapsed,
+        'rss_base_octets': baseline,
+        'rss_pic_octets': spool.peak_rss(),
+    }
+    for collected in (stats['violations'], stats['changes']):
+        collected.close()
+    for path in (destination, report):
+        os.remove(path)
+    return result
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--size-mb', type=float, default=500, help="Taille du fichier généré")
+    parser.add_argument('--budget-mb', type=float, default=128, help="Budget de mémoire résidente")
+    parser.add_argument('--commandes', default=DEFAULT_COMMANDES)
+    parser.add_argument('--child', metavar='XML', help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.child:
+        print(json.dumps(child(args.child, args.commandes)))
+        return 0
+
+    budget = int(args.budget_mb * 1024 * 1024)
+    with tempfile.TemporaryDirectory() as tmp:
+        source = os.path.join(tmp, 'export.xml')
+        with open(source, 'wb') as f:
+            size = xmlgen.generate(f, int(args.size_mb * 1024 * 1024 / BYTES_PER_ASSIGNMENT))
+        print(f"📦 {source} : {size / (1024 * 1024):.0f} Mo")
+
+        env = dict(os.environ, VERALLIA_SPOOL_DIR=os.path.join(tmp, 'spool'),
+                   VERALLIA_MEMORY_BUDGET_MB=str(args.budget_mb))
+        completed = subprocess.run(
+            [sys.executable, '-m', 'benchmarks.check_memory', '--child', source, '--commandes', args.commandes],
+            env=env, capture_output=True, text=True,
+        )
+    if completed.returncode:
+        print(completed.stderr, file=sys.stderr)
+        return completed.returncode
+
+    result = json.loads(completed.stdout.strip().splitlines()[-1])
+    peak = result['rss_pic_octets']
+    print(
+        f"🔧 {result['assignments']} contrats, {result['corrections']} modifications, "
+        f"{result['violations']} écarts HR-XML en {result['duree_s']:.1f}s"
+    )
+    print(f"📥 {result['telecharge_octets'] / (1024 * 1024):.0f} Mo téléchargés depuis le disque")
+    print(
+        f"🧠 RSS : {result['rss_base_octets'] / (1024 * 1024):.0f} Mo au départ, "
+        f"pic {peak / (1024 * 1024):.0f} Mo (budget {args.budget_mb:.0f} Mo, "
+        f"{peak / size:.2f} × la taille du fichier)"
+    )
+    if result['telecharge_octets'] != result['sortie_octets']:
+        print("❌ Téléchargement incomplet")
+        return 1
+    if peak > budget:
+        print("❌ Budget mémoire dépassé")
+        return 1
+    print("✅ Pic de mémoire sous le budget")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,263 @@
+"""
+Test différentiel du moteur par patch d'octets
+
+Corrige chaque document avec patcher.patch_stream et avec
+streaming.correct_stream (chemin lxml de référence), puis vérifie que :
+- les statistiques sont identiques (violations de validation et rapport
+  des modifications compris) ;
+- les deux sorties sont le même document XML (forme canonique C14N) et
+  gardent le DOCTYPE de l'original ;
+- les octets hors des nœuds corrigés sont conservés tels quels.
+
+Les documents testés sont des fichiers synthétiques (xmlgen, plusieurs
+graines et proportions de balises manquantes) et des cas limites écrits à
+la main (préfixes, commentaires, CDATA, balises auto-fermantes, entités,
+Assignment imbriqués...). Un dernier passage compare les temps sur un gros
+fichier.
+
+Usage (depuis streamlit_app/):
+    python -m benchmarks.check_patcher
+    python -m benchmarks.check_patcher --seeds 50 --timing 100000
+"""
+
+import argparse
+import io
+import sys
+import time
+
+from lxml import etree
+
+import patcher
+import streaming
+from benchmarks import xmlgen
+
+
+# ============================================================================
+# CAS LIMITES
+# ============================================================================
+
+HR_NS = 'http://ns.hr-xml.org/2004-08-02'
+
+EDGE_CASES = {
+    'préfixe hr:': f'''<?xml version="1.0" encoding="ISO-8859-1"?>
+<hr:Envelope xmlns:hr="{HR_NS}">
+  <hr:Assignment>
+    <hr:ReferenceInformation><hr:OrderId><hr:IdValue>001815</hr:IdValue></hr:OrderId></hr:ReferenceInformation>
+    <hr:CustomerReportingRequirements>
+      <hr:ExternalOrderNumber>001815</hr:ExternalOrderNumber>
+    </hr:CustomerReportingRequirements>
+    <hr:StaffingShift shiftPeriod="weekly"><hr:Id><hr:IdValue name="HORAIRE">35H</hr:IdValue></hr:Id></hr:StaffingShift>
+  </hr:Assignment>
+</hr:Envelope>
+''',
+    'commentaires, PI, CDATA': f'''<?xml version="1.0" encoding="ISO-8859-1"?>
+<!-- <Assignment> dans un commentaire -->
+<?app <IdValue>1</IdValue> ?>
+<Envelope xmlns="{HR_NS}">
+  <Assignment>
+    <!-- <CustomerJobCode>faux</CustomerJobCode> -->
+    <ReferenceInformation><OrderId><IdValue><![CDATA[001816]]></IdValue></OrderId></ReferenceInformation>
+    <CustomerReportingRequirements>
+      <CustomerJobCode>AVANT<!-- c -->APRES</CustomerJobCode>
+      <Note><![CDATA[<ExternalOrderNumber>x</ExternalOrderNumber>]]></Note>
+    </CustomerReportingRequirements>
+    <StaffingShift shiftPeriod='weekly'><Id><IdValue name='X' other="a>b">35H</IdValue></Id></StaffingShift>
+  </Assignment>
+</Envelope>
+<!-- fin -->
+''',
+    'balises auto-fermantes': f'''<?xml version="1.0" encoding="ISO-8859-1"?>
+<Envelope xmlns="{HR_NS}">
+  <Assignment>
+    <ReferenceInformation><OrderId><IdValue>001815</IdValue></OrderId></ReferenceInformation>
+    <CustomerReportingRequirements/>
+    <StaffingShift shiftPeriod="weekly"><Id><IdValue/></Id></StaffingShift>
+  </Assignment>
+  <Assignment>
+    <ReferenceInformation><OrderId><IdValue>001816</IdValue></OrderId></ReferenceInformation>
+    <CustomerReportingRequirements><CustomerJobCode/></CustomerReportingRequirements>
+    <StaffingShift shiftPeriod="weekly"><Id><IdValue name="HORAIRE" /></Id></StaffingShift>
+  </Assignment>
+  <Assignment/>
+</Envelope>
+''',
+    'entités et caractères spéciaux': f'''<?xml version="1.0" encoding="ISO-8859-1"?>
+<Envelope xmlns="{HR_NS}">
+  <Assignment>
+    <AssignmentId><IdValue> C&amp;17 </IdValue></AssignmentId>
+    <ReferenceInformation><OrderId><IdValue>  &#48;01&#x38;17 </IdValue></OrderId></ReferenceInformation>
+    <CustomerReportingRequirements>
+      <CustomerJobCode>A &amp; B</CustomerJobCode>
+      <ExternalOrderNumber>E</ExternalOrderNumber>
+    </CustomerReportingRequirements>
+    <StaffingShift shiftPeriod="we&#101;kly"><Id><IdValue>Jérôme &lt;35H&gt;</IdValue></Id></StaffingShift>
+  </Assignment>
+</Envelope>
+''',
+    'structure inhabituelle': f'''<?xml version="1.0" encoding="ISO-8859-1"?>
+<Envelope xmlns="{HR_NS}" xmlns:x="urn:autre">
+  <Assignment>
+    <ReferenceInformation>
+      <OrderId><Wrapper><IdValue>999999</IdValue></Wrapper></OrderId>
+      <OrderId>
+        <IdValue>001815</IdValue>
+      </OrderId>
+    </ReferenceInformation>
+    <x:CustomerJobCode>autre namespace</x:CustomerJobCode>
+    <CustomerReportingRequirements>
+      <Sub><ExternalOrderNumber>imbriqué</ExternalOrderNumber></Sub>
+      <CostCenterCode>CC</CostCenterCode>
+    </CustomerReportingRequirements>
+    <CustomerReportingRequirements><ExternalOrderNumber>second bloc</ExternalOrderNumber></CustomerReportingRequirements>
+    <StaffingShift shiftPeriod="daily"><Id><IdValue>JOUR</IdValue></Id></StaffingShift>
+    <StaffingShift shiftPeriod="weekly"><Id><Other/><IdValue name="A">1</IdValue><IdValue>2</IdValue></Id></StaffingShift>
+    <Assignment>
+      <ReferenceInformation><OrderId><IdValue>001816</IdValue></OrderId></ReferenceInformation>
+    </Assignment>
+  </Assignment>
+  <Assignment>
+    <ReferenceInformation><OrderId><IdValue>inconnue</IdValue></OrderId></ReferenceInformation>
+  </Assignment>
+  <Assignment><OrderId><IdValue>   </IdValue></OrderId></Assignment>
+</Envelope>
+''',
+    'sans déclaration, accents ISO-8859-1': f'''<Envelope xmlns="{HR_NS}">
+  <Assignment>
+    <ReferenceInformation><OrderId><IdValue>001816</IdValue></OrderId></ReferenceInformation>
+    <CustomerReportingRequirements>
+      <CustomerJobCode>Équipe été</CustomerJobCode>
+      <ExternalOrderNumber>001816</ExternalOrderNumber>
+    </CustomerReportingRequirements>
+    <StaffingShift shiftPeriod="weekly"><Id><IdValue name="HORAIRE">Matinée</IdValue></Id></StaffingShift>
+  </Assignment>
+</Envelope>
+''',
+    'DOCTYPE et sous-ensemble interne': f'''<?xml version="1.0" encoding="ISO-8859-1"?>
+<!DOCTYPE Envelope [
+<!ENTITY societe "Verallia ]> France">
+<!ELEMENT Note (#PCDATA)>
+]>
+<Envelope xmlns="{HR_NS}">
+  <Assignment>
+    <ReferenceInformation><OrderId><IdValue>001815</IdValue></OrderId></ReferenceInformation>
+    <CustomerReportingRequirements><CustomerJobCode>X</CustomerJobCode></CustomerReportingRequirements>
+    <StaffingShift shiftPeriod="weekly"><Id><IdValue>35H</IdValue></Id></StaffingShift>
+  </Assignment>
+</Envelope>
+''',
+    'aucun Assignment': f'''<?xml version="1.0" encoding="ISO-8859-1"?>
+<Envelope xmlns="{HR_NS}"><Sender><Id>OSMOSE</Id></Sender></Envelope>
+''',
+}
+
+EDGE_ORDERS = {
+    '001815': {'codePoste': 'A&B <é>', 'codeCycle': 'VA EQUIPE B 5X8'},
+    '001816': {'codePoste': '4FACO2', 'codeCycle': 'Cycle € "2"'},
+    '001817': {'codePoste': None, 'codeCycle': 'C\r\nD'},
+}
+
+
+# ============================================================================
+# COMPARAISON
+# ============================================================================
+
+def _canonical(data: bytes) -> bytes:
+    parser = etree.XMLParser(encoding='iso-8859-1', remove_blank_text=False)
+    return etree.tostring(etree.parse(io.BytesIO(data), parser), method='c14n')
+
+
+def _doctype(data: bytes) -> tuple:
+    """DOCTYPE et entités du sous-ensemble interne (absents de la forme C14N)"""
+    parser = etree.XMLParser(encoding='iso-8859-1', remove_blank_text=False)
+    docinfo = etree.parse(io.BytesIO(data), parser).docinfo
+    dtd = docinfo.internalDTD
+    return docinfo.doctype, [(e.name, e.content) for e in dtd.iterentities()] if dtd is not None else []
+
+
+def check(name: str, data: bytes, commandes_map: dict, only_orders=None, validate: bool = False) -> bool:
+    # La validation et le rapport des modifications sont vérifiés ensemble
+    expected = io.BytesIO()
+    expected_stats = streaming.correct_stream(io.BytesIO(data), expected, commandes_map, only_orders,
+                                              validate, validate)
+    if _doctype(expected.getvalue()) != _doctype(data):
+        print(f"❌ {name} : DOCTYPE perdu par correct_stream")
+        return False
+
+    patched = io.BytesIO()
+    try:
+        stats = patcher.patch_stream(data, patched, commandes_map, only_orders, validate, validate)
+    except patcher.PatchUnsupported as e:
+        print(f"➖ {name} : hors périmètre ({e})")
+        return True
+
+    errors = []
+    if stats != expected_stats:
+        errors.append(f"stats {stats} ≠ {expected_stats}")
+    if _canonical(patched.getvalue()) != _canonical(expected.getvalue()):
+        errors.append("documents différents (C14N)")
+    if _doctype(patched.getvalue()) != _doctype(expected.getvalue()):
+        errors.append("DOCTYPE différent")
+    if not stats['corrections'] and patched.getvalue() != data:
+        errors.append("octets modifiés sans correction")
+
+    if errors:
+        print(f"❌ {name} : " + ' ; '.join(errors))
+        return False
+    detail = f", {len(stats['violations'])} violations, {len(stats['changes'])} contrats au rapport" if validate else ""
+    print(f"✅ {name} : {stats['contratsCorriges']}/{stats['assignments']} contrats, {stats['corrections']} corrections{detail}")
+    return True
+
+
+def timing(assignments: int):
+    data = xmlgen.generate_bytes(assignments)
+    commandes_map = {f'{n:06d}': {'codePoste': '4FACO2', 'codeCycle': 'VA EQUIPE B 5X8'} for n in range(1800, 2400)}
+    for label, run in (
+        ('lxml (correct_stream)', lambda out: streaming.correct_stream(io.BytesIO(data), out, commandes_map)),
+        ('patch (patch_stream)', lambda out: patcher.patch_stream(data, out, commandes_map)),
+    ):
+        best = min(_timed(run) for _ in range(3))
+        print(f"⏱️ {label:<24}{assignments:>8} contrats  {best:.2f}s  "
+              f"{len(data) / best / (1024 * 1024):.1f} Mo/s")
+
+
+def _timed(run) -> float:
+    started = time.perf_counter()
+    run(io.BytesIO())
+    return time.perf_counter() - started
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Test différentiel patch d'octets / lxml")
+    parser.add_argument('--seeds', type=int, default=20, help="Nombre de fichiers synthétiques")
+    parser.add_argument('--timing', type=int, default=20000, help="Contrats du fichier de mesure (0 : aucun)")
+    args = parser.parse_args(argv)
+
+    ok = True
+    for name, text in EDGE_CASES.items():
+        data = text.encode('iso-8859-1')
+        ok &= check(name, data, EDGE_ORDERS)
+        ok &= check(f"{name} (incrémental)", data, EDGE_ORDERS, only_orders={'001816'})
+        ok &= check(f"{name} (validation)", data, EDGE_ORDERS, validate=True)
+
+    numeros = [f'{n:06d}' for n in range(1800, 2400)]
+    for seed in range(args.seeds):
+        data = xmlgen.generate_bytes(
+            50 + seed * 10,
+            seed=seed,
+            missing_job_code=(seed % 4) / 4,
+            missing_external_order=(seed % 3) / 3,
+            missing_staffing_shift=(seed % 5) / 5,
+            missing_order_id=(seed % 2) / 10,
+        )
+        commandes_map = {n: {'codePoste': f'P{n}', 'codeCycle': f'CYCLE {n}'} for n in numeros[::2]}
+        ok &= check(f"xmlgen graine {seed}", data, commandes_map, validate=seed % 2 == 1)
+
+    if args.timing:
+        timing(args.timing)
+
+    print("\n✅ Sorties équivalentes" if ok else "\n❌ Écarts détectés")
+    return 0 if ok else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
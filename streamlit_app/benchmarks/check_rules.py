@@ -0,0 +1,233 @@
+"""
+Test de parité du moteur de règles (rules.py)
+
+Pour chaque bloc <Assignment> des documents testés (cas limites de
+check_patcher et fichiers synthétiques xmlgen), vérifie que :
+- le plan compilé résout les mêmes éléments que des find() lxml enchaînés,
+  étape par étape (implémentation de référence indépendante) ;
+- les deux règles historiques appliquées par le plan produisent le même
+  document (C14N) et les mêmes compteurs que les fonctions d'origine
+  update_customer_job_code / update_cycle_horaire (copie figée ci-dessous,
+  utils n'en garde que des enveloppes du plan), appliquées au bloc isolé ;
+- ces enveloppes, appliquées au document entier, le corrigent comme les
+  fonctions d'origine.
+
+Une dernière mesure compare le coût par contrat (résolution + correction)
+avec les deux règles historiques et avec des règles supplémentaires :
+toutes les cibles sont résolues dans le même parcours du bloc.
+
+Usage (depuis streamlit_app/):
+    python -m benchmarks.check_rules
+    python -m benchmarks.check_rules --seeds 50 --timing 20000
+"""
+
+import argparse
+import copy
+import io
+import sys
+import time
+
+from lxml import etree
+
+import rules
+import utils
+from benchmarks import xmlgen
+from benchmarks.check_patcher import EDGE_CASES, EDGE_ORDERS
+
+
+ASSIGNMENT_TAG = utils.HR + 'Assignment'
+
+# Règles supplémentaires de la mesure (champs de data/commandes_extraites.json)
+EXTRA_RULES = (
+    rules.Rule('Qualification', '//StaffingPosition/PositionTitle', 'qualification', parent='//StaffingPosition'),
+    rules.Rule('DateDebut', '//AssignmentDateRange/StartDate', 'dateDebut', parent='//AssignmentDateRange',
+               anchor='ExpectedEndDate'),
+    rules.Rule('Client', '//CustomerReportingRequirements/DepartmentCode', 'client',
+               parent='//CustomerReportingRequirements', anchor='CustomerJobCode'),
+)
+
+
+# ============================================================================
+# RÉFÉRENCES
+# ============================================================================
+
+def reference_find(assignment, path: str):
+    """Premier élément du chemin, par find() / iter() lxml enchaînés"""
+    scope = assignment
+    for descendant, tag, attributes, parent_tag in rules.parse_path(path):
+        candidates = scope.iter(tag) if descendant else scope.iterchildren(tag)
+        scope = next(
+            (
+                elem for elem in candidates
+                if elem is not scope
+                and (parent_tag is None or elem.getparent().tag == parent_tag)
+                and all(elem.get(name) == value for name, value in attributes)
+            ),
+            None,
+        )
+        if scope is None:
+            return None
+    return scope
+
+
+def legacy_update_customer_job_code(root, code_poste: str) -> str:
+    """utils.update_customer_job_code d'origine ; retourne l'action"""
+    job_code_elem = root.find('.//hr:CustomerJobCode', utils.NAMESPACES)
+    if job_code_elem is None:
+        cust_req = root.find('.//hr:CustomerReportingRequirements', utils.NAMESPACES)
+        if cust_req is None:
+            return 'skipped'
+        external_order = cust_req.find('hr:ExternalOrderNumber', utils.NAMESPACES)
+        job_code_elem = etree.Element('{http://ns.hr-xml.org/2004-08-02}CustomerJobCode')
+        job_code_elem.text = code_poste
+        job_code_elem.tail = '\n          '
+        if external_order is not None:
+            cust_req.insert(list(cust_req).index(external_order), job_code_elem)
+        else:
+            cust_req.append(job_code_elem)
+        return 'created'
+    job_code_elem.text = code_poste
+    return 'updated'
+
+
+def legacy_update_cycle_horaire(root, code_cycle: str) -> str:
+    """utils.update_cycle_horaire d'origine ; retourne l'action"""
+    staffing_shift = root.find('.//hr:StaffingShift[@shiftPeriod="weekly"]', utils.NAMESPACES)
+    if staffing_shift is None:
+        return 'skipped'
+    id_value_elem = staffing_shift.find('.//hr:IdValue', utils.NAMESPACES)
+    if id_value_elem is None:
+        return 'skipped'
+    id_value_elem.set('name', 'CYCLE')
+    id_value_elem.text = code_cycle
+    return 'updated'
+
+
+def legacy_correct(assignment, commande: dict) -> tuple:
+    """Bloc isolé corrigé par les fonctions d'origine, et leurs compteurs"""
+    root = copy.deepcopy(assignment)
+    counts = {
+        ('CustomerJobCode', legacy_update_customer_job_code(root, commande.get('codePoste'))): 1,
+        ('CycleHoraire', legacy_update_cycle_horaire(root, commande.get('codeCycle'))): 1,
+    }
+    return root, counts
+
+
+def check_wrappers(root) -> list:
+    """utils.update_* (plan) ≡ fonctions d'origine sur le document entier"""
+    expected, actual = copy.deepcopy(root), etree.ElementTree(copy.deepcopy(root))
+    results = [
+        legacy_update_customer_job_code(expected, '4FACO2') != 'skipped',
+        legacy_update_cycle_horaire(expected, 'VA EQUIPE B 5X8') != 'skipped',
+    ]
+    returned = [
+        utils.update_customer_job_code(actual, '4FACO2'),
+        utils.update_cycle_horaire(actual, 'VA EQUIPE B 5X8'),
+    ]
+    errors = []
+    if returned != results:
+        errors.append(f"utils.update_* retournent {returned} ≠ {results}")
+    if _canonical(actual.getroot()) != _canonical(expected):
+        errors.append("utils.update_* : documents différents (C14N)")
+    return errors
+
+
+def _canonical(elem) -> bytes:
+    return etree.tostring(elem, method='c14n')
+
+
+# ============================================================================
+# COMPARAISON
+# ============================================================================
+
+def check(name: str, data: bytes, commandes: dict) -> bool:
+    parser = etree.XMLParser(encoding='iso-8859-1', remove_blank_text=False)
+    root = etree.parse(io.BytesIO(data), parser).getroot()
+    plan = rules.compile_plan(rules.BUILTIN_RULES)
+    extended = rules.compile_plan(rules.BUILTIN_RULES + EXTRA_RULES)
+
+    errors = check_wrappers(root)
+    assignments = [elem for elem in root.iter(ASSIGNMENT_TAG) if next(elem.iterancestors(ASSIGNMENT_TAG), None) is None]
+    corrected = 0
+    for number, assignment in enumerate(assignments, 1):
+        targets = extended.resolve(assignment)
+        for path in extended.paths:
+            if targets[path] is not reference_find(assignment, path):
+                errors.append(f"Assignment[{number}] {path} résolu différemment")
+
+        order_id = targets['orderId']
+        numero = order_id.text.strip() if order_id is not None and order_id.text else None
+        commande = commandes.get(numero)
+        if not commande:
+            continue
+        expected, expected_counts = legacy_correct(assignment, commande)
+        counts = {}
+        plan.apply(assignment, commande, counts=counts)
+        corrected += 1
+        if counts != expected_counts:
+            errors.append(f"Assignment[{number}] compteurs {counts} ≠ {expected_counts}")
+        if _canonical(assignment) != _canonical(expected):
+            errors.append(f"Assignment[{number}] blocs différents (C14N)")
+
+    if errors:
+        print(f"❌ {name} : " + ' ; '.join(errors[:5]) + (f" (+{len(errors) - 5})" if len(errors) > 5 else ""))
+        return False
+    print(f"✅ {name} : {len(assignments)} contrats résolus, {corrected} corrigés à l'identique")
+    return True
+
+
+def timing(assignments: int):
+    data = xmlgen.generate_bytes(assignments)
+    commande = {
+        'codePoste': '4FACO2', 'codeCycle': 'VA EQUIPE B 5X8',
+        'qualification': 'CARISTE', 'dateDebut': '2026-07-01', 'client': 'VERALLIA',
+    }
+    for label, rule_set in (
+        (f"{len(rules.BUILTIN_RULES)} règles", rules.BUILTIN_RULES),
+        (f"{len(rules.BUILTIN_RULES) + len(EXTRA_RULES)} règles", rules.BUILTIN_RULES + EXTRA_RULES),
+    ):
+        plan = rules.compile_plan(rule_set)
+        best = None
+        for _ in range(3):
+            root = etree.fromstring(data)
+            blocks = list(root.iter(ASSIGNMENT_TAG))
+            started = time.perf_counter()
+            for assignment in blocks:
+                plan.apply(assignment, commande, plan.resolve(assignment))
+            elapsed = time.perf_counter() - started
+            best = elapsed if best is None else min(best, elapsed)
+        print(f"⏱️ {label:<10}{len(plan.tags):>3} balises suivies  {best / assignments * 1e6:6.1f} µs/contrat")
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Test de parité du moteur de règles")
+    parser.add_argument('--seeds', type=int, default=20, help="Nombre de fichiers synthétiques")
+    parser.add_argument('--timing', type=int, default=20000, help="Contrats du fichier de mesure (0 : aucun)")
+    args = parser.parse_args(argv)
+
+    ok = True
+    for name, text in EDGE_CASES.items():
+        ok &= check(name, text.encode('iso-8859-1'), EDGE_ORDERS)
+
+    numeros = [f'{n:06d}' for n in range(1800, 2400)]
+    for seed in range(args.seeds):
+        data = xmlgen.generate_bytes(
+            50 + seed * 10,
+            seed=seed,
+            missing_job_code=(seed % 4) / 4,
+            missing_external_order=(seed % 3) / 3,
+            missing_staffing_shift=(seed % 5) / 5,
+            missing_order_id=(seed % 2) / 10,
+        )
+        commandes = {n: {'codePoste': f'P{n}', 'codeCycle': f'CYCLE {n}'} for n in numeros[::2]}
+        ok &= check(f"xmlgen graine {seed}", data, commandes)
+
+    if args.timing:
+        timing(args.timing)
+
+    print("\n✅ Règles à parité avec les corrections d'origine" if ok else "\n❌ Écarts détectés")
+    return 0 if ok else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,122 @@
+"""
+Test de charge du service de correction (service.py)
+
+Envoie un fichier synthétique (xmlgen) à /correct ou /analyze depuis
+plusieurs clients simultanés (une connexion HTTP persistante chacun) et
+affiche les latences (p50, p90, p99, max), le débit et le nombre de
+requêtes refusées par la file (503).
+
+Usage (depuis streamlit_app/, service lancé à part):
+    python service.py -j 4 &
+    python -m benchmarks.loadtest --concurrency 8 --requests 200
+    python -m benchmarks.loadtest --concurrency 32 --contracts 5000 --endpoint analyze
+"""
+
+import argparse
+import http.client
+import json
+import statistics
+import sys
+import threading
+import time
+from urllib.parse import urlsplit
+
+from benchmarks import xmlgen
+
+
+DEFAULT_URL = 'http://127.0.0.1:8502'
+
+
+def percentile(values: list, fraction: float) -> float:
+    """Percentile par rang le plus proche (valeurs triées)"""
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, max(0, round(fraction * len(values)) - 1))]
+
+
+def _client(url, path: str, data: bytes, count: int, latencies: list, statuses: dict, lock: threading.Lock):
+    connection = http.client.HTTPConnection(url.hostname, url.port or 80, timeout=600)
+    headers = {'Content-Type': 'application/xml'}
+    try:
+        for _ in range(count):
+            started = time.perf_counter()
+            connection.request('POST', path, body=data, headers=headers)
+            response = connection.getresponse()
+            response.read()
+            elapsed = time.perf_counter() - started
+            with lock:
+                statuses[response.status] = statuses.get(response.status, 0) + 1
+                if response.status == 200:
+                    latencies.append(elapsed)
+    finally:
+        connection.close()
+
+
+def run(url: str, endpoint: str, data: bytes, concurrency: int, requests: int, validate: bool) -> dict:
+    """Lance la charge ; retourne latences (s) et codes HTTP"""
+    parsed = urlsplit(url)
+    path = f'/{endpoint}' + ('?validate=1' if validate else '')
+    latencies, statuses, lock = [], {}, threading.Lock()
+    per_client = [requests // concurrency + (1 if n < requests % concurrency else 0) for n in range(concurrency)]
+
+    started = time.perf_counter()
+    threads = [
+        threading.Thread(target=_client, args=(parsed, path, data, count, latencies, statuses, lock))
+        for count in per_client if count
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        'requetes': sum(statuses.values()),
+        'ok': len(latencies),
+        'refusees_503': statuses.get(503, 0),
+        'statuts': statuses,
+        'duree_s': elapsed,
+        'debit_req_s': len(latencies) / elapsed if elapsed else 0.0,
+        'p50_ms': percentile(latencies, 0.50) * 1000,
+        'p90_ms': percentile(latencies, 0.90) * 1000,
+        'p99_ms': percentile(latencies, 0.99) * 1000,
+        'max_ms': latencies[-1] * 1000 if latencies else 0.0,
+        'moyenne_ms': statistics.fmean(latencies) * 1000 if latencies else 0.0,
+    }
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Test de charge du service de correction")
+    parser.add_argument('--url', default=DEFAULT_URL, help=f"Adresse du service (défaut : {DEFAULT_URL})")
+    parser.add_argument('--endpoint', choices=('correct', 'analyze'), default='correct')
+    parser.add_argument('-c', '--concurrency', type=int, default=8, help="Clients simultanés")
+    parser.add_argument('-n', '--requests', type=int, default=100, help="Nombre total de requêtes")
+    parser.add_argument('--contracts', type=int, default=1000, help="Contrats du fichier envoyé")
+    parser.add_argument('--validate', action='store_true', help="Validation HR-XML pendant la correction")
+    parser.add_argument('--json', action='store_true', help="Résultat au format JSON")
+    args = parser.parse_args(argv)
+
+    data = xmlgen.generate_bytes(args.contracts)
+    result = run(args.url, args.endpoint, data, max(1, args.concurrency), args.requests, args.validate)
+
+    if args.json:
+        print(json.dumps(result, indent=2))
+    else:
+        print(
+            f"📦 {args.contracts} contrats ({len(data) / (1024 * 1024):.1f} Mo) → /{args.endpoint}, "
+            f"{args.concurrency} clients, {result['requetes']} requêtes en {result['duree_s']:.2f}s"
+        )
+        print(
+            f"⏱️ p50 {result['p50_ms']:.1f} ms | p90 {result['p90_ms']:.1f} ms | "
+            f"p99 {result['p99_ms']:.1f} ms | max {result['max_ms']:.1f} ms"
+        )
+        print(f"🚀 {result['debit_req_s']:.1f} requêtes/s, {result['refusees_503']} refusées (file pleine)")
+        errors = {status: count for status, count in result['statuts'].items() if status not in (200, 503)}
+        if errors:
+            print(f"❌ Réponses en erreur : {errors}")
+    return 0 if result['ok'] else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
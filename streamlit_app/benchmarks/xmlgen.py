@@ -0,0 +1,188 @@
+"""
+Générateur de fichiers HR-XML synthétiques (format Osmose)
+
+Produit un fichier de 1 à N blocs <Assignment> en ISO-8859-1, avec une part
+configurable de contrats sans CustomerJobCode, sans ExternalOrderNumber ou
+sans StaffingShift. La génération est déterministe (graine fixe).
+
+Usage (depuis streamlit_app/):
+    python -m benchmarks.xmlgen 10000 /tmp/export_10k.xml
+"""
+
+import argparse
+import io
+import random
+
+
+# ============================================================================
+# GABARITS
+# ============================================================================
+
+HEADER = (
+    '<?xml version="1.0" encoding="ISO-8859-1"?>\n'
+    '<Envelope xmlns="http://ns.hr-xml.org/2004-08-02" version="01.00">\n'
+    '  <Sender>\n'
+    '    <Id>OSMOSE</Id>\n'
+    '  </Sender>\n'
+    '  <Packet>\n'
+    '    <PacketInfo packetType="data">\n'
+    '      <PacketId>1</PacketId>\n'
+    '    </PacketInfo>\n'
+    '    <Payload>\n'
+)
+
+FOOTER = (
+    '    </Payload>\n'
+    '  </Packet>\n'
+    '</Envelope>\n'
+)
+
+ASSIGNMENT = (
+    '      <Assignment>\n'
+    '        <AssignmentId idOwner="RANDSTAD">\n'
+    '          <IdValue>{contrat}</IdValue>\n'
+    '        </AssignmentId>\n'
+    '        <ReferenceInformation>\n'
+    '{order_id}'
+    '          <StaffingSupplierId>\n'
+    '            <IdValue>RANDSTAD</IdValue>\n'
+    '          </StaffingSupplierId>\n'
+    '        </ReferenceInformation>\n'
+    '        <CustomerReportingRequirements>\n'
+    '          <DepartmentCode>VAUXROT</DepartmentCode>\n'
+    '{job_code}'
+    '{external_order}'
+    '          <CostCenterCode>{cost_center}</CostCenterCode>\n'
+    '        </CustomerReportingRequirements>\n'
+    '        <HumanResource>\n'
+    '          <PersonName>\n'
+    '            <GivenName>{prenom}</GivenName>\n'
+    '            <FamilyName>{nom}</FamilyName>\n'
+    '          </PersonName>\n'
+    '        </HumanResource>\n'
+    '        <StaffingPosition>\n'
+    '          <PositionTitle>CONDUCTEUR MÉCANICIEN</PositionTitle>\n'
+    '        </StaffingPosition>\n'
+    '{staffing_shift}'
+    '        <AssignmentDateRange>\n'
+    '          <StartDate>2026-06-01</StartDate>\n'
+    '          <ExpectedEndDate>2026-06-30</ExpectedEndDate>\n'
+    '        </AssignmentDateRange>\n'
+    '      </Assignment>\n'
+)
+
+ORDER_ID = (
+    '          <OrderId idOwner="PIXID">\n'
+    '            <IdValue>{numero}</IdValue>\n'
+    '          </OrderId>\n'
+)
+
+JOB_CODE = '          <CustomerJobCode>{code}</CustomerJobCode>\n'
+
+EXTERNAL_ORDER = '          <ExternalOrderNumber>{numero}</ExternalOrderNumber>\n'
+
+STAFFING_SHIFT = (
+    '        <StaffingShift shiftPeriod="weekly">\n'
+    '          <Id>\n'
+    '            <IdValue name="HORAIRE">{cycle}</IdValue>\n'
+    '          </Id>\n'
+    '          <Hours>35</Hours>\n'
+    '        </StaffingShift>\n'
+)
+
+PRENOMS = ['Jérôme', 'Hélène', 'François', 'Zoé', 'Noël', 'Amélie']
+NOMS = ['DUPONT', 'LEFÈVRE', 'MARTIN', 'GARÇON', 'BERNARD', 'PETIT']
+
+
+# ============================================================================
+# GÉNÉRATION
+# ============================================================================
+
+def generate(
+    output,
+    assignments: int,
+    numeros: list = None,
+    missing_job_code: float = 0.3,
+    missing_external_order: float = 0.2,
+    missing_staffing_shift: float = 0.1,
+    missing_order_id: float = 0.0,
+    seed: int = 42,
+) -> int:
+    """
+    Écrit un fichier HR-XML synthétique
+
+    Args:
+        output: Fichier binaire de sortie
+        assignments: Nombre de blocs <Assignment>
+        numeros: Numéros de commande à utiliser (défaut : 001800 à 002399)
+        missing_*: Proportion de contrats sans la balise correspondante
+        seed: Graine du générateur pseudo-aléatoire
+
+    Returns:
+        Nombre d'octets écrits
+    """
+    rng = random.Random(seed)
+    numeros = numeros or [f'{n:06d}' for n in range(1800, 2400)]
+    written = 0
+
+    def write(text: str):
+        nonlocal written
+        data = text.encode('iso-8859-1')
+        output.write(data)
+        written += len(data)
+
+    write(HEADER)
+    for i in range(assignments):
+        numero = rng.choice(numeros)
+        write(ASSIGNMENT.format(
+            contrat=f'C{i:08d}',
+            order_id='' if rng.random() < missing_order_id else ORDER_ID.format(numero=numero),
+            job_code='' if rng.random() < missing_job_code else JOB_CODE.format(code=f'OLD{i % 97}'),
+            external_order='' if rng.random() < missing_external_order else EXTERNAL_ORDER.format(numero=numero),
+            cost_center=f'CC{i % 13:03d}',
+            prenom=rng.choice(PRENOMS),
+            nom=rng.choice(NOMS),
+            staffing_shift='' if rng.random() < missing_staffing_shift else STAFFING_SHIFT.format(cycle='35H'),
+        ))
+    write(FOOTER)
+    return written
+
+
+def generate_bytes(assignments: int, **kwargs) -> bytes:
+    """Variante en mémoire de generate()"""
+    output = io.BytesIO()
+    generate(output, assignments, **kwargs)
+    return output.getvalue()
+
+
+# ============================================================================
+# POINT D'ENTRÉE
+# ============================================================================
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Génère un fichier HR-XML synthétique")
+    parser.add_argument('assignments', type=int, help="Nombre de blocs <Assignment>")
+    parser.add_argument('output', help="Fichier XML à écrire")
+    parser.add_argument('--missing-job-code', type=float, default=0.3)
+    parser.add_argument('--missing-external-order', type=float, default=0.2)
+    parser.add_argument('--missing-staffing-shift', type=float, default=0.1)
+    parser.add_argument('--missing-order-id', type=float, default=0.0)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args(argv)
+
+    with open(args.output, 'wb') as f:
+        size = generate(
+            f,
+            args.assignments,
+            missing_job_code=args.missing_job_code,
+            missing_external_order=args.missing_external_order,
+            missing_staffing_shift=args.missing_staffing_shift,
+            missing_order_id=args.missing_order_id,
+            seed=args.seed,
+        )
+    print(f"✅ {args.assignments} contrats, {size / (1024 * 1024):.1f} Mo → {args.output}")
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
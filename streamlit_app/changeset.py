@@ -0,0 +1,140 @@
+"""
+VERALLIA Modificator - Rapport des modifications (change-set)
+Valeurs avant / après de chaque contrat corrigé, relevées par les moteurs
+de correction au moment où ils écrivent (aucune relecture du document),
+exportables en CSV / JSON et affichées sous forme de tableau pandas
+"""
+
+import csv
+import io
+import json
+
+
+# ============================================================================
+# CONFIGURATION
+# ============================================================================
+
+ACTION_CREATED = 'created'
+ACTION_UPDATED = 'updated'
+ACTION_SKIPPED = 'skipped'
+
+# Attribut name posé sur l'IdValue du cycle horaire
+CYCLE_NAME = 'CYCLE'
+
+# Colonnes du rapport (ordre des exports CSV)
+FIELDS = (
+    'assignment',
+    'numeroCommande',
+    'numeroContrat',
+    'customerJobCodeAvant',
+    'customerJobCodeApres',
+    'customerJobCodeAction',
+    'cycleAvant',
+    'cycleApres',
+    'cycleNameAvant',
+    'cycleNameApres',
+    'cycleAction',
+)
+
+# Intitulés du tableau affiché dans l'application
+COLUMN_LABELS = {
+    'assignment': 'N°',
+    'numeroCommande': 'Commande',
+    'numeroContrat': 'Contrat',
+    'customerJobCodeAvant': 'CustomerJobCode avant',
+    'customerJobCodeApres': 'CustomerJobCode après',
+    'customerJobCodeAction': 'CustomerJobCode',
+    'cycleAvant': 'Cycle avant',
+    'cycleApres': 'Cycle après',
+    'cycleNameAvant': 'name avant',
+    'cycleNameApres': 'name après',
+    'cycleAction': 'Cycle',
+}
+
+ACTION_LABELS = {
+    ACTION_CREATED: 'créé',
+    ACTION_UPDATED: 'mis à jour',
+    ACTION_SKIPPED: 'absent',
+}
+
+
+# ============================================================================
+# ENTRÉES DU RAPPORT
+# ============================================================================
+
+def make_change(number: int, numero: str, contrat: str, commande: dict,
+                job_code_before: str, job_code_action: str,
+                cycle_before: str, cycle_name_before: str, cycle_found: bool) -> dict:
+    """
+    Entrée du rapport pour un contrat corrigé
+
+    Args:
+        number: Position du bloc <Assignment> dans le fichier (à partir de 1)
+        numero: Numéro de commande du bloc
+        contrat: Numéro de contrat (AssignmentId/IdValue), ou None
+        commande: Valeurs appliquées {codePoste, codeCycle}
+        job_code_before: Texte de CustomerJobCode avant correction
+        job_code_action: ACTION_UPDATED, ACTION_CREATED ou ACTION_SKIPPED
+            (ni CustomerJobCode ni CustomerReportingRequirements)
+        cycle_before: Texte de l'IdValue du cycle avant correction
+        cycle_name_before: Attribut name de cet IdValue avant correction
+        cycle_found: Vrai si le bloc a un IdValue de cycle (corrigé)
+
+    Returns:
+        dict (clés FIELDS)
+    """
+    return {
+        'assignment': number,
+        'numeroCommande': numero,
+        'numeroContrat': contrat,
+        'customerJobCodeAvant': job_code_before,
+        'customerJobCodeApres': commande.get('codePoste') if job_code_action != ACTION_SKIPPED else None,
+        'customerJobCodeAction': job_code_action,
+        'cycleAvant': cycle_before,
+        'cycleApres': commande.get('codeCycle') if cycle_found else None,
+        'cycleNameAvant': cycle_name_before,
+        'cycleNameApres': CYCLE_NAME if cycle_found else None,
+        'cycleAction': ACTION_UPDATED if cycle_found else ACTION_SKIPPED,
+    }
+
+
+def summarize(changes: list) -> dict:
+    """Nombre de contrats par (champ, action), ex. {('CustomerJobCode', 'created'): 12}"""
+    counts = {}
+    for change in changes:
+        for field, key in (('CustomerJobCode', 'customerJobCodeAction'), ('CycleHoraire', 'cycleAction')):
+            counts[(field, change[key])] = counts.get((field, change[key]), 0) + 1
+    return counts
+
+
+# ============================================================================
+# EXPORTS
+# ============================================================================
+
+def write_csv(changes, output):
+    """Écrit le rapport CSV dans un fichier texte, entrée par entrée"""
+    writer = csv.DictWriter(output, fieldnames=FIELDS, delimiter=';', lineterminator='\n')
+    writer.writeheader()
+    writer.writerows(changes)
+
+
+def to_csv(changes: list) -> bytes:
+    """Rapport CSV (UTF-8 avec BOM, séparateur « ; » : ouverture directe dans Excel)"""
+    output = io.StringIO()
+    write_csv(changes, output)
+    return output.getvalue().encode('utf-8-sig')
+
+
+def to_json(changes: list) -> bytes:
+    """Rapport JSON (liste d'objets, clés FIELDS)"""
+    return json.dumps(changes, ensure_ascii=False, indent=2).encode('utf-8')
+
+
+def to_dataframe(changes: list):
+    """Tableau pandas du rapport, avec les intitulés de l'application"""
+    import pandas as pd
+
+    frame = pd.DataFrame(changes, columns=FIELDS)
+    for column in ('customerJobCodeAction', 'cycleAction'):
+        frame[column] = frame[column].map(ACTION_LABELS)
+    return frame.rename(columns=COLUMN_LABELS)
@@ -0,0 +1,279 @@
+"""
+VERALLIA Modificator - Compaction de la base de commandes
+Replie l'historique (append-only) de commandes_extraites.json en un état
+courant par numéro de commande : suppressions, remplacements, doublons et
+enregistrements sans numéro sont retirés et tracés dans un journal d'audit
+
+Usage:
+    python compaction.py ../data/commandes_extraites.json commandes_compactees.json
+    python compaction.py ../data/commandes_extraites.json commandes_compactees.json --audit audit.jsonl
+"""
+
+import argparse
+import glob
+import json
+import os
+import sys
+import tempfile
+
+from order_store import _record_sort_key
+from snapshot import DEFAULT_CACHE_DIR, parse_commandes
+
+
+# ============================================================================
+# CONFIGURATION
+# ============================================================================
+
+FORMAT_VERSION = 1
+
+DEFAULT_COMPACTED_DIR = os.path.join(DEFAULT_CACHE_DIR, 'compacted')
+
+# Sujet des emails d'annulation Pixid (« PIXID - Suppression de Commande - ... »)
+DELETION_SUBJECT = 'suppression de commande'
+
+# Actions du journal d'audit
+ACTION_CREATED = 'creation'
+ACTION_SUPERSEDED = 'remplacement'
+ACTION_DELETED = 'suppression'
+ACTION_DELETED_UNKNOWN = 'suppression_sans_commande'
+ACTION_RECREATED = 'recreation'
+ACTION_DUPLICATE = 'doublon'
+ACTION_NO_NUMBER = 'sans_numero'
+
+
+def is_deletion(commande: dict) -> bool:
+    """Vrai si l'enregistrement provient d'un email de suppression de commande"""
+    return DELETION_SUBJECT in (commande.get('emailSubject') or '').lower()
+
+
+# ============================================================================
+# COMPACTION
+# ============================================================================
+
+class Compaction:
+    """
+    État courant de la base de commandes
+
+    - commandes : une commande vivante par numéro (la plus récente)
+    - deleted : numéro → enregistrement de suppression (pierre tombale),
+      pour les commandes dont la dernière opération est une suppression
+    - audit : une entrée par enregistrement de l'historique, dans l'ordre
+      d'application
+    - stats : compteurs du repli
+    """
+
+    def __init__(self, commandes: list, deleted: dict, audit: list, stats: dict):
+        self.commandes = commandes
+        self.deleted = deleted
+        self.audit = audit
+        self.stats = stats
+
+    def to_dict(self) -> dict:
+        """Snapshot compacté (sans le journal d'audit)"""
+        return {
+            'version': FORMAT_VERSION,
+            'stats': self.stats,
+            'commandes': self.commandes,
+            'deleted': self.deleted,
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> 'Compaction':
+        """Snapshot compacté, ou None s'il est d'un autre format"""
+        if not isinstance(data, dict) or data.get('version') != FORMAT_VERSION:
+            return None
+        return cls(data['commandes'], data['deleted'], [], data['stats'])
+
+
+def _audit_entry(commande: dict, action: str, replaces: dict = None) -> dict:
+    return {
+        'numeroCommande': commande.get('numeroCommande'),
+        'emailId': commande.get('emailId'),
+        'dateExtraction': commande.get('dateExtraction'),
+        'action': action,
+        'remplace': replaces.get('emailId') if replaces else None,
+    }
+
+
+def compact(commandes: list) -> Compaction:
+    """
+    Replie l'historique des commandes en un état courant
+
+    Les enregistrements sont appliqués par dateExtraction croissante
+    (emailId à égalité, comme OrderIndex) :
+    - un email de suppression retire la commande (pierre tombale) ;
+    - une commande plus récente remplace la précédente, y compris après
+      une suppression (recréation) ;
+    - un emailId déjà vu et les enregistrements sans numeroCommande sont
+      ignorés.
+
+    Args:
+        commandes: Liste brute issue de commandes_extraites.json
+
+    Returns:
+        Compaction
+    """
+    valid = [c for c in commandes or [] if c is not None and isinstance(c, dict)]
+    current = {}
+    deleted = {}
+    audit = []
+    seen_emails = set()
+    stats = {
+        'enregistrements': len(valid),
+        'commandes': 0,
+        'supprimees': 0,
+        'remplacements': 0,
+        'doublons': 0,
+        'sansNumero': 0,
+    }
+
+    for commande in sorted(valid, key=_record_sort_key):
+        email_id = commande.get('emailId')
+        if email_id and email_id in seen_emails:
+            stats['doublons'] += 1
+            audit.append(_audit_entry(commande, ACTION_DUPLICATE))
+            continue
+        if email_id:
+            seen_emails.add(email_id)
+
+        numero = commande.get('numeroCommande')
+        if not numero:
+            stats['sansNumero'] += 1
+            audit.append(_audit_entry(commande, ACTION_NO_NUMBER))
+            continue
+
+        previous = current.get(numero)
+        if is_deletion(commande):
+            if previous is not None:
+                del current[numero]
+                audit.append(_audit_entry(commande, ACTION_DELETED, previous))
+            else:
+                audit.append(_audit_entry(commande, ACTION_DELETED_UNKNOWN))
+            deleted[numero] = commande
+        elif previous is not None:
+            current[numero] = commande
+            stats['remplacements'] += 1
+            audit.append(_audit_entry(commande, ACTION_SUPERSEDED, previous))
+        else:
+            current[numero] = commande
+            audit.append(_audit_entry(commande, ACTION_RECREATED if deleted.pop(numero, None) else ACTION_CREATED))
+
+    stats['commandes'] = len(current)
+    stats['supprimees'] = len(deleted)
+    return Compaction(list(current.values()), deleted, audit, stats)
+
+
+# ============================================================================
+# SNAPSHOTS COMPACTÉS SUR DISQUE
+# ============================================================================
+
+class CompactedStore:
+    """
+    Snapshots compactés, un par version de la base de commandes
+
+    <version>.json contient l'état courant (chargé par l'application à la
+    place de l'historique complet), <version>.audit.jsonl le journal
+    d'audit du repli. Seules les keep versions les plus récentes sont
+    conservées.
+    """
+
+    def __init__(self, compacted_dir: str = None, keep: int = 4):
+        self.compacted_dir = compacted_dir or DEFAULT_COMPACTED_DIR
+        self.keep = keep
+
+    def _path(self, version: str, suffix: str = '.json') -> str:
+        return os.path.join(self.compacted_dir, f'{version}{suffix}')
+
+    def _write_atomic(self, path: str, content: bytes):
+        fd, tmp_path = tempfile.mkstemp(dir=self.compacted_dir, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(content)
+        os.replace(tmp_path, path)
+
+    def load(self, version: str, loader) -> Compaction:
+        """
+        Snapshot compacté de cette version, construit au premier appel
+
+        La base a pu changer depuis la lecture de version : si le loader
+        retourne une autre version, la compaction est retournée sans être
+        enregistrée sous version.
+
+        Args:
+            version: Version (hash) de la base de commandes
+            loader: Fonction sans argument retournant (version, liste brute),
+                ex. MultiSourceSnapshot.load_versioned
+
+        Returns:
+            Compaction (journal d'audit vide si lue depuis le disque)
+        """
+        try:
+            with open(self._path(version), 'r', encoding='utf-8') as f:
+                compaction = Compaction.from_dict(json.load(f))
+            if compaction is not None:
+                return compaction
+        except (OSError, ValueError, KeyError):
+            pass
+
+        loaded_version, commandes = loader()
+        compaction = compact(commandes)
+        if loaded_version != version:
+            return compaction
+        os.makedirs(self.compacted_dir, exist_ok=True)
+        self._write_atomic(
+            self._path(version, '.audit.jsonl'),
+            ''.join(json.dumps(entry, ensure_ascii=False) + '\n' for entry in compaction.audit).encode('utf-8'),
+        )
+        self._write_atomic(self._path(version), json.dumps(compaction.to_dict(), ensure_ascii=False).encode('utf-8'))
+        self._prune()
+        return compaction
+
+    def audit(self, version: str) -> list:
+        """Journal d'audit du repli de cette version (vide si absent)"""
+        try:
+            with open(self._path(version, '.audit.jsonl'), 'r', encoding='utf-8') as f:
+                return [json.loads(line) for line in f if line.strip()]
+        except (OSError, ValueError):
+            return []
+
+    def _prune(self):
+        snapshots = sorted(glob.glob(os.path.join(self.compacted_dir, '*.json')), key=os.path.getmtime, reverse=True)
+        for path in snapshots[self.keep:]:
+            for stale in (path, path[:-len('.json')] + '.audit.jsonl'):
+                try:
+                    os.remove(stale)
+                except OSError:
+                    pass
+
+
+# ============================================================================
+# POINT D'ENTRÉE
+# ============================================================================
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Compacte commandes_extraites.json (une commande vivante par numéro)")
+    parser.add_argument('json_path', help="commandes_extraites.json")
+    parser.add_argument('output_path', help="Fichier JSON compacté à écrire")
+    parser.add_argument('--audit', help="Journal d'audit à écrire (JSON Lines)")
+    args = parser.parse_args(argv)
+
+    with open(args.json_path, 'rb') as f:
+        compaction = compact(parse_commandes(f.read()))
+
+    with open(args.output_path, 'w', encoding='utf-8') as f:
+        json.dump(compaction.commandes, f, ensure_ascii=False, indent=2)
+    if args.audit:
+        with open(args.audit, 'w', encoding='utf-8') as f:
+            for entry in compaction.audit:
+                f.write(json.dumps(entry, ensure_ascii=False) + '\n')
+
+    stats = compaction.stats
+    print(
+        f"✅ {stats['enregistrements']} enregistrements → {stats['commandes']} commandes "
+        f"({stats['supprimees']} supprimées, {stats['remplacements']} remplacements, "
+        f"{stats['doublons']} doublons, {stats['sansNumero']} sans numéro) → {args.output_path}"
+    )
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
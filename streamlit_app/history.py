@@ -0,0 +1,310 @@
+"""
+VERALLIA Modificator - Historique des corrections
+Base SQLite locale de toutes les corrections : fichier (nom, hash SHA-256),
+horodatage, version de la base de commandes et valeurs avant / après de
+chaque contrat corrigé (rapport changeset.py), interrogeable par numéro de
+commande, numéro de contrat et date
+
+Usage:
+    python history.py --commande 001815
+    python history.py --contrat C00001234 --depuis 2026-10-01 --jusqu-au 2026-10-07
+"""
+
+import argparse
+import os
+import sqlite3
+import sys
+import threading
+from contextlib import closing
+from datetime import date, datetime, timedelta
+
+import changeset
+from snapshot import DEFAULT_CACHE_DIR
+
+
+# ============================================================================
+# CONFIGURATION
+# ============================================================================
+
+SCHEMA_VERSION = 1
+
+DEFAULT_HISTORY_PATH = os.environ.get('VERALLIA_HISTORY_DB') or os.path.join(DEFAULT_CACHE_DIR, 'history.sqlite3')
+
+# Lignes par page de recherche
+PAGE_SIZE = 50
+
+# Cache de pages SQLite des écritures (Kio) : les index sur numéros de
+# commande et de contrat sont mis à jour à des positions dispersées
+WRITE_CACHE_KB = 64 * 1024
+
+# Origine d'une correction
+ORIGIN_APP = 'application'
+ORIGIN_BATCH = 'lot'
+
+TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+# Colonnes d'une correction (runs) ; les contrats (changes) reprennent
+# changeset.FIELDS, plus la correction et sa date
+RUN_FIELDS = (
+    'fileSha256',
+    'filename',
+    'startedAt',
+    'finishedAt',
+    'snapshotVersion',
+    'origin',
+    'assignments',
+    'contratsCorriges',
+    'corrections',
+)
+
+# La date de la correction est recopiée sur chaque contrat : chaque index
+# (commande, contrat, date) couvre aussi le tri des résultats, du plus
+# récent au plus ancien, et la pagination par curseur n'est qu'une
+# descente dans l'index, quelle que soit la profondeur de la page
+SCHEMA = f'''
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    {', '.join(f'{field} {"INTEGER" if field in ("assignments", "contratsCorriges", "corrections") else "TEXT"}'
+               for field in RUN_FIELDS)}
+);
+CREATE INDEX IF NOT EXISTS runs_file ON runs (fileSha256);
+CREATE INDEX IF NOT EXISTS runs_date ON runs (finishedAt);
+
+CREATE TABLE IF NOT EXISTS changes (
+    id INTEGER PRIMARY KEY,
+    run INTEGER NOT NULL REFERENCES runs (id),
+    correctedAt TEXT NOT NULL,
+    {', '.join(f'{field} {"INTEGER" if field == "assignment" else "TEXT"}' for field in changeset.FIELDS)}
+);
+CREATE INDEX IF NOT EXISTS changes_order ON changes (numeroCommande, correctedAt);
+CREATE INDEX IF NOT EXISTS changes_contract ON changes (numeroContrat, correctedAt);
+CREATE INDEX IF NOT EXISTS changes_date ON changes (correctedAt);
+'''
+
+_INSERT_RUN = f"INSERT INTO runs ({', '.join(RUN_FIELDS)}) VALUES ({', '.join('?' * len(RUN_FIELDS))})"
+_INSERT_CHANGE = (
+    f"INSERT INTO changes (run, correctedAt, {', '.join(changeset.FIELDS)}) "
+    f"VALUES (?, ?, {', '.join('?' * len(changeset.FIELDS))})"
+)
+
+# Colonnes des lignes de recherche
+_CHANGE_COLUMNS = ('id', 'correctedAt', *changeset.FIELDS)
+_RUN_COLUMNS = ('filename', 'fileSha256', 'snapshotVersion', 'origin')
+
+
+def now() -> str:
+    """Horodatage local au format de l'historique"""
+    return datetime.now().strftime(TIMESTAMP_FORMAT)
+
+
+# ============================================================================
+# STOCKAGE
+# ============================================================================
+
+class HistoryStore:
+    """
+    Historique des corrections (SQLite, mode WAL)
+
+    Chaque correction est écrite en une seule transaction à la fin du
+    passage. Une connexion est ouverte par opération : le même fichier peut
+    être partagé entre sessions, threads et processus.
+    """
+
+    def __init__(self, path: str = None):
+        self.path = path or DEFAULT_HISTORY_PATH
+        self._lock = threading.Lock()
+        self._ready = False
+
+    def _connect(self) -> sqlite3.Connection:
+        if not self._ready:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        connection = sqlite3.connect(self.path, timeout=30)
+        connection.execute('PRAGMA synchronous = NORMAL')
+        if not self._ready:
+            with self._lock:
+                if not self._ready:
+                    self._create(connection)
+                    self._ready = True
+        return connection
+
+    def _create(self, connection: sqlite3.Connection):
+        version = connection.execute('PRAGMA user_version').fetchone()[0]
+        if version == SCHEMA_VERSION:
+            return
+        if version:
+            raise RuntimeError(f"Historique au format {version} (attendu : {SCHEMA_VERSION}) : {self.path}")
+        connection.execute('PRAGMA journal_mode = WAL')
+        with connection:
+            connection.executescript(SCHEMA)
+            connection.execute(f'PRAGMA user_version = {SCHEMA_VERSION}')
+
+    # ------------------------------------------------------------------
+    # Écriture
+    # ------------------------------------------------------------------
+
+    def record(self, filename: str, input_sha256: str, snapshot_version: str, stats: dict, changes=None,
+               started_at: str = None, origin: str = ORIGIN_APP, finished_at: str = None) -> int:
+        """
+        Enregistre une correction et ses contrats corrigés
+
+        Args:
+            filename: Nom d'origine du fichier
+            input_sha256: Hash SHA-256 du XML d'entrée
+            snapshot_version: Version de la base de commandes appliquée
+            stats: Statistiques de la correction (assignments, contratsCorriges,
+                corrections)
+            changes: Entrées du rapport des modifications (itérable, lu une
+                fois : liste ou spool.SpooledRecords), ou None
+            started_at: Début de la correction (défaut : maintenant)
+            origin: ORIGIN_APP ou ORIGIN_BATCH
+            finished_at: Fin de la correction (défaut : maintenant)
+
+        Returns:
+            Identifiant de la correction
+        """
+        finished_at = finished_at or now()
+        run = {
+            'fileSha256': input_sha256,
+            'filename': filename,
+            'startedAt': started_at or finished_at,
+            'finishedAt': finished_at,
+            'snapshotVersion': snapshot_version,
+            'origin': origin,
+            'assignments': stats.get('assignments'),
+            'contratsCorriges': stats.get('contratsCorriges'),
+            'corrections': stats.get('corrections'),
+        }
+        with closing(self._connect()) as connection, connection:
+            connection.execute(f'PRAGMA cache_size = -{WRITE_CACHE_KB}')
+            run_id = connection.execute(_INSERT_RUN, [run[field] for field in RUN_FIELDS]).lastrowid
+            if changes:
+                connection.executemany(_INSERT_CHANGE, (
+                    (run_id, finished_at, *(change.get(field) for field in changeset.FIELDS))
+                    for change in changes
+                ))
+        return run_id
+
+    # ------------------------------------------------------------------
+    # Recherche
+    # ------------------------------------------------------------------
+
+    def search(self, numero_commande: str = None, numero_contrat: str = None, since: date = None,
+               until: date = None, cursor: tuple = None, limit: int = PAGE_SIZE) -> tuple:
+        """
+        Contrats corrigés, du plus récent au plus ancien (pagination par curseur)
+
+        Args:
+            numero_commande: Numéro de commande exact
+            numero_contrat: Numéro de contrat exact
+            since: Premier jour inclus
+            until: Dernier jour inclus
+            cursor: Curseur renvoyé avec la page précédente (None : première page)
+            limit: Lignes par page
+
+        Returns:
+            (lignes : dicts changeset.FIELDS + correctedAt, filename,
+            fileSha256, snapshotVersion, origin ; curseur de la page
+            suivante ou None)
+        """
+        conditions, parameters = [], []
+        for column, value in (('numeroCommande', numero_commande), ('numeroContrat', numero_contrat)):
+            if value:
+                conditions.append(f'c.{column} = ?')
+                parameters.append(value)
+        if since:
+            conditions.append('c.correctedAt >= ?')
+            parameters.append(since.isoformat())
+        upper = (until + timedelta(days=1)).isoformat() if until else None
+
+        rows = []
+        with closing(self._connect()) as connection:
+            if cursor:
+                # Suite de la même seconde, puis les secondes antérieures :
+                # deux descentes dans l'index plutôt qu'une comparaison
+                # (date, id) qu'il ne sait pas prendre comme borne. Le
+                # curseur remplace la borne haute (SQLite n'en retient qu'une)
+                corrected_at, last_id = cursor
+                rows = self._page(connection, conditions + ['c.correctedAt = ?', 'c.id < ?'],
+                                  parameters + [corrected_at, last_id], 'c.id DESC', limit + 1)
+                upper = corrected_at
+            if upper:
+                conditions.append('c.correctedAt < ?')
+                parameters.append(upper)
+            if len(rows) <= limit:
+                rows += self._page(connection, conditions, parameters, 'c.correctedAt DESC, c.id DESC',
+                                   limit + 1 - len(rows))
+        next_cursor = None
+        if len(rows) > limit:
+            del rows[limit:]
+            next_cursor = (rows[-1]['correctedAt'], rows[-1]['id'])
+        return rows, next_cursor
+
+    @staticmethod
+    def _page(connection: sqlite3.Connection, conditions: list, parameters: list, order: str, limit: int) -> list:
+        query = (
+            f"SELECT {', '.join('c.' + column for column in _CHANGE_COLUMNS)}, "
+            f"{', '.join('r.' + column for column in _RUN_COLUMNS)} "
+            f"FROM changes c JOIN runs r ON r.id = c.run "
+            f"{'WHERE ' + ' AND '.join(conditions) if conditions else ''} ORDER BY {order} LIMIT ?"
+        )
+        columns = _CHANGE_COLUMNS + _RUN_COLUMNS
+        return [dict(zip(columns, row)) for row in connection.execute(query, [*parameters, limit])]
+
+    def runs(self, input_sha256: str = None, limit: int = PAGE_SIZE) -> list:
+        """Dernières corrections (toutes, ou celles d'un même fichier d'entrée)"""
+        query = f"SELECT id, {', '.join(RUN_FIELDS)} FROM runs"
+        parameters = []
+        if input_sha256:
+            query += ' WHERE fileSha256 = ?'
+            parameters.append(input_sha256)
+        with closing(self._connect()) as connection:
+            return [
+                dict(zip(('id', *RUN_FIELDS), row))
+                for row in connection.execute(query + ' ORDER BY id DESC LIMIT ?', [*parameters, limit])
+            ]
+
+
+# ============================================================================
+# AFFICHAGE
+# ============================================================================
+
+def to_dataframe(rows: list):
+    """Tableau pandas d'une page de recherche (intitulés de l'application)"""
+    frame = changeset.to_dataframe(rows)
+    frame.insert(0, 'Fichier', [row['filename'] for row in rows])
+    frame.insert(0, 'Date', [row['correctedAt'] for row in rows])
+    return frame
+
+
+# ============================================================================
+# POINT D'ENTRÉE
+# ============================================================================
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Recherche dans l'historique des corrections")
+    parser.add_argument('--db', default=DEFAULT_HISTORY_PATH, help="Fichier SQLite de l'historique")
+    parser.add_argument('--commande', help="Numéro de commande")
+    parser.add_argument('--contrat', help="Numéro de contrat")
+    parser.add_argument('--depuis', type=date.fromisoformat, help="Premier jour (AAAA-MM-JJ)")
+    parser.add_argument('--jusqu-au', dest='until', type=date.fromisoformat, help="Dernier jour (AAAA-MM-JJ)")
+    parser.add_argument('--limit', type=int, default=PAGE_SIZE, help="Nombre de lignes affichées")
+    args = parser.parse_args(argv)
+
+    if not os.path.exists(args.db):
+        print(f"❌ Aucun historique : {args.db}", file=sys.stderr)
+        return 1
+    rows, more = HistoryStore(args.db).search(args.commande, args.contrat, args.depuis, args.until,
+                                              limit=args.limit)
+    for row in rows:
+        print(
+            f"{row['correctedAt']}  {row['filename']}  commande {row['numeroCommande']}  "
+            f"contrat {row['numeroContrat'] or '-'}  "
+            f"CustomerJobCode {row['customerJobCodeAvant']!r} → {row['customerJobCodeApres']!r}  "
+            f"cycle {row['cycleAvant']!r} → {row['cycleApres']!r}"
+        )
+    print(f"📋 {len(rows)} contrats" + (" (suite disponible : --limit)" if more else ""))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
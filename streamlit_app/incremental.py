@@ -0,0 +1,182 @@
+"""
+VERALLIA Modificator - Correction incrémentale
+Manifeste par fichier des valeurs appliquées à chaque commande : au passage
+suivant, seuls les contrats dont la commande a changé (ou manquait) sont
+retouchés
+"""
+
+import hashlib
+import json
+import os
+import tempfile
+
+import rules
+from patcher import correct_document
+from snapshot import DEFAULT_CACHE_DIR
+from streaming import correct_stream
+
+
+# ============================================================================
+# CONFIGURATION
+# ============================================================================
+
+MANIFEST_VERSION = 1
+
+DEFAULT_MANIFEST_DIR = os.path.join(DEFAULT_CACHE_DIR, 'manifests')
+
+
+# ============================================================================
+# OUTILS
+# ============================================================================
+
+def _applied_values(commande: dict) -> list:
+    """Valeurs écrites dans un contrat pour cette commande (champs des règles actives)"""
+    return list(rules.order_values(commande).values())
+
+
+def fingerprint(path: str) -> list:
+    """Empreinte (taille, date de modification) d'un fichier"""
+    stat = os.stat(path)
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+# ============================================================================
+# MANIFESTE
+# ============================================================================
+
+class Manifest:
+    """
+    État de correction d'un fichier XML
+
+    orders associe chaque numéro de commande présent dans le fichier aux
+    valeurs [codePoste, codeCycle] appliquées à ses contrats, ou None si la
+    commande manquait dans la base lors du dernier passage.
+    """
+
+    def __init__(self, orders: dict = None, assignments: int = 0,
+                 source: list = None, destination: list = None):
+        self.orders = orders or {}
+        self.assignments = assignments
+        # Empreintes des fichiers après le dernier passage
+        self.source = source
+        self.destination = destination
+
+    @classmethod
+    def build(cls, stats: dict, commandes_map, previous: 'Manifest' = None) -> 'Manifest':
+        """
+        Manifeste d'un fichier après un passage de correct_stream
+
+        Une commande retirée de la base depuis le passage précédent garde les
+        valeurs déjà écrites dans le fichier.
+        """
+        orders = {}
+        for numero in stats['commandesTrouvees']:
+            orders[numero] = _applied_values(commandes_map.get(numero))
+        for numero in stats['commandesManquantes']:
+            orders[numero] = previous.orders.get(numero) if previous is not None else None
+        return cls(orders, stats['assignments'])
+
+    def dirty_orders(self, commandes_map) -> set:
+        """
+        Commandes dont les contrats doivent être retouchés : valeurs modifiées
+        dans la base, ou commandes auparavant manquantes et désormais présentes
+        """
+        dirty = set()
+        for numero, applied in self.orders.items():
+            commande = commandes_map.get(numero)
+            if commande and _applied_values(commande) != applied:
+                dirty.add(numero)
+        return dirty
+
+    def unchanged_stats(self, commandes_map) -> dict:
+        """Statistiques d'un fichier laissé intact (aucune commande modifiée)"""
+        trouvees = [numero for numero in self.orders if commandes_map.get(numero)]
+        found = set(trouvees)
+        return {
+            'assignments': self.assignments,
+            'contratsCorriges': 0,
+            'contratsIgnores': self.assignments,
+            'corrections': 0,
+            'commandesTrouvees': trouvees,
+            'commandesManquantes': [numero for numero in self.orders if numero not in found],
+        }
+
+    def to_dict(self) -> dict:
+        return {
+            'version': MANIFEST_VERSION,
+            'assignments': self.assignments,
+            'orders': self.orders,
+            'source': self.source,
+            'destination': self.destination,
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> 'Manifest':
+        """Manifeste sérialisé, ou None s'il est d'un autre format"""
+        if not isinstance(data, dict) or data.get('version') != MANIFEST_VERSION:
+            return None
+        return cls(data.get('orders'), data.get('assignments', 0),
+                   data.get('source'), data.get('destination'))
+
+
+class ManifestStore:
+    """
+    Manifestes sur disque, un par fichier corrigé (clé : chemin absolu)
+    """
+
+    def __init__(self, manifest_dir: str = None):
+        self.manifest_dir = manifest_dir or DEFAULT_MANIFEST_DIR
+
+    def _path(self, destination: str) -> str:
+        key = hashlib.sha1(os.path.abspath(destination).encode('utf-8')).hexdigest()[:16]
+        return os.path.join(self.manifest_dir, f'{key}.json')
+
+    def load(self, destination: str) -> Manifest:
+        """Manifeste du fichier corrigé, ou None"""
+        try:
+            with open(self._path(destination), 'r', encoding='utf-8') as f:
+                return Manifest.from_dict(json.load(f))
+        except (OSError, ValueError):
+            return None
+
+    def save(self, destination: str, manifest: Manifest):
+        os.makedirs(self.manifest_dir, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=self.manifest_dir, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(json.dumps(manifest.to_dict()).encode('utf-8'))
+        os.replace(tmp_path, self._path(destination))
+
+
+# ============================================================================
+# CORRECTION
+# ============================================================================
+
+def correct_incremental(source, destination, commandes_map, manifest: Manifest = None,
+                        patch: bool = True, validate: bool = False, changes: bool = False) -> tuple:
+    """
+    Corrige un fichier en ne retouchant que les commandes modifiées
+
+    Sans manifeste, la correction est complète. Avec un manifeste, source
+    doit être le XML déjà corrigé lors du passage précédent : seuls les
+    contrats des commandes de dirty_orders() sont réécrits, les autres sont
+    recopiés tels quels.
+
+    Args:
+        source: Chemin ou fichier binaire à lire
+        destination: Chemin ou fichier binaire de sortie
+        commandes_map: Mapping {numero_commande: {codePoste, codeCycle}}
+        manifest: Manifeste du passage précédent (optionnel)
+        patch: Patch d'octets (patcher) plutôt que re-sérialisation lxml
+        validate: Vérifie chaque bloc corrigé (règles de validation.py)
+        changes: Relève les valeurs avant / après (rapport changeset.py)
+
+    Returns:
+        (stats de correct_stream, nouveau manifeste sans empreintes)
+    """
+    only_orders = manifest.dirty_orders(commandes_map) if manifest is not None else None
+    if patch:
+        stats = correct_document(source, destination, commandes_map, only_orders, validate, changes)
+    else:
+        stats = correct_stream(source, destination, commandes_map, only_orders=only_orders, validate=validate,
+                               changes=changes)
+    return stats, Manifest.build(stats, commandes_map, manifest)
@@ -0,0 +1,547 @@
+"""
+VERALLIA Modificator - Ingestion des emails de commande Pixid
+Extrait des emails de commande (fichiers .eml ou mbox, ex. export Google
+Takeout) les champs de commandes_extraites.json et les ajoute à une base
+locale : JSON au même format (utilisable comme source par l'application et
+batch.py) et, en option, base compilée .vmdb indexée par numéro de commande.
+Les fichiers sont lus en parallèle, les champs extraits par lots, et seuls
+les emails jamais ingérés (emailId) sont traités à chaque passage.
+
+Usage:
+    python ingest.py /chemin/emails --store ../data/commandes_ingerees.json
+    python ingest.py Takeout/Mail/Pixid.mbox --store commandes.json --vmdb commandes.vmdb -j 8
+"""
+
+import argparse
+import bisect
+import hashlib
+import html
+import json
+import os
+import re
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from email.header import decode_header, make_header
+from email.parser import BytesParser
+from email.utils import parsedate_to_datetime
+
+from order_db import compile_commandes
+from order_store import _record_sort_key
+
+
+# ============================================================================
+# CONFIGURATION
+# ============================================================================
+
+STATE_VERSION = 1
+
+# Valeur du champ version des enregistrements (extracteur Apps Script : 2.x)
+EXTRACTOR_VERSION = 'ingest-1'
+
+CLIENT = 'VERALLIA'
+
+# Extensions lues dans les répertoires
+EML_EXTENSIONS = ('.eml',)
+MBOX_EXTENSIONS = ('.mbox', '.mbx')
+
+# Taille des lots confiés aux workers
+EML_BATCH = 256
+MBOX_CHUNK = 16 * 1024 * 1024
+
+# Emails de commande : « PIXID - Commande - … », « PIXID - Suppression de
+# Commande - … », « PIXID - Agence n°: … - Consultation terminée - … »
+PIXID_SUBJECT = re.compile(r'^\s*PIXID\b', re.IGNORECASE)
+
+# « Qualification: 626b/4FACO2/CONDUCTEUR MECANICIEN-4FACO2 - Code Postal: 02880 »
+QUALIFICATION_SUBJECT = re.compile(r'Qualification\s*:\s*(.+?)(?:\s+-\s+Code Postal\b|$)', re.IGNORECASE)
+
+# Champs lus dans le corps (une ligne « Libellé : valeur » chacun). Les
+# expressions sont réunies en une seule, appliquée une fois par lot
+BODY_FIELDS = {
+    'numeroCommande': r'N(?:°|º|o\.?|um[ée]ro)[ \t]*(?:de[ \t]+)?commande[ \t]*:?[ \t]*(?P<numeroCommande>\d+)',
+    'numeroContrat': r'N(?:°|º|o\.?|um[ée]ro)[ \t]*(?:de[ \t]+)?contrat[ \t]*:?[ \t]*(?P<numeroContrat>[A-Z0-9][\w-]*)',
+    'codePoste': r'Code[ \t]+poste[ \t]*:?[ \t]*(?P<codePoste>[^\s/]+)',
+    'codeCycle': r'Cycle(?:[ \t]+horaire)?[ \t]*:[ \t]*(?P<codeCycle>[^\r\n\x00]*?)[ \t]*$',
+    'dateDebut': r'Date[ \t]+de[ \t]+d[ée]but(?:[ \t]+de[ \t]+mission)?[ \t]*:?[ \t]*(?P<dateDebut>\d{2}/\d{2}/\d{4})',
+}
+BODY_PATTERN = re.compile(
+    '|'.join(f'^[ \\t]*(?:{pattern})' for pattern in BODY_FIELDS.values()),
+    re.IGNORECASE | re.MULTILINE,
+)
+
+# Séparateur des corps concaténés d'un lot (aucun champ ne le traverse)
+_SEPARATOR = '\n\x00\n'
+
+# Ligne « From » de Google Takeout : « From 1790238484834532459@xxx … »,
+# identifiant Gmail en décimal (emailId = le même en hexadécimal)
+_TAKEOUT_FROM = re.compile(rb'^From (\d+)@')
+_MBOX_FROM = re.compile(rb'^From ', re.MULTILINE)
+_MBOX_ESCAPED = re.compile(rb'^>(>*From )', re.MULTILINE)
+
+_HTML_BREAK = re.compile(r'<br\s*/?>|</(?:p|div|tr|li|h\d)\s*>', re.IGNORECASE)
+_HTML_TAG = re.compile(r'<[^>]+>')
+_HTML_HIDDEN = re.compile(r'<(style|script)\b.*?</\1\s*>', re.IGNORECASE | re.DOTALL)
+
+
+# ============================================================================
+# EXTRACTION
+# ============================================================================
+
+def extract_fields(texts: list) -> list:
+    """
+    Champs du corps de plusieurs emails, en un seul passage de BODY_PATTERN
+
+    Les corps sont concaténés ; chaque correspondance est rattachée à son
+    email par sa position. La première valeur de chaque champ l'emporte.
+
+    Args:
+        texts: Corps des emails (texte brut)
+
+    Returns:
+        Un dict {champ: valeur} par email
+    """
+    results = [{} for _ in texts]
+    if not texts:
+        return results
+    starts = []
+    position = 0
+    for text in texts:
+        starts.append(position)
+        position += len(text) + len(_SEPARATOR)
+    joined = _SEPARATOR.join(texts)
+    for match in BODY_PATTERN.finditer(joined):
+        fields = results[bisect.bisect_right(starts, match.start()) - 1]
+        field = match.lastgroup
+        if field not in fields:
+            fields[field] = match.group(field).strip()
+    return results
+
+
+def parse_subject(subject: str) -> dict:
+    """
+    Champs du sujet : qualification (« code/poste/libellé » → « code/poste
+    libellé », comme l'extracteur Apps Script) et code poste
+    """
+    match = QUALIFICATION_SUBJECT.search(subject)
+    if not match:
+        return {}
+    parts = match.group(1).strip().split('/', 2)
+    fields = {'qualification': ' '.join(['/'.join(parts[:2])] + parts[2:])}
+    if len(parts) > 1:
+        fields['codePoste'] = parts[1].strip()
+    return fields
+
+
+def html_to_text(content: str) -> str:
+    """Texte d'un corps HTML (une ligne par paragraphe, cellule ou <br>)"""
+    content = _HTML_HIDDEN.sub('', content)
+    content = _HTML_BREAK.sub('\n', content)
+    return html.unescape(_HTML_TAG.sub(' ', content))
+
+
+def hash_id(value: bytes) -> str:
+    """emailId dérivé d'un Message-ID (ou du message) hors export Gmail"""
+    return hashlib.sha1(value).hexdigest()[:16]
+
+
+def email_id(message, raw: bytes, from_line: bytes = None) -> str:
+    """
+    Identifiant stable d'un email
+
+    Identifiant Gmail de la ligne « From » d'un export Takeout (le même que
+    l'extracteur Apps Script), sinon empreinte du Message-ID, sinon du
+    message brut.
+    """
+    match = _TAKEOUT_FROM.match(from_line) if from_line else None
+    if match:
+        return format(int(match.group(1)), 'x')
+    message_id = message['Message-ID']
+    if message_id:
+        return hash_id(str(message_id).strip().encode('utf-8'))
+    return hash_id(raw)
+
+
+def _header(message, name: str) -> str:
+    """En-tête décodé (RFC 2047), sans retour à la ligne"""
+    value = message[name]
+    if value is None:
+        return ''
+    try:
+        value = str(make_header(decode_header(value)))
+    except (LookupError, ValueError, UnicodeError):
+        value = str(value)
+    return re.sub(r'\r?\n', '', value).strip()
+
+
+def _body_text(message) -> str:
+    """Corps texte de l'email (partie text/plain, sinon text/html)"""
+    parts = {}
+    for part in message.walk():
+        content_type = part.get_content_type()
+        if content_type in ('text/plain', 'text/html') and content_type not in parts and not part.get_filename():
+            parts[content_type] = part
+    part = parts.get('text/plain') or parts.get('text/html')
+    if part is None:
+        return ''
+    payload = part.get_payload(decode=True) or b''
+    try:
+        content = payload.decode(part.get_content_charset() or 'utf-8', 'replace')
+    except LookupError:
+        content = payload.decode('iso-8859-1')
+    return html_to_text(content) if part.get_content_subtype() == 'html' else content
+
+
+def _date_extraction(message, fallback: float) -> str:
+    try:
+        date = parsedate_to_datetime(str(message['Date']))
+        date = date.astimezone() if date.tzinfo else date
+    except (TypeError, ValueError, IndexError):
+        date = datetime.fromtimestamp(fallback)
+    return date.strftime('%Y-%m-%d %H:%M:%S')
+
+
+def parse_messages(raws: list, known_ids: frozenset = frozenset()) -> tuple:
+    """
+    Enregistrements de commande d'un lot d'emails bruts
+
+    Args:
+        raws: [(octets du message, ligne « From » mbox ou None, date de repli)]
+        known_ids: emailId déjà ingérés (ignorés)
+
+    Returns:
+        (enregistrements, compteurs {lus, dejaIngeres, ignores})
+    """
+    counts = {'lus': len(raws), 'dejaIngeres': 0, 'ignores': 0}
+    # Politique compat32 : seuls le sujet et l'expéditeur sont décodés,
+    # plusieurs fois plus rapide que l'analyse de tous les en-têtes
+    parser = BytesParser()
+    pending = []
+    for raw, from_line, fallback_time in raws:
+        # Export Takeout : email déjà ingéré reconnu sans l'analyser
+        match = _TAKEOUT_FROM.match(from_line) if from_line else None
+        if match and format(int(match.group(1)), 'x') in known_ids:
+            counts['dejaIngeres'] += 1
+            continue
+        message = parser.parsebytes(raw)
+        identifier = email_id(message, raw, from_line)
+        if identifier in known_ids:
+            counts['dejaIngeres'] += 1
+            continue
+        subject = _header(message, 'Subject')
+        if not PIXID_SUBJECT.match(subject):
+            counts['ignores'] += 1
+            continue
+        pending.append((message, identifier, subject, fallback_time))
+
+    bodies = extract_fields([_body_text(message) for message, _, _, _ in pending])
+    records = []
+    for (message, identifier, subject, fallback_time), body in zip(pending, bodies):
+        from_subject = parse_subject(subject)
+        records.append({
+            'numeroCommande': body.get('numeroCommande'),
+            'numeroContrat': body.get('numeroContrat'),
+            'codePoste': body.get('codePoste') or from_subject.get('codePoste'),
+            'codeCycle': body.get('codeCycle') or None,
+            'qualification': from_subject.get('qualification'),
+            'client': CLIENT,
+            'dateDebut': body.get('dateDebut'),
+            'dateExtraction': _date_extraction(message, fallback_time),
+            'emailSubject': subject,
+            'emailId': identifier,
+            'emailFrom': _header(message, 'From'),
+            'version': EXTRACTOR_VERSION,
+        })
+    return records, counts
+
+
+# ============================================================================
+# LECTURE DES FICHIERS (WORKERS)
+# ============================================================================
+
+_known_ids = frozenset()
+
+
+def _init_worker(known_ids: frozenset):
+    global _known_ids
+    _known_ids = known_ids
+
+
+def read_eml_batch(paths: list) -> tuple:
+    """
+    Lit et analyse un lot de fichiers .eml (exécuté dans un worker)
+
+    Returns:
+        (enregistrements, compteurs, {chemin: état du fichier})
+    """
+    raws = []
+    files = {}
+    for path in paths:
+        with open(path, 'rb') as f:
+            stat = os.fstat(f.fileno())
+            raws.append((f.read(), None, stat.st_mtime))
+        files[path] = {'size': stat.st_size, 'mtime': stat.st_mtime}
+    records, counts = parse_messages(raws, _known_ids)
+    return records, counts, files
+
+
+def read_mbox_range(path: str, start: int, end: int) -> tuple:
+    """
+    Lit et analyse les messages d'une tranche de fichier mbox (exécuté
+    dans un worker) ; start et end tombent sur des débuts de message
+
+    Returns:
+        (enregistrements, compteurs, {})
+    """
+    with open(path, 'rb') as f:
+        f.seek(start)
+        data = f.read(end - start)
+        mtime = os.fstat(f.fileno()).st_mtime
+    positions = [match.start() for match in _MBOX_FROM.finditer(data)]
+    raws = []
+    for begin, stop in zip(positions, positions[1:] + [len(data)]):
+        newline = data.find(b'\n', begin, stop)
+        if newline < 0:
+            continue
+        from_line = data[begin:newline].rstrip(b'\r')
+        raws.append((_MBOX_ESCAPED.sub(rb'\1', data[newline + 1:stop]), from_line, mtime))
+    records, counts = parse_messages(raws, _known_ids)
+    return records, counts, {}
+
+
+def mbox_boundaries(path: str, start: int, end: int, chunk_size: int = MBOX_CHUNK) -> list:
+    """Débuts de message (lignes « From ») découpant [start, end) en tranches d'environ chunk_size"""
+    boundaries = [start]
+    with open(path, 'rb') as f:
+        position = start + chunk_size
+        while position < end:
+            # Fin de la ligne en cours, puis prochaine ligne « From »
+            f.seek(position)
+            position += len(f.readline())
+            while position < end:
+                line = f.readline()
+                if line.startswith(b'From '):
+                    break
+                position += len(line)
+            if position >= end:
+                break
+            boundaries.append(position)
+            position += chunk_size
+    boundaries.append(end)
+    return boundaries
+
+
+# ============================================================================
+# BASE LOCALE
+# ============================================================================
+
+def _write_atomic(path: str, content: bytes):
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    with os.fdopen(fd, 'wb') as f:
+        f.write(content)
+    os.replace(tmp_path, path)
+
+
+class IngestStore:
+    """
+    Base locale des commandes ingérées
+
+    - <store>.json : enregistrements au format de commandes_extraites.json
+      (historique, un par email)
+    - <store>.state.json : avancement par fichier source (taille, date de
+      modification, position atteinte dans un mbox)
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.state_path = os.path.splitext(path)[0] + '.state.json'
+        self.commandes = []
+        self.files = {}
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            self.commandes = [c for c in data if isinstance(c, dict)] if isinstance(data, list) else []
+        except (OSError, ValueError):
+            pass
+        try:
+            with open(self.state_path, 'r', encoding='utf-8') as f:
+                state = json.load(f)
+            if isinstance(state, dict) and state.get('version') == STATE_VERSION:
+                self.files = state['files']
+        except (OSError, ValueError, KeyError):
+            pass
+
+    def known_ids(self) -> frozenset:
+        return frozenset(c['emailId'] for c in self.commandes if c.get('emailId'))
+
+    def add(self, records: list) -> int:
+        """Ajoute les enregistrements inconnus (emailId), du plus ancien au plus récent"""
+        known = set(self.known_ids())
+        added = []
+        for record in sorted(records, key=_record_sort_key):
+            if record['emailId'] not in known:
+                known.add(record['emailId'])
+                added.append(record)
+        self.commandes.extend(added)
+        return len(added)
+
+    def save(self, vmdb_path: str = None):
+        _write_atomic(self.path, json.dumps(self.commandes, ensure_ascii=False, indent=2).encode('utf-8'))
+        _write_atomic(
+            self.state_path,
+            json.dumps({'version': STATE_VERSION, 'files': self.files}, ensure_ascii=False).encode('utf-8'),
+        )
+        if vmdb_path:
+            _write_atomic(vmdb_path, compile_commandes(self.commandes))
+
+
+# ============================================================================
+# INGESTION
+# ============================================================================
+
+def collect_sources(inputs: list) -> tuple:
+    """Fichiers .eml et mbox des entrées (fichiers ou répertoires), triés"""
+    emls, mboxes = set(), set()
+    for item in inputs:
+        if os.path.isdir(item):
+            paths = [os.path.join(dirpath, name) for dirpath, _, names in os.walk(item) for name in names]
+        else:
+            paths = [item]
+        for path in paths:
+            lower = path.lower()
+            if lower.endswith(EML_EXTENSIONS):
+                emls.add(os.path.abspath(path))
+            elif lower.endswith(MBOX_EXTENSIONS) or (path == item and os.path.isfile(path)):
+                mboxes.add(os.path.abspath(path))
+    return sorted(emls), sorted(mboxes)
+
+
+def plan_units(store: IngestStore, emls: list, mboxes: list, full: bool = False) -> tuple:
+    """
+    Tâches de lecture : lots de .eml nouveaux ou modifiés, et tranches mbox
+    au-delà de la position déjà lue (un mbox ne grossit que par la fin)
+
+    Returns:
+        (tâches [(fonction, arguments)], états des mbox après lecture)
+    """
+    units = []
+    pending = []
+    for path in emls:
+        stat = os.stat(path)
+        known = store.files.get(path)
+        if full or not known or known.get('size') != stat.st_size or known.get('mtime') != stat.st_mtime:
+            pending.append(path)
+    for i in range(0, len(pending), EML_BATCH):
+        units.append((read_eml_batch, (pending[i:i + EML_BATCH],)))
+
+    mbox_states = {}
+    for path in mboxes:
+        stat = os.stat(path)
+        known = store.files.get(path) or {}
+        offset = known.get('offset', 0)
+        if full or offset > stat.st_size or known.get('mtime') is None:
+            offset = 0
+        elif known.get('size') == stat.st_size and known.get('mtime') == stat.st_mtime:
+            continue
+        boundaries = mbox_boundaries(path, offset, stat.st_size)
+        for start, end in zip(boundaries, boundaries[1:]):
+            if start < end:
+                units.append((read_mbox_range, (path, start, end)))
+        mbox_states[path] = {'size': stat.st_size, 'mtime': stat.st_mtime, 'offset': stat.st_size}
+    return units, mbox_states
+
+
+def ingest(inputs: list, store_path: str, vmdb_path: str = None, workers: int = 1, full: bool = False) -> dict:
+    """
+    Ingère les emails de commande des entrées dans la base locale
+
+    Args:
+        inputs: Fichiers .eml, mbox ou répertoires
+        store_path: Base JSON (créée si absente)
+        vmdb_path: Base compilée à régénérer (optionnel)
+        workers: Nombre de processus de lecture
+        full: Relit tous les fichiers (les emails déjà ingérés restent ignorés)
+
+    Returns:
+        Compteurs : fichiers, lus, dejaIngeres, ignores, nouveaux, sansNumero, total
+    """
+    store = IngestStore(store_path)
+    emls, mboxes = collect_sources(inputs)
+    units, mbox_states = plan_units(store, emls, mboxes, full)
+
+    known_ids = store.known_ids()
+    records = []
+    totals = {'fichiers': len(emls) + len(mboxes), 'lus': 0, 'dejaIngeres': 0, 'ignores': 0}
+    files = {}
+
+    if workers > 1 and len(units) > 1:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(known_ids,)) as pool:
+            results = list(pool.map(_run_unit, units))
+    else:
+        _init_worker(known_ids)
+        results = [_run_unit(unit) for unit in units]
+
+    for unit_records, counts, unit_files in results:
+        records.extend(unit_records)
+        files.update(unit_files)
+        for key, value in counts.items():
+            totals[key] += value
+
+    new = store.add(records)
+    store.files.update(files)
+    store.files.update(mbox_states)
+    if units or (vmdb_path and not os.path.exists(vmdb_path)):
+        store.save(vmdb_path)
+
+    totals['nouveaux'] = new
+    totals['dejaIngeres'] += len(records) - new
+    totals['sansNumero'] = sum(1 for record in records if not record['numeroCommande'])
+    totals['total'] = len(store.commandes)
+    return totals
+
+
+def _run_unit(unit: tuple) -> tuple:
+    function, arguments = unit
+    return function(*arguments)
+
+
+# ============================================================================
+# POINT D'ENTRÉE
+# ============================================================================
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Ingère les emails de commande Pixid (.eml, mbox) dans une base locale")
+    parser.add_argument('inputs', nargs='+', help="Fichiers .eml, mbox ou répertoires")
+    parser.add_argument('--store', required=True, help="Base JSON des commandes (format commandes_extraites.json)")
+    parser.add_argument('--vmdb', help="Base compilée .vmdb à régénérer")
+    parser.add_argument('-j', '--workers', type=int, default=os.cpu_count() or 1,
+                        help="Nombre de processus (défaut : nombre de cœurs)")
+    parser.add_argument('--full', action='store_true', help="Relit tous les fichiers, même inchangés")
+    args = parser.parse_args(argv)
+
+    started = time.perf_counter()
+    try:
+        totals = ingest(args.inputs, args.store, args.vmdb, max(1, args.workers), args.full)
+    except OSError as e:
+        print(f"❌ {e}", file=sys.stderr)
+        return 1
+    elapsed = time.perf_counter() - started
+
+    print(
+        f"📬 {totals['fichiers']} fichiers, {totals['lus']} emails lus : {totals['nouveaux']} nouveaux "
+        f"({totals['sansNumero']} sans numéro de commande), {totals['dejaIngeres']} déjà ingérés, "
+        f"{totals['ignores']} hors Pixid"
+    )
+    print(
+        f"📊 {totals['total']} enregistrements dans {args.store} — {elapsed:.2f}s"
+        + (f", {totals['lus'] / elapsed:.0f} emails/s" if totals['lus'] and elapsed else "")
+    )
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,324 @@
+"""
+VERALLIA Modificator - Traitement de plusieurs fichiers en arrière-plan
+Chaque fichier chargé devient un job (détection → correspondances →
+correction) exécuté dans un pool de processus ; les jobs survivent aux
+reruns Streamlit et les résultats sont regroupés dans une archive ZIP
+"""
+
+import io
+import multiprocessing
+import os
+import sqlite3
+import threading
+import time
+import zipfile
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from lxml import etree
+
+import history
+import incremental
+import result_cache
+import rules
+from metrics import METRICS
+from streaming import extract_all_order_numbers_from_xml
+
+
+# ============================================================================
+# CONFIGURATION
+# ============================================================================
+
+# Processus de correction (détection et correction sont CPU-bound)
+DEFAULT_WORKERS = int(os.environ.get('VERALLIA_UPLOAD_WORKERS', min(4, os.cpu_count() or 1)))
+
+# Jobs terminés conservés en mémoire (les plus anciens sont oubliés)
+MAX_FINISHED_JOBS = 64
+
+STATUS_QUEUED = 'queued'
+STATUS_SCANNING = 'scanning'
+STATUS_CORRECTING = 'correcting'
+STATUS_DONE = 'done'
+STATUS_ERROR = 'error'
+
+STATUS_LABELS = {
+    STATUS_QUEUED: "⏳ En attente",
+    STATUS_SCANNING: "🔍 Détection",
+    STATUS_CORRECTING: "⚙️ Correction",
+    STATUS_DONE: "✅ Terminé",
+    STATUS_ERROR: "❌ Erreur",
+}
+
+# Avancement affiché pour chaque étape
+STATUS_PROGRESS = {
+    STATUS_QUEUED: 0.0,
+    STATUS_SCANNING: 0.2,
+    STATUS_CORRECTING: 0.6,
+    STATUS_DONE: 1.0,
+    STATUS_ERROR: 1.0,
+}
+
+ZIP_CHUNK_SIZE = 1024 * 1024
+
+
+# ============================================================================
+# TRAVAIL DES WORKERS (processus du pool)
+# ============================================================================
+
+def _scan(data: bytes) -> tuple:
+    """Numéros de commande du fichier (lève ValueError s'il est mal formé)"""
+    METRICS.reset()
+    try:
+        orders = extract_all_order_numbers_from_xml(data)
+    except etree.XMLSyntaxError as e:
+        # Les erreurs lxml ne passent pas d'un processus à l'autre
+        raise ValueError(f"Fichier XML invalide : {e}") from None
+    return orders, METRICS.snapshot()
+
+
+def _correct(data: bytes, corrections_map: dict, manifest: dict = None) -> tuple:
+    """Corrige un fichier ; retourne (XML corrigé, stats, manifeste, mesures)"""
+    METRICS.reset()
+    output = io.BytesIO()
+    stats, new_manifest = incremental.correct_incremental(
+        io.BytesIO(data), output, corrections_map, incremental.Manifest.from_dict(manifest), validate=True,
+        changes=True
+    )
+    return output.getvalue(), stats, new_manifest.to_dict(), METRICS.snapshot()
+
+
+# ============================================================================
+# JOBS
+# ============================================================================
+
+class UploadJob:
+    """
+    Un fichier chargé et l'état de son traitement
+
+    La clé est celle du cache des résultats (contenu du fichier, version de
+    la base de commandes) : un même fichier renvoyé lors d'un rerun ou par
+    une autre session retrouve le job existant.
+    """
+
+    def __init__(self, key: str, filename: str, size: int):
+        self.key = key
+        self.filename = filename
+        self.size = size
+        self.status = STATUS_QUEUED
+        self.error = None
+        self.orders = []
+        self.found = []
+        self.missing = []
+        self.corrections = 0
+        self.violations = None
+        self.incremental = False
+        self.cached = False
+        self.result = None
+        self.submitted = time.time()
+        self.duration = None
+
+    @property
+    def finished(self) -> bool:
+        return self.status in (STATUS_DONE, STATUS_ERROR)
+
+    @property
+    def progress(self) -> float:
+        return STATUS_PROGRESS[self.status]
+
+    def summary(self) -> dict:
+        """Ligne du tableau d'avancement"""
+        return {
+            'Fichier': self.filename,
+            'Statut': STATUS_LABELS[self.status] + (" (cache)" if self.cached else ""),
+            'Commandes': len(self.orders),
+            'Trouvées': len(self.found),
+            'Manquantes': len(self.missing),
+            'Corrections': self.corrections,
+            'Écarts HR-XML': len(self.violations) if self.violations is not None else None,
+            'Durée (s)': round(self.duration, 2) if self.duration is not None else None,
+            'Erreur': self.error or '',
+        }
+
+
+class JobManager:
+    """
+    Pool de traitement partagé par toutes les sessions
+
+    Un thread par job enchaîne les étapes ; la détection et la correction
+    s'exécutent dans un pool de processus, la recherche des commandes dans
+    l'index (en mémoire) dans le processus principal. Les résultats sont
+    enregistrés dans le cache des résultats, et chaque correction dans
+    l'historique, comme pour un fichier unique.
+    """
+
+    def __init__(self, workers: int = DEFAULT_WORKERS, results: result_cache.ResultCache = None,
+                 history_store: history.HistoryStore = None):
+        self.workers = max(1, workers)
+        self.results = results
+        self.history = history_store
+        # spawn : pas de fork d'un serveur Streamlit multi-thread
+        self._pool = ProcessPoolExecutor(
+            max_workers=self.workers, mp_context=multiprocessing.get_context('spawn')
+        )
+        self._threads = ThreadPoolExecutor(max_workers=self.workers * 2, thread_name_prefix='upload')
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+
+    def submit(self, filename: str, data: bytes, index, version: str) -> UploadJob:
+        """
+        Lance le traitement d'un fichier, ou retourne le job déjà lancé
+        (y compris en erreur : un fichier invalide n'est pas retraité à
+        chaque rerun)
+
+        Args:
+            filename: Nom d'origine du fichier
+            data: Contenu XML
+            index: OrderIndex ou matching.OrderMatcher des commandes (méthode get)
+            version: Version de la base de commandes
+
+        Returns:
+            UploadJob
+        """
+        input_sha256 = result_cache.sha256_file(data)
+        key = result_cache.make_key(input_sha256, version)
+        with self._lock:
+            job = self._jobs.get(key)
+            if job is not None:
+                return job
+            job = UploadJob(key, filename, len(data))
+            self._jobs[key] = job
+            self._forget_finished()
+        self._threads.submit(self._run, job, data, input_sha256, index, version)
+        return job
+
+    def get(self, key: str) -> UploadJob:
+        with self._lock:
+            return self._jobs.get(key)
+
+    def _forget_finished(self):
+        finished = [key for key, job in self._jobs.items() if job.finished]
+        for key in finished[:max(0, len(finished) - MAX_FINISHED_JOBS)]:
+            del self._jobs[key]
+
+    # ------------------------------------------------------------------
+    # Étapes d'un job
+    # ------------------------------------------------------------------
+
+    def _run(self, job: UploadJob, data: bytes, input_sha256: str, index, version: str):
+        started = time.perf_counter()
+        try:
+            self._process(job, data, input_sha256, index, version)
+        except Exception as e:
+            job.error = str(e) or type(e).__name__
+        job.duration = time.perf_counter() - started
+        job.status = STATUS_ERROR if job.error else STATUS_DONE
+
+    def _process(self, job: UploadJob, data: bytes, input_sha256: str, index, version: str):
+        cached = self.results.get(job.key) if self.results is not None else None
+        if cached is not None:
+            job.result, stats = cached
+            job.orders = stats['commandes']
+            job.found = list(stats['commandesTrouvees'])
+            job.missing = stats['commandesManquantes']
+            job.corrections = stats['corrections']
+            job.violations = stats.get('violations')
+            job.cached = True
+            return
+
+        job.status = STATUS_SCANNING
+        started_at = history.now()
+        job.orders, snapshot = self._pool.submit(_scan, data).result()
+        METRICS.merge(snapshot)
+        if not job.orders:
+            raise ValueError("Aucun numéro de commande trouvé dans le XML")
+
+        corrections_map = {}
+        with METRICS.stage('match'):
+            for numero in job.orders:
+                commande = index.get(numero)
+                if commande:
+                    corrections_map[numero] = rules.order_values(commande)
+                else:
+                    job.missing.append(numero)
+        job.found = list(corrections_map)
+        if not corrections_map:
+            raise ValueError("Aucune commande trouvée dans la base de données")
+
+        # Fichier déjà corrigé avec une version antérieure de la base
+        previous = self.results.latest_for_input(input_sha256) if self.results is not None else None
+        manifest = incremental.Manifest.from_dict(previous[1].get('manifest')) if previous else None
+
+        if manifest is not None and not manifest.dirty_orders(corrections_map):
+            corrected_xml = previous[0]
+            stats = manifest.unchanged_stats(corrections_map)
+            stats['violations'] = previous[1].get('violations')
+            new_manifest = manifest.to_dict()
+        else:
+            job.status = STATUS_CORRECTING
+            corrected_xml, stats, new_manifest, snapshot = self._pool.submit(
+                _correct,
+                previous[0] if manifest is not None else data,
+                corrections_map,
+                manifest.to_dict() if manifest is not None else None,
+            ).result()
+            METRICS.merge(snapshot)
+        if self.history is not None:
+            try:
+                self.history.record(job.filename, input_sha256, version, stats, stats.get('changes'), started_at)
+            except sqlite3.Error:
+                # Le fichier corrigé reste disponible sans son entrée d'historique
+                METRICS.incr('history_errors')
+
+        job.incremental = manifest is not None
+        job.corrections = stats['corrections']
+        job.violations = stats.get('violations')
+        job.result = corrected_xml
+        if self.results is not None:
+            self.results.put(job.key, corrected_xml, {
+                'filename': job.filename,
+                'inputSha256': input_sha256,
+                'commandes': job.orders,
+                'commandesTrouvees': corrections_map,
+                'commandesManquantes': job.missing,
+                'corrections': job.corrections,
+                'manifest': new_manifest,
+                'violations': job.violations,
+            })
+
+
+# ============================================================================
+# ARCHIVE
+# ============================================================================
+
+def write_zip(entries, fileobj) -> int:
+    """
+    Écrit les fichiers corrigés dans une archive ZIP, entrée par entrée
+
+    Les noms d'origine sont conservés ; un nom en double reçoit un suffixe
+    (« export (2).xml »).
+
+    Args:
+        entries: Itérable de (nom de fichier, contenu bytes)
+        fileobj: Fichier binaire de sortie
+
+    Returns:
+        Nombre de fichiers écrits
+    """
+    used = set()
+    count = 0
+    with zipfile.ZipFile(fileobj, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+        for filename, content in entries:
+            name = os.path.basename(filename) or 'fichier.xml'
+            stem, ext = os.path.splitext(name)
+            n = 2
+            while name in used:
+                name = f'{stem} ({n}){ext}'
+                n += 1
+            used.add(name)
+
+            with archive.open(name, 'w') as entry:
+                view = memoryview(content)
+                for position in range(0, len(view), ZIP_CHUNK_SIZE):
+                    entry.write(view[position:position + ZIP_CHUNK_SIZE])
+            count += 1
+    return count
@@ -0,0 +1,164 @@
+"""
+VERALLIA Modificator - Rapprochement des numéros de commande
+Index multi-clés construit une fois par version de la base : numéro exact,
+numéro normalisé (espaces et zéros en tête ignorés) et identifiants
+secondaires (numeroContrat). Les numéros d'un fichier sont résolus en un
+seul passage, chaque rapprochement non exact étant expliqué
+"""
+
+
+# ============================================================================
+# CONFIGURATION
+# ============================================================================
+
+MATCH_EXACT = 'exact'
+MATCH_NORMALIZED = 'normalise'
+MATCH_CONTRACT = 'contrat'
+MATCH_AMBIGUOUS = 'ambigu'
+MATCH_MISSING = 'manquante'
+
+# Champs de commande servant d'identifiant secondaire
+ALTERNATE_FIELDS = ('numeroContrat',)
+
+
+def normalize(numero) -> str:
+    """
+    Clé normalisée d'un numéro : sans espaces, en majuscules, sans zéros
+    en tête (« 001815 », « 1815 » et « 1 815 » → « 1815 »)
+    """
+    key = ''.join(str(numero).split()).upper()
+    return key.lstrip('0') or ('0' if key else '')
+
+
+# ============================================================================
+# INDEX
+# ============================================================================
+
+class Match:
+    """Résolution d'un numéro de commande du fichier"""
+
+    __slots__ = ('numero', 'base', 'kind', 'explanation')
+
+    def __init__(self, numero: str, base: str, kind: str, explanation: str = None):
+        self.numero = numero
+        # Numéro de la commande retenue dans la base (None si aucune)
+        self.base = base
+        self.kind = kind
+        self.explanation = explanation
+
+    @property
+    def found(self) -> bool:
+        return self.base is not None
+
+    def to_dict(self) -> dict:
+        return {'numero': self.numero, 'base': self.base, 'kind': self.kind, 'explanation': self.explanation}
+
+
+class OrderMatcher:
+    """
+    Index multi-clés des commandes
+
+    Se comporte comme le mapping des commandes attendu par les moteurs de
+    correction (méthode get) : un numéro sans correspondance exacte est
+    cherché par clé normalisée, puis parmi les identifiants secondaires.
+    Une clé partagée par plusieurs commandes est ambiguë et n'est jamais
+    utilisée.
+    """
+
+    def __init__(self, orders: dict, alternates: dict = None):
+        """
+        Args:
+            orders: numéro de commande → valeur retournée par get (commande
+                ou entrée {codePoste, codeCycle})
+            alternates: identifiant secondaire → numéro de commande
+        """
+        self.orders = orders
+        # Clé normalisée → numéros de la base (plusieurs : ambiguë)
+        self.normalized = {}
+        for numero in orders:
+            self.normalized.setdefault(normalize(numero), []).append(numero)
+        self.alternates = {}
+        for identifier, numero in (alternates or {}).items():
+            if numero in orders:
+                candidates = self.alternates.setdefault(normalize(identifier), [])
+                if numero not in candidates:
+                    candidates.append(numero)
+
+    @classmethod
+    def from_commandes(cls, commandes, value=None) -> 'OrderMatcher':
+        """
+        Index d'un OrderIndex (ou d'un dict numéro → commande)
+
+        Args:
+            commandes: OrderIndex ou dict {numeroCommande: commande}
+            value: Fonction commande → valeur retournée par get (par défaut
+                la commande elle-même)
+        """
+        by_numero = getattr(commandes, 'by_numero', commandes)
+        orders = {numero: value(c) if value else c for numero, c in by_numero.items()}
+        alternates = {
+            c[field]: numero
+            for numero, c in by_numero.items()
+            for field in ALTERNATE_FIELDS
+            if c.get(field)
+        }
+        return cls(orders, alternates)
+
+    def __len__(self) -> int:
+        return len(self.orders)
+
+    def __contains__(self, numero: str) -> bool:
+        return self.match(numero).found
+
+    def match(self, numero: str) -> Match:
+        """Résout un numéro de commande du fichier"""
+        if numero in self.orders:
+            return Match(numero, numero, MATCH_EXACT)
+
+        key = normalize(numero)
+        candidates = self.normalized.get(key)
+        if candidates:
+            if len(candidates) == 1:
+                return Match(numero, candidates[0], MATCH_NORMALIZED,
+                             f"{numero} rapproché de {candidates[0]} (espaces et zéros en tête ignorés)")
+            return Match(numero, None, MATCH_AMBIGUOUS,
+                         f"{numero} correspond à plusieurs commandes ({', '.join(sorted(candidates))})")
+
+        candidates = self.alternates.get(key)
+        if candidates:
+            if len(candidates) == 1:
+                return Match(numero, candidates[0], MATCH_CONTRACT,
+                             f"{numero} est le numéro de contrat de la commande {candidates[0]}")
+            return Match(numero, None, MATCH_AMBIGUOUS,
+                         f"{numero} est le numéro de contrat de plusieurs commandes "
+                         f"({', '.join(sorted(candidates))})")
+
+        return Match(numero, None, MATCH_MISSING)
+
+    def resolve(self, numeros) -> dict:
+        """
+        Résout tous les numéros d'un fichier
+
+        Args:
+            numeros: Numéros de commande lus dans le fichier
+
+        Returns:
+            dict ordonné {numero: Match}
+        """
+        return {numero: self.match(numero) for numero in numeros}
+
+    def get(self, numero: str, default=None):
+        """Valeur de la commande rapprochée de ce numéro (ou default)"""
+        value = self.orders.get(numero)
+        if value is not None:
+            return value
+        match = self.match(numero)
+        return self.orders[match.base] if match.found else default
+
+
+def summarize(matches: dict) -> dict:
+    """Nombre de numéros par type de rapprochement"""
+    counts = {}
+    for match in matches.values():
+        counts[match.kind] = counts.get(match.kind, 0) + 1
+    return counts
@@ -0,0 +1,172 @@
+"""
+VERALLIA Modificator - Mesures de la chaîne de correction
+Durées par étape, compteurs de balises et histogramme des tailles de
+fichiers, exportables au format texte Prometheus
+"""
+
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+
+# ============================================================================
+# CONFIGURATION
+# ============================================================================
+
+PREFIX = 'verallia'
+
+# Étapes de la chaîne, dans l'ordre d'affichage
+STAGES = ('fetch', 'parse', 'extract', 'match', 'rewrite', 'serialize', 'validate')
+
+# Bornes (octets) de l'histogramme des tailles de fichiers
+FILE_SIZE_BUCKETS = (
+    10 * 1024,
+    100 * 1024,
+    1024 * 1024,
+    10 * 1024 * 1024,
+    100 * 1024 * 1024,
+    1024 * 1024 * 1024,
+)
+
+
+def _labels(labels: dict) -> str:
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{k}="{v}"' for k, v in labels) + '}'
+
+
+# ============================================================================
+# REGISTRE
+# ============================================================================
+
+class Metrics:
+    """
+    Registre de mesures (thread-safe)
+
+    Les boucles chaudes accumulent leurs durées et compteurs dans des
+    variables locales et ne les reportent ici qu'une fois par fichier.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            # étape → [nombre, durée totale, durée max]
+            self.stages = {}
+            # (nom, labels triés) → valeur
+            self.counters = {}
+            self.file_sizes = [0] * (len(FILE_SIZE_BUCKETS) + 1)
+            self.file_sizes_sum = 0
+
+    @contextmanager
+    def stage(self, name: str):
+        """Chronomètre un bloc : with METRICS.stage('parse'): ..."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record_stage(name, time.perf_counter() - started)
+
+    def record_stage(self, name: str, seconds: float, count: int = 1):
+        with self._lock:
+            entry = self.stages.setdefault(name, [0, 0.0, 0.0])
+            entry[0] += count
+            entry[1] += seconds
+            entry[2] = max(entry[2], seconds)
+
+    def incr(self, name: str, value: int = 1, **labels):
+        if not value:
+            return
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe_file_size(self, size: int):
+        bucket = 0
+        while bucket < len(FILE_SIZE_BUCKETS) and size > FILE_SIZE_BUCKETS[bucket]:
+            bucket += 1
+        with self._lock:
+            self.file_sizes[bucket] += 1
+            self.file_sizes_sum += size
+
+    # ------------------------------------------------------------------
+    # Export
+    # ------------------------------------------------------------------
+
+    def snapshot(self) -> dict:
+        """État courant sérialisable (JSON, pickle) — voir merge()"""
+        with self._lock:
+            return {
+                'stages': {name: list(entry) for name, entry in self.stages.items()},
+                'counters': [[name, dict(labels), value] for (name, labels), value in self.counters.items()],
+                'fileSizes': list(self.file_sizes),
+                'fileSizesSum': self.file_sizes_sum,
+            }
+
+    def merge(self, snapshot: dict):
+        """Ajoute les mesures d'un autre registre (ex. worker de batch.py)"""
+        for name, (count, total, maximum) in snapshot['stages'].items():
+            with self._lock:
+                entry = self.stages.setdefault(name, [0, 0.0, 0.0])
+                entry[0] += count
+                entry[1] += total
+                entry[2] = max(entry[2], maximum)
+        for name, labels, value in snapshot['counters']:
+            self.incr(name, value, **labels)
+        with self._lock:
+            for bucket, count in enumerate(snapshot['fileSizes']):
+                self.file_sizes[bucket] += count
+            self.file_sizes_sum += snapshot['fileSizesSum']
+
+    def to_prometheus(self) -> str:
+        """Exposition au format texte Prometheus"""
+        data = self.snapshot()
+        lines = []
+
+        name = f'{PREFIX}_stage_duration_seconds'
+        lines.append(f'# HELP {name} Durée des étapes de la chaîne de correction')
+        lines.append(f'# TYPE {name} summary')
+        stages = sorted(data['stages'], key=lambda s: (STAGES.index(s) if s in STAGES else len(STAGES), s))
+        for stage in stages:
+            count, total, _ = data['stages'][stage]
+            lines.append(f'{name}_sum{{stage="{stage}"}} {total:.6f}')
+            lines.append(f'{name}_count{{stage="{stage}"}} {count}')
+        lines.append(f'# TYPE {PREFIX}_stage_duration_seconds_max gauge')
+        for stage in stages:
+            lines.append(f'{PREFIX}_stage_duration_seconds_max{{stage="{stage}"}} {data["stages"][stage][2]:.6f}')
+
+        by_name = {}
+        for counter, labels, value in data['counters']:
+            by_name.setdefault(counter, []).append((tuple(sorted(labels.items())), value))
+        for counter in sorted(by_name):
+            lines.append(f'# TYPE {PREFIX}_{counter}_total counter')
+            for labels, value in sorted(by_name[counter]):
+                lines.append(f'{PREFIX}_{counter}_total{_labels(labels)} {value}')
+
+        name = f'{PREFIX}_file_size_bytes'
+        lines.append(f'# HELP {name} Taille des fichiers XML traités')
+        lines.append(f'# TYPE {name} histogram')
+        cumulative = 0
+        for bound, count in zip(FILE_SIZE_BUCKETS + ('+Inf',), data['fileSizes']):
+            cumulative += count
+            lines.append(f'{name}_bucket{{le="{bound}"}} {cumulative}')
+        lines.append(f'{name}_sum {data["fileSizesSum"]}')
+        lines.append(f'{name}_count {cumulative}')
+
+        return '\n'.join(lines) + '\n'
+
+    def write_prometheus(self, path: str):
+        """Écrit l'exposition Prometheus dans un fichier (atomique)"""
+        directory = os.path.dirname(os.path.abspath(path))
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            f.write(self.to_prometheus())
+        os.replace(tmp_path, path)
+
+
+# Registre du processus
+METRICS = Metrics()
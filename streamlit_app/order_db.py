@@ -0,0 +1,240 @@
+"""
+VERALLIA Modificator - Base de commandes compilée
+Format binaire compact de commandes_extraites.json, chargé par mmap
+
+Seuls les champs utiles à la correction sont conservés (numeroCommande,
+codePoste, codeCycle, dateDebut, dateExtraction, et numeroContrat pour le
+rapprochement) ; une seule commande par
+numéro (la plus récente, comme OrderIndex), les commandes supprimées étant
+retirées au préalable (compaction). Les chaînes répétées sont
+stockées une seule fois dans une table de chaînes.
+
+Format (little-endian) :
+    en-tête   : magic 'VMDB', version u16, réservé u16,
+                nb_chaînes u32, nb_enregistrements u32
+    chaînes   : (nb_chaînes + 1) offsets u32, puis les octets UTF-8
+    enregistrements : nb_enregistrements × 6 identifiants de chaîne u32,
+                triés par numeroCommande (NONE = absent)
+
+Usage:
+    python order_db.py ../data/commandes_extraites.json ../data/commandes.vmdb
+"""
+
+import argparse
+import array
+import bisect
+import json
+import mmap
+import struct
+import sys
+
+from compaction import compact
+from order_store import build_order_index
+
+
+# ============================================================================
+# FORMAT
+# ============================================================================
+
+MAGIC = b'VMDB'
+FORMAT_VERSION = 2
+HEADER = struct.Struct('<4sHHII')
+NONE = 0xFFFFFFFF
+
+# Entiers non signés 32 bits natifs, pour lire la table des enregistrements
+U32 = 'I' if array.array('I').itemsize == 4 else 'L'
+
+FIELDS = ('numeroCommande', 'codePoste', 'codeCycle', 'dateDebut', 'dateExtraction', 'numeroContrat')
+
+
+# ============================================================================
+# CONVERSION
+# ============================================================================
+
+def compile_commandes(commandes: list) -> bytes:
+    """
+    Compile la liste brute des commandes au format binaire
+
+    Args:
+        commandes: Liste issue de commandes_extraites.json
+
+    Returns:
+        Contenu du fichier .vmdb
+    """
+    index = build_order_index(compact(commandes).commandes)
+
+    strings = []
+    string_ids = {}
+
+    def intern(value):
+        if value is None:
+            return NONE
+        value = str(value)
+        if value not in string_ids:
+            string_ids[value] = len(strings)
+            strings.append(value)
+        return string_ids[value]
+
+    records = []
+    for numero in sorted(index.by_numero):
+        commande = index.by_numero[numero]
+        records.append([intern(commande.get(field)) for field in FIELDS])
+
+    encoded = [s.encode('utf-8') for s in strings]
+    offsets = [0]
+    for data in encoded:
+        offsets.append(offsets[-1] + len(data))
+
+    parts = [
+        HEADER.pack(MAGIC, FORMAT_VERSION, 0, len(strings), len(records)),
+        struct.pack(f'<{len(offsets)}I', *offsets),
+        b''.join(encoded),
+    ]
+    # Alignement sur 4 octets de la table des enregistrements
+    size = sum(len(p) for p in parts)
+    parts.append(b'\0' * (-size % 4))
+    flat = [string_id for record in records for string_id in record]
+    parts.append(struct.pack(f'<{len(flat)}I', *flat))
+    return b''.join(parts)
+
+
+def convert_json(json_path: str, db_path: str) -> int:
+    """
+    Convertit commandes_extraites.json en base compilée
+
+    Returns:
+        Nombre de commandes écrites
+    """
+    with open(json_path, 'r', encoding='utf-8') as f:
+        commandes = json.load(f)
+    content = compile_commandes(commandes if isinstance(commandes, list) else [])
+    with open(db_path, 'wb') as f:
+        f.write(content)
+    return HEADER.unpack_from(content)[4]
+
+
+# ============================================================================
+# LECTURE
+# ============================================================================
+
+def _u32_table(buffer, start: int, end: int):
+    """
+    Entiers u32 little-endian de buffer[start:end]
+
+    Vue sans copie sur une machine little-endian ; ailleurs, copie dont
+    l'ordre des octets est inversé.
+    """
+    view = memoryview(buffer)[start:end]
+    if sys.byteorder == 'little':
+        return view.cast(U32)
+    table = array.array(U32, view)
+    view.release()
+    table.byteswap()
+    return table
+
+
+class OrderDB:
+    """
+    Base de commandes compilée, projetée en mémoire (mmap)
+
+    Expose la même interface de lecture que OrderIndex pour le chemin de
+    correction : get(numero), `in`, len(). close() (ou un bloc with)
+    libère la projection.
+    """
+
+    def __init__(self, buffer):
+        self._buffer = buffer
+        magic, version, _, n_strings, n_records = HEADER.unpack_from(buffer)
+        if magic != MAGIC or version != FORMAT_VERSION:
+            raise ValueError("Fichier de commandes compilé invalide")
+
+        offsets_start = HEADER.size
+        blob_start = offsets_start + 4 * (n_strings + 1)
+        offsets = struct.unpack_from(f'<{n_strings + 1}I', buffer, offsets_start)
+        blob_end = blob_start + offsets[-1]
+
+        # Une seule instance Python par chaîne distincte
+        blob = buffer[blob_start:blob_end]
+        self.strings = [
+            sys.intern(blob[offsets[i]:offsets[i + 1]].decode('utf-8'))
+            for i in range(n_strings)
+        ]
+
+        records_start = blob_end + (-blob_end % 4)
+        self._records = _u32_table(buffer, records_start, records_start + 4 * len(FIELDS) * n_records)
+        self._numeros = [self.strings[self._records[i * len(FIELDS)]] for i in range(n_records)]
+
+    @classmethod
+    def open(cls, path: str) -> 'OrderDB':
+        """Ouvre une base compilée en lecture seule (mmap)"""
+        with open(path, 'rb') as f:
+            return cls(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+
+    @classmethod
+    def from_bytes(cls, content: bytes) -> 'OrderDB':
+        return cls(content)
+
+    def close(self):
+        """Libère la projection mémoire (la base n'est plus lisible ensuite)"""
+        if isinstance(self._records, memoryview):
+            self._records.release()
+        if isinstance(self._buffer, mmap.mmap):
+            self._buffer.close()
+
+    def __enter__(self) -> 'OrderDB':
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __len__(self) -> int:
+        return len(self._numeros)
+
+    def __contains__(self, numero_commande: str) -> bool:
+        return self._position(numero_commande) is not None
+
+    def _position(self, numero_commande: str):
+        i = bisect.bisect_left(self._numeros, numero_commande)
+        if i < len(self._numeros) and self._numeros[i] == numero_commande:
+            return i
+        return None
+
+    def _record(self, position: int) -> dict:
+        base = position * len(FIELDS)
+        return {
+            field: (None if self._records[base + k] == NONE else self.strings[self._records[base + k]])
+            for k, field in enumerate(FIELDS)
+        }
+
+    def get(self, numero_commande: str) -> dict:
+        """Retourne la commande pour ce numéro (ou None)"""
+        position = self._position(numero_commande)
+        return self._record(position) if position is not None else None
+
+    def records(self) -> list:
+        """Toutes les commandes, triées par numéro"""
+        return [self._record(i) for i in range(len(self))]
+
+
+def load_order_db(path: str) -> OrderDB:
+    """Ouvre une base de commandes compilée"""
+    return OrderDB.open(path)
+
+
+# ============================================================================
+# POINT D'ENTRÉE
+# ============================================================================
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Compile commandes_extraites.json au format .vmdb")
+    parser.add_argument('json_path', help="commandes_extraites.json")
+    parser.add_argument('db_path', help="Fichier .vmdb à écrire")
+    args = parser.parse_args(argv)
+
+    count = convert_json(args.json_path, args.db_path)
+    print(f"✅ {count} commandes compilées → {args.db_path}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,91 @@
+"""
+VERALLIA Modificator - Index des commandes
+Construit une fois par chargement des données un index des commandes
+(numeroCommande, emailId, codePoste, dateDebut)
+"""
+
+
+# ============================================================================
+# INDEX DES COMMANDES
+# ============================================================================
+
+def _record_sort_key(commande: dict) -> tuple:
+    """
+    Clé de tri déterministe d'une commande : la plus récente en dernier
+
+    La dateExtraction ("YYYY-MM-DD HH:MM:SS") est comparable en tant que
+    chaîne ; l'emailId départage deux extractions à la même seconde.
+    """
+    return (commande.get('dateExtraction') or '', commande.get('emailId') or '')
+
+
+class OrderIndex:
+    """
+    Index en mémoire des commandes extraites
+
+    - index principal : numeroCommande → commande la plus récente
+    - index secondaires : emailId, codePoste, dateDebut → liste de commandes
+      (de la plus récente à la plus ancienne)
+    """
+
+    def __init__(self, commandes: list):
+        self.by_numero = {}
+        self.by_email_id = {}
+        self.by_code_poste = {}
+        self.by_date_debut = {}
+        self.total = 0
+
+        valid = [c for c in commandes if c is not None and isinstance(c, dict)]
+        self.total = len(valid)
+
+        # Du plus récent au plus ancien : la première occurrence d'un
+        # numeroCommande est celle que l'on conserve
+        for commande in sorted(valid, key=_record_sort_key, reverse=True):
+            numero = commande.get('numeroCommande')
+            if numero and numero not in self.by_numero:
+                self.by_numero[numero] = commande
+
+            for index, field in (
+                (self.by_email_id, 'emailId'),
+                (self.by_code_poste, 'codePoste'),
+                (self.by_date_debut, 'dateDebut'),
+            ):
+                key = commande.get(field)
+                if key:
+                    index.setdefault(key, []).append(commande)
+
+    def __len__(self) -> int:
+        return self.total
+
+    def __contains__(self, numero_commande: str) -> bool:
+        return numero_commande in self.by_numero
+
+    def get(self, numero_commande: str) -> dict:
+        """Retourne la commande la plus récente pour ce numéro (ou None)"""
+        return self.by_numero.get(numero_commande)
+
+    def by_email(self, email_id: str) -> dict:
+        """Retourne la commande extraite de cet email (ou None)"""
+        matches = self.by_email_id.get(email_id)
+        return matches[0] if matches else None
+
+    def find_by_code_poste(self, code_poste: str) -> list:
+        """Retourne les commandes d'un code poste"""
+        return self.by_code_poste.get(code_poste, [])
+
+    def find_by_date_debut(self, date_debut: str) -> list:
+        """Retourne les commandes débutant à cette date (format JJ/MM/AAAA)"""
+        return self.by_date_debut.get(date_debut, [])
+
+
+def build_order_index(commandes: list) -> OrderIndex:
+    """
+    Construit l'index des commandes
+
+    Args:
+        commandes: Liste brute issue de commandes_extraites.json
+
+    Returns:
+        OrderIndex
+    """
+    return OrderIndex(commandes or [])
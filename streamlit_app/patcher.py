@@ -0,0 +1,964 @@
+"""
+VERALLIA Modificator - Correction par patch d'octets
+Repère en un seul balayage les positions (octets) des nœuds à corriger et
+écrit le XML corrigé comme une suite de tranches du fichier original et de
+courtes insertions ISO-8859-1, sans re-sérialiser le document
+
+La bonne formation du document est vérifiée par un passage SAX de libxml2
+sans construction d'arbre (check_well_formed), avant toute écriture : un
+fichier mal formé lève etree.XMLSyntaxError, comme avec lxml. Le moteur
+applique les deux règles
+historiques (rules.BUILTIN_RULES) sous forme compilée à la main. Les
+documents qu'il ne sait pas traiter à l'identique du moteur lxml (DOCTYPE,
+namespaces déclarés ailleurs que sur la racine), ou d'autres règles
+actives, lèvent PatchUnsupported : l'appelant se replie alors sur
+streaming.correct_stream.
+"""
+
+import functools
+import mmap
+import os
+import re
+import time
+from xml.sax.saxutils import escape
+
+from lxml import etree
+
+import changeset
+import rules
+from metrics import METRICS
+from streaming import collector, correct_stream
+from utils import NAMESPACES
+from validation import READ_TAGS, validate_assignment
+
+
+# ============================================================================
+# CONSTANTES
+# ============================================================================
+
+HR_NS = NAMESPACES['hr']
+
+_NAME = rb'[A-Za-z_][\w.\-]*'
+
+# Éléments HR-XML suivis par le balayage, et ceux relevés en plus pour la
+# validation (balises lues par les règles de validation.py)
+_TRACKED = frozenset([
+    b'Assignment', b'OrderId', b'IdValue', b'CustomerJobCode', b'CustomerReportingRequirements',
+    b'ExternalOrderNumber', b'StaffingShift',
+])
+_VALIDATED = _TRACKED | frozenset(
+    tag[len(HR_NS) + 2:].encode('ascii') for tag in READ_TAGS if tag.startswith(f'{{{HR_NS}}}')
+)
+_ATTRIBUTES = rb'(?:\s+[^\s=/>]+\s*=\s*(?:"[^"]*"|\'[^\']*\'))*'
+
+# Balises utiles à la correction, compilées pour les préfixes du namespace
+# HR-XML du document (les autres éléments ne sont jamais remontés en
+# Python, et un préfixe littéral évite de relire chaque nom de balise) :
+# - feuilles <IdValue>, <CustomerJobCode>, <ExternalOrderNumber> sans
+#   balisage interne, reconnues d'un bloc (groupes 1 à 4)
+# - commentaires, CDATA et instructions de traitement, à sauter
+# - autres balises ouvrantes / fermantes suivies (groupes 5 à 8)
+@functools.lru_cache(maxsize=16)
+def _target_token(hr_prefixes: frozenset, elements: frozenset = _TRACKED):
+    prefixes = b'|'.join(sorted(re.escape(prefix) + b':' if prefix else b'' for prefix in hr_prefixes))
+    return re.compile(
+        rb'<(' + prefixes + rb')(IdValue|CustomerJobCode|ExternalOrderNumber)'
+        rb'(' + _ATTRIBUTES + rb')\s*>([^<]*)</\1\2\s*>'
+        rb'|<!--.*?-->|<!\[CDATA\[.*?\]\]>|<\?.*?\?>'
+        rb'|<(/?)((?:' + prefixes + rb')(?:' + b'|'.join(sorted(elements)) + rb'))'
+        rb'(' + _ATTRIBUTES + rb')\s*(/?)>',
+        re.S,
+    )
+
+
+_LEAF = 4
+
+
+# Numéro de contrat (AssignmentId/IdValue), cherché dans un bloc corrigé
+# seulement quand le rapport des modifications est demandé
+@functools.lru_cache(maxsize=16)
+def _contract_token(hr_prefixes: frozenset):
+    prefixes = b'|'.join(sorted(re.escape(prefix) + b':' if prefix else b'' for prefix in hr_prefixes))
+    return re.compile(
+        rb'<(' + prefixes + rb')AssignmentId' + _ATTRIBUTES + rb'\s*>\s*'
+        rb'<\1IdValue' + _ATTRIBUTES + rb'\s*>([^<]*)</\1IdValue\s*>'
+    )
+
+# Cible de chaque feuille autre que IdValue
+_LEAF_TARGETS = {
+    b'CustomerJobCode': 'customerJobCode',
+    b'ExternalOrderNumber': 'externalOrderNumber',
+}
+
+# Tout élément : sert à mesurer la profondeur sur de courtes portions, et
+# au chemin des éléments d'un bloc en violation (nom qualifié, groupe 2)
+_ANY_TOKEN = re.compile(
+    rb'<!--.*?-->|<!\[CDATA\[.*?\]\]>|<\?.*?\?>'
+    rb'|<(/?)((?:' + _NAME + rb':)?' + _NAME + rb')' + _ATTRIBUTES + rb'\s*(/?)>',
+    re.S,
+)
+
+_ATTRIBUTE = re.compile(rb'([^\s=/>]+)\s*=\s*(?:"([^"]*)"|\'([^\']*)\')')
+_XMLNS = re.compile(rb'xmlns')
+_XML_DECLARATION = re.compile(rb'<\?xml[^>]*?encoding\s*=\s*["\']([A-Za-z0-9._\-]+)["\']')
+_CHAR_REF = re.compile(r'&#(x[0-9A-Fa-f]+|[0-9]+);')
+
+# Indentation ajoutée après une balise CustomerJobCode créée (comme lxml)
+CREATED_TAIL = b'\n          '
+
+# Taille des morceaux transmis au parser de vérification
+WELL_FORMED_CHUNK = 1024 * 1024
+
+
+class PatchUnsupported(ValueError):
+    """Document hors du périmètre du moteur par patch"""
+
+
+class _NullTarget:
+    """Cible SAX sans rappel : libxml2 vérifie le document sans créer d'éléments"""
+
+    def close(self):
+        return None
+
+
+def _declared_encoding(data):
+    """Encodage de la déclaration XML (minuscules), ou None sans déclaration"""
+    declaration = _XML_DECLARATION.match(data)
+    return declaration.group(1).lower() if declaration else None
+
+
+def check_well_formed(data):
+    """
+    Vérifie que data est un document XML bien formé (sans arbre, ~15 % du
+    temps d'un balayage du patch)
+
+    Sans déclaration d'encodage, le document est lu en ISO-8859-1, comme
+    par utils.parse_xml et streaming (exports Osmose).
+
+    Raises:
+        etree.XMLSyntaxError si le document est mal formé
+    """
+    started = time.perf_counter()
+    parser = etree.XMLParser(target=_NullTarget(), huge_tree=True, resolve_entities=False, no_network=True,
+                             encoding=None if _declared_encoding(data) else 'iso-8859-1')
+    view = memoryview(data)
+    try:
+        for position in range(0, len(view), WELL_FORMED_CHUNK):
+            parser.feed(bytes(view[position:position + WELL_FORMED_CHUNK]))
+        parser.close()
+    finally:
+        view.release()
+    METRICS.record_stage('parse', time.perf_counter() - started)
+
+
+# ============================================================================
+# OUTILS
+# ============================================================================
+
+def _unescape(raw: bytes) -> str:
+    """Texte XML (ISO-8859-1) → valeur, comme lxml la lit"""
+    text = raw.decode('iso-8859-1')
+    if '<![CDATA[' in text:
+        text = re.sub(r'<!\[CDATA\[(.*?)\]\]>', lambda m: escape(m.group(1)), text, flags=re.S)
+    if '&' not in text:
+        return text.replace('\r\n', '\n')
+    text = _CHAR_REF.sub(
+        lambda m: chr(int(m.group(1)[1:], 16) if m.group(1)[0] == 'x' else int(m.group(1))), text
+    )
+    return (text.replace('&lt;', '<').replace('&gt;', '>').replace('&quot;', '"')
+            .replace('&apos;', "'").replace('&amp;', '&').replace('\r\n', '\n'))
+
+
+class _Element:
+    __slots__ = ('local', 'prefix', 'start', 'start_end', 'attributes', 'self_closing',
+                 'end_start', 'open', 'parent')
+
+    def __init__(self, local, prefix, start, start_end, attributes, self_closing, parent=None):
+        self.local = local
+        self.prefix = prefix
+        self.start = start
+        self.start_end = start_end
+        self.attributes = attributes
+        self.self_closing = self_closing
+        self.end_start = start_end if self_closing else None
+        self.open = not self_closing
+        self.parent = parent
+
+
+def _depth_between(data, start: int, end: int) -> int:
+    """Profondeur relative des éléments ouverts dans data[start:end]"""
+    # Copie de la portion (courte) : mmap n'a pas de count
+    portion = data[start:end]
+    opening = portion.count(b'<')
+    if portion.count(b'>') == opening and b'<!' not in portion and b'<?' not in portion:
+        # Balises seules (un « > » chacune, pas de commentaire ni CDATA) :
+        # décompte direct des ouvrantes, fermantes et auto-fermantes
+        return opening - 2 * portion.count(b'</') - portion.count(b'/>')
+    depth = 0
+    for match in _ANY_TOKEN.finditer(data, start, end):
+        if match.group(1) is None:
+            continue
+        if match.group(1):
+            depth -= 1
+        elif not match.group(3):
+            depth += 1
+    return depth
+
+
+def _open_elements(data, start: int, end: int) -> list:
+    """Noms qualifiés des éléments ouverts dans data[start:end] et non refermés"""
+    stack = []
+    for match in _ANY_TOKEN.finditer(data, start, end):
+        if match.group(1) is None:
+            continue
+        if match.group(1):
+            stack.pop()
+        elif not match.group(3):
+            stack.append(match.group(2))
+    return stack
+
+
+def _text_end(data, elem: _Element) -> int:
+    """Fin du texte initial d'un élément (premier enfant ou balise fermante)"""
+    position = elem.start_end
+    while True:
+        i = data.find(b'<', position, elem.end_start)
+        if i == -1:
+            return elem.end_start
+        if data[i:i + 9] != b'<![CDATA[':
+            return i
+        position = data.find(b']]>', i) + 3
+
+
+def _text_value(data, elem: _Element):
+    """Texte initial d'un élément de l'original (None si vide, comme lxml)"""
+    if elem.self_closing:
+        return None
+    return _unescape(data[elem.start_end:_text_end(data, elem)]) or None
+
+
+def _attribute(elem: _Element, name: bytes):
+    for attribute in _ATTRIBUTE.finditer(elem.attributes):
+        if attribute.group(1) == name:
+            value = attribute.group(2) if attribute.group(2) is not None else attribute.group(3)
+            return _unescape(value)
+    return None
+
+
+def _local_name(tag: str) -> str:
+    return tag.rpartition('}')[2]
+
+
+_UNREAD = object()
+
+
+def _node_text(value):
+    """Texte d'un élément après elem.text = value (lxml)"""
+    return None if value is None or value == '' else str(value)
+
+
+class _Node(_Element):
+    """
+    Élément d'un bloc à valider, vu par les règles de validation.py : le
+    sous-ensemble de l'API lxml qu'elles utilisent, sur les positions
+    relevées pendant le balayage (sans parser le bloc)
+
+    Seules les balises de validation.READ_TAGS sont relevées : parent est
+    le plus proche ancêtre relevé, et depth le nombre d'éléments non
+    relevés entre les deux (0 : enfant direct, seul vu par l'itération,
+    find et getparent). Texte et attributs sont lus dans l'original à la
+    demande, sauf valeurs corrigées.
+    """
+    __slots__ = ('tag', 'children', 'data', 'depth', '_text', '_attrib')
+
+    def __init__(self, local, prefix, start, start_end, attributes, self_closing, parent, tag: str, data):
+        self.local = local
+        self.prefix = prefix
+        self.start = start
+        self.start_end = start_end
+        self.attributes = attributes
+        self.self_closing = self_closing
+        self.end_start = start_end if self_closing else None
+        self.open = not self_closing
+        self.parent = parent
+        self.tag = tag
+        self.children = []
+        # None : élément créé par la correction, sans octets d'origine
+        self.data = data
+        self.depth = 0
+        self._text = _UNREAD
+        self._attrib = None
+
+    @property
+    def text(self):
+        if self._text is _UNREAD:
+            self._text = _text_value(self.data, self) if self.data is not None else None
+        return self._text
+
+    def get(self, name: str, default=None):
+        if self._attrib is not None and name in self._attrib:
+            return self._attrib[name]
+        value = _attribute(self, name.encode('ascii')) if self.data is not None else None
+        return default if value is None else value
+
+    def getparent(self):
+        if self.parent is None or not self.depth:
+            return self.parent
+        # Parent non relevé : seul son nom est connu
+        qname = _open_elements(self.data, self.parent.start_end, self.start)[-1]
+        prefix, _, local = qname.rpartition(b':')
+        return _Node(local, prefix or None, None, None, None, False, None, None, None)
+
+    def __iter__(self):
+        return (child for child in self.children if not child.depth)
+
+    def iterchildren(self, tag: str = None):
+        return (child for child in self.children if not child.depth and (tag is None or child.tag == tag))
+
+    def find(self, tag: str):
+        return next(self.iterchildren(tag), None)
+
+    def findall(self, tag: str) -> list:
+        return list(self.iterchildren(tag))
+
+    def iter(self, *tags):
+        pending = [self]
+        while pending:
+            node = pending.pop()
+            if not tags or node.tag in tags:
+                yield node
+            pending.extend(reversed(node.children))
+
+
+class _Patcher:
+    """Balayage d'un document et calcul des modifications"""
+
+    def __init__(self, data, commandes_map, only_orders=None, validate=False, changes=False, prolog=None):
+        self.data = data
+        self.commandes_map = commandes_map
+        self.only_orders = only_orders
+        self.validate = validate
+        self.validate_seconds = 0.0
+        # Modifications : (début, fin, octets de remplacement), dans l'ordre
+        self.edits = []
+        self.stats = {
+            'assignments': 0,
+            'contratsCorriges': 0,
+            'contratsIgnores': 0,
+            'corrections': 0,
+            'commandesTrouvees': [],
+            'commandesManquantes': [],
+        }
+        if validate:
+            self.stats['violations'] = collector(validate)
+        if changes:
+            self.stats['changes'] = collector(changes)
+        self.seen_orders = set()
+        self.tag_counts = {}
+        if prolog is None:
+            self._read_prolog()
+        else:
+            # Portion d'un document (shards.py) : prologue lu sur le document entier
+            self.namespaces, self.hr_prefixes, self.insert_encoding = prolog
+        self.qualified_tags = {}
+
+    # ------------------------------------------------------------------
+    # Prologue : encodage et préfixes du namespace HR-XML
+    # ------------------------------------------------------------------
+
+    def _read_prolog(self):
+        data = self.data
+        root = next((m for m in _ANY_TOKEN.finditer(data) if m.group(1) is not None), None)
+        if root is None:
+            raise PatchUnsupported("Aucun élément racine")
+        if data.find(b'<!DOCTYPE', 0, root.start()) != -1:
+            raise PatchUnsupported("DOCTYPE non pris en charge")
+
+        # Préfixe → URI : nom qualifié des éléments vus par la validation
+        self.namespaces = {}
+        for attribute in _ATTRIBUTE.finditer(root.group(0)):
+            name = attribute.group(1)
+            if name == b'xmlns' or name.startswith(b'xmlns:'):
+                value = attribute.group(2) if attribute.group(2) is not None else attribute.group(3)
+                self.namespaces[name[6:] or None] = _unescape(value)
+        if _XMLNS.search(data, root.end()):
+            raise PatchUnsupported("Namespaces déclarés hors de la racine")
+        self.hr_prefixes = frozenset(prefix for prefix, uri in self.namespaces.items() if uri == HR_NS)
+
+        # Sans déclaration : ISO-8859-1, comme check_well_formed
+        encoding = _declared_encoding(data) or b'iso-8859-1'
+        self.insert_encoding = 'iso-8859-1' if encoding in (b'iso-8859-1', b'iso8859-1', b'latin-1', b'latin1') else 'ascii'
+
+    @property
+    def prolog(self) -> tuple:
+        """Contexte du prologue, pour corriger une portion du document à part"""
+        return self.namespaces, self.hr_prefixes, self.insert_encoding
+
+    def _encode_text(self, value) -> bytes:
+        if value is None:
+            return b''
+        return escape(str(value)).replace('\r', '&#13;').encode(self.insert_encoding, 'xmlcharrefreplace')
+
+    # ------------------------------------------------------------------
+    # Balayage
+    # ------------------------------------------------------------------
+
+    def run(self, start: int = 0, end: int = None):
+        """
+        Balaye data[start:end] ; la portion doit commencer et finir hors de
+        tout élément suivi (ex. entre deux blocs <Assignment>)
+
+        Avec la validation, les éléments des blocs lus par les règles sont
+        aussi relevés, comme _Node : chaque bloc est vérifié à sa balise
+        fermante, sur ces positions et les valeurs corrigées, sans parser
+        le bloc.
+        """
+        data = self.data
+        validate = bool(self.validate)
+        hr_prefixes = self.hr_prefixes
+        qnames = {}
+        stack = []
+        assignment = None
+        targets = None
+
+        if not hr_prefixes:
+            # Aucun élément HR-XML : rien à corriger
+            return self
+
+        def split_qname(qname: bytes) -> tuple:
+            prefix, _, local = qname.rpartition(b':')
+            prefix = prefix or None
+            split = qnames[qname] = (prefix, local, prefix in hr_prefixes and local in _TRACKED,
+                                     self._qualified_tag(prefix, local))
+            return split
+
+        token = _target_token(hr_prefixes, _VALIDATED if validate else _TRACKED)
+        # Validation : profondeur de la position courante sous le dernier
+        # _Node ouvert, mise à jour avec les balises non relevées entre deux
+        # jetons
+        scanned = start
+        depth = 0
+        for match in token.finditer(data, start, len(data) if end is None else end):
+            gap_start, scanned = scanned, match.end()
+            kind = match.lastindex
+            if kind is None:
+                continue
+
+            if kind == _LEAF:
+                # Feuille : l'élément n'est construit que s'il est une cible
+                # (ou un élément du bloc à valider)
+                if assignment is None:
+                    continue
+                parent = stack[-1]
+                if validate:
+                    qname = match.group(1) + match.group(2)
+                    prefix, local, tracked, tag = qnames.get(qname) or split_qname(qname)
+                else:
+                    prefix = match.group(1)[:-1] or None
+                    local = match.group(2)
+                    tracked = True
+                if not tracked:
+                    is_target = False
+                elif local == b'IdValue':
+                    staffing_shift = targets['staffingShift']
+                    is_order = targets['orderId'] is None and parent.local == b'OrderId'
+                    is_cycle = (targets['cycleIdValue'] is None and staffing_shift is not None
+                                and staffing_shift.open)
+                    is_target = is_order or is_cycle
+                else:
+                    is_target = targets[_LEAF_TARGETS[local]] is None
+                if validate:
+                    elem = _Node(local, prefix, match.start(), match.start(4), match.group(3), False, parent,
+                                 tag, data)
+                    if data.find(b'<', gap_start, match.start()) != -1:
+                        depth += _depth_between(data, gap_start, match.start())
+                    elem.depth = depth
+                    parent.children.append(elem)
+                elif is_target:
+                    elem = _Element(local, prefix, match.start(), match.start(4), match.group(3), False, parent)
+                else:
+                    continue
+                elem.end_start = match.end(4)
+                elem.open = False
+                if not is_target:
+                    continue
+            else:
+                closing, qname, attributes, slash = match.group(5, 6, 7, 8)
+                prefix, local, tracked, tag = qnames.get(qname) or split_qname(qname)
+
+                if closing:
+                    if not stack or stack[-1].local != local or stack[-1].prefix != prefix:
+                        raise PatchUnsupported(f"Balise fermante inattendue à l'octet {match.start()}")
+                    elem = stack.pop()
+                    elem.end_start = match.start()
+                    elem.open = False
+                    if validate and assignment is not None:
+                        depth = elem.depth
+                    if elem is assignment:
+                        numero, commande = self._finish_assignment(targets, elem, match.start())
+                        if validate:
+                            self._validate(elem, targets, numero, commande)
+                        assignment = None
+                    continue
+
+                self_closing = bool(slash)
+                parent = stack[-1] if stack else None
+                opens_block = local == b'Assignment' and tracked and assignment is None
+                if validate and (assignment is not None or opens_block):
+                    elem = _Node(local, prefix, match.start(), match.end(), attributes, self_closing,
+                                 None if opens_block else parent, tag, data)
+                    if not opens_block:
+                        if data.find(b'<', gap_start, match.start()) != -1:
+                            depth += _depth_between(data, gap_start, match.start())
+                        elem.depth = depth
+                        parent.children.append(elem)
+                    if not self_closing:
+                        depth = 0
+                else:
+                    elem = _Element(local, prefix, match.start(), match.end(), attributes, self_closing, parent)
+                if not self_closing:
+                    stack.append(elem)
+
+                if opens_block:
+                    assignment = elem
+                    targets = {
+                        'orderId': None,
+                        'customerJobCode': None,
+                        'customerReportingRequirements': None,
+                        'externalOrderNumber': None,
+                        'staffingShift': None,
+                        'cycleIdValue': None,
+                    }
+                    if self_closing:
+                        numero, commande = self._finish_assignment(targets, elem, match.end())
+                        if validate:
+                            self._validate(elem, targets, numero, commande)
+                        assignment = None
+                    continue
+                if assignment is None or not tracked:
+                    continue
+
+            # Mêmes chemins, dans le même ordre, que rules.TARGETS
+            if local == b'IdValue':
+                # Parent direct : plus proche ancêtre suivi, sans autre élément
+                # ouvert entre les deux
+                if (targets['orderId'] is None and parent.local == b'OrderId'
+                        and _depth_between(self.data, parent.start_end, elem.start) == 0):
+                    targets['orderId'] = elem
+                staffing_shift = targets['staffingShift']
+                if targets['cycleIdValue'] is None and staffing_shift is not None and staffing_shift.open:
+                    targets['cycleIdValue'] = elem
+            elif local == b'CustomerJobCode':
+                if targets['customerJobCode'] is None:
+                    targets['customerJobCode'] = elem
+            elif local == b'CustomerReportingRequirements':
+                if targets['customerReportingRequirements'] is None:
+                    targets['customerReportingRequirements'] = elem
+            elif local == b'ExternalOrderNumber':
+                cust_req = targets['customerReportingRequirements']
+                if (targets['externalOrderNumber'] is None and cust_req is not None and cust_req.open
+                        and _depth_between(self.data, cust_req.start_end, elem.start) == 0):
+                    targets['externalOrderNumber'] = elem
+            elif local == b'StaffingShift':
+                if targets['staffingShift'] is None and _attribute(elem, b'shiftPeriod') == 'weekly':
+                    targets['staffingShift'] = elem
+
+        if stack:
+            raise PatchUnsupported("Document incomplet")
+        return self
+
+    # ------------------------------------------------------------------
+    # Corrections d'un bloc <Assignment>
+    # ------------------------------------------------------------------
+
+    def _count(self, tag: str, action: str):
+        key = (tag, action)
+        self.tag_counts[key] = self.tag_counts.get(key, 0) + 1
+
+    def _set_text(self, elem: _Element, text: bytes):
+        """Remplace le texte initial d'un élément (comme elem.text = ...)"""
+        if elem.self_closing:
+            # <X a="1"/> → <X a="1">texte</X>
+            qname = (elem.prefix + b':' if elem.prefix else b'') + elem.local
+            start_tag = self.data[elem.start:elem.start_end].rstrip(b'>').rstrip(b'/').rstrip()
+            self.edits.append((elem.start, elem.start_end,
+                               bytes(start_tag) + b'>' + text + b'</' + qname + b'>'))
+        else:
+            self.edits.append((elem.start_end, _text_end(self.data, elem), text))
+
+    def _contract_id(self, assignment: _Element, end: int):
+        for match in _contract_token(self.hr_prefixes).finditer(self.data, assignment.start_end, end):
+            if _depth_between(self.data, assignment.start_end, match.start()) == 0:
+                return _unescape(match.group(2)).strip() or None
+        return None
+
+    def _change(self, assignment: _Element, end: int, numero, commande: dict, targets: dict) -> dict:
+        """Entrée du rapport des modifications (valeurs de l'original)"""
+        job_code = targets['customerJobCode']
+        if job_code is not None:
+            job_code_action = changeset.ACTION_UPDATED
+        elif targets['customerReportingRequirements'] is not None:
+            job_code_action = changeset.ACTION_CREATED
+        else:
+            job_code_action = changeset.ACTION_SKIPPED
+        cycle = targets['cycleIdValue']
+        return changeset.make_change(
+            self.stats['assignments'], numero, self._contract_id(assignment, end), commande,
+            _text_value(self.data, job_code) if job_code is not None else None, job_code_action,
+            _text_value(self.data, cycle) if cycle is not None else None,
+            _attribute(cycle, b'name') if cycle is not None else None,
+            cycle is not None,
+        )
+
+    def _finish_assignment(self, targets: dict, assignment: _Element, end: int) -> tuple:
+        """Corrige un bloc ; retourne (numéro de commande, commande appliquée ou None)"""
+        stats = self.stats
+        stats['assignments'] += 1
+
+        order_elem = targets['orderId']
+        numero = None
+        if order_elem is not None and not order_elem.self_closing:
+            text = _unescape(self.data[order_elem.start_end:_text_end(self.data, order_elem)])
+            numero = text.strip() if text else None
+        commande = self.commandes_map.get(numero) if numero is not None else None
+        if numero is not None and numero not in self.seen_orders:
+            self.seen_orders.add(numero)
+            stats['commandesTrouvees' if commande else 'commandesManquantes'].append(numero)
+
+        if self.only_orders is not None and numero not in self.only_orders:
+            stats['contratsIgnores'] += 1
+            return numero, None
+        if not commande:
+            return numero, None
+        if 'changes' in stats:
+            stats['changes'].append(self._change(assignment, end, numero, commande, targets))
+
+        corrections_applied = 0
+        code_poste = self._encode_text(commande['codePoste'])
+
+        job_code = targets['customerJobCode']
+        cust_req = targets['customerReportingRequirements']
+        if job_code is not None:
+            self._set_text(job_code, code_poste)
+            corrections_applied += 1
+            self._count('CustomerJobCode', 'updated')
+        elif cust_req is not None:
+            qname = (cust_req.prefix + b':' if cust_req.prefix else b'') + b'CustomerJobCode'
+            created = b'<' + qname + b'>' + code_poste + b'</' + qname + b'>' + CREATED_TAIL
+            external_order = targets['externalOrderNumber']
+            if external_order is not None:
+                self.edits.append((external_order.start, external_order.start, created))
+            elif cust_req.self_closing:
+                self._set_text(cust_req, created)
+            else:
+                self.edits.append((cust_req.end_start, cust_req.end_start, created))
+            corrections_applied += 1
+            self._count('CustomerJobCode', 'created')
+        else:
+            self._count('CustomerJobCode', 'skipped')
+
+        cycle = targets['cycleIdValue']
+        if cycle is not None:
+            self._set_cycle(cycle, self._encode_text(commande['codeCycle']))
+            corrections_applied += 1
+            self._count('CycleHoraire', 'updated')
+        else:
+            self._count('CycleHoraire', 'skipped')
+
+        stats['corrections'] += corrections_applied
+        stats['contratsCorriges'] += 1 if corrections_applied else 0
+        return numero, commande
+
+    def _qualified_tag(self, prefix, local: bytes) -> str:
+        """Nom {namespace}local d'un élément, comme lxml"""
+        key = (prefix, local)
+        tag = self.qualified_tags.get(key)
+        if tag is None:
+            uri = self.namespaces.get(prefix)
+            name = local.decode('ascii')
+            tag = self.qualified_tags[key] = f'{{{uri}}}{name}' if uri else name
+        return tag
+
+    def _validate(self, assignment: _Node, targets: dict, numero, commande):
+        """
+        Valide un bloc corrigé : éléments relevés par le balayage, avec les
+        valeurs écrites par _finish_assignment (mêmes modifications que ses
+        insertions)
+        """
+        started = time.perf_counter()
+        if commande:
+            code_poste = _node_text(commande['codePoste'])
+            job_code = targets['customerJobCode']
+            cust_req = targets['customerReportingRequirements']
+            if job_code is not None:
+                job_code._text = code_poste
+            elif cust_req is not None:
+                created = _Node(b'CustomerJobCode', cust_req.prefix, None, None, None, False, cust_req,
+                                self._qualified_tag(cust_req.prefix, b'CustomerJobCode'), None)
+                created._text = code_poste
+                external_order = targets['externalOrderNumber']
+                siblings = cust_req.children
+                siblings.insert(siblings.index(external_order) if external_order is not None else len(siblings),
+                                created)
+            cycle = targets['cycleIdValue']
+            if cycle is not None:
+                cycle._text = _node_text(commande['codeCycle'])
+                cycle._attrib = {'name': 'CYCLE'}
+
+        paths = {}
+
+        def path(elem, block, number):
+            # Chemins calculés une fois par bloc, au premier écart seulement
+            if not paths:
+                paths.update(self._block_paths(block, number))
+            if elem.start is None:
+                return f"{paths[elem.parent.start]}/{_local_name(elem.tag)}"
+            return paths[elem.start]
+
+        self.stats['violations'].extend(validate_assignment(assignment, self.stats['assignments'], numero, path))
+        self.validate_seconds += time.perf_counter() - started
+
+    def _block_paths(self, assignment: _Node, number: int) -> dict:
+        """
+        Position de balise ouvrante → chemin depuis le bloc, comme
+        validation.element_path, d'après les balises du bloc d'origine
+        """
+        paths = {assignment.start: f'Assignment[{number}]'}
+        if assignment.self_closing:
+            return paths
+        root = [None, assignment.start, []]
+        stack = [root]
+        for match in _ANY_TOKEN.finditer(self.data, assignment.start_end, assignment.end_start):
+            if match.group(1) is None:
+                continue
+            if match.group(1):
+                stack.pop()
+                continue
+            prefix, _, local = match.group(2).rpartition(b':')
+            node = [self._qualified_tag(prefix or None, local), match.start(), []]
+            stack[-1][2].append(node)
+            if not match.group(3):
+                stack.append(node)
+
+        pending = [root]
+        while pending:
+            tag, start, children = pending.pop()
+            counts = {}
+            for child in children:
+                counts[child[0]] = counts.get(child[0], 0) + 1
+            seen = {}
+            for child in children:
+                step = _local_name(child[0])
+                if counts[child[0]] > 1:
+                    seen[child[0]] = seen.get(child[0], 0) + 1
+                    step += f'[{seen[child[0]]}]'
+                paths[child[1]] = f'{paths[start]}/{step}'
+                pending.append(child)
+        return paths
+
+    def _set_cycle(self, elem: _Element, text: bytes):
+        """name="CYCLE" et texte du cycle horaire"""
+        attributes_start = elem.start + 1 + len(elem.local) + (len(elem.prefix) + 1 if elem.prefix else 0)
+        for attribute in _ATTRIBUTE.finditer(elem.attributes):
+            if attribute.group(1) == b'name':
+                group = 2 if attribute.group(2) is not None else 3
+                self.edits.append((attributes_start + attribute.start(group),
+                                   attributes_start + attribute.end(group), b'CYCLE'))
+                break
+        else:
+            attributes_end = attributes_start + len(elem.attributes)
+            self.edits.append((attributes_end, attributes_end, b' name="CYCLE"'))
+
+        if elem.self_closing:
+            # Le nouvel attribut éventuel est déjà enregistré sur la balise :
+            # seul le texte est inséré, avant « /> »
+            qname = (elem.prefix + b':' if elem.prefix else b'') + elem.local
+            slash = self.data.rfind(b'/', elem.start, elem.start_end)
+            self.edits.append((slash, elem.start_end, b'>' + text + b'</' + qname + b'>'))
+        else:
+            self.edits.append((elem.start_end, _text_end(self.data, elem), text))
+
+    # ------------------------------------------------------------------
+    # Écriture
+    # ------------------------------------------------------------------
+
+    def chunks(self):
+        """Tranches de l'original (memoryview, sans copie) et insertions"""
+        view = memoryview(self.data)
+        position = 0
+        for start, end, replacement in sorted(self.edits, key=lambda edit: (edit[0], edit[1])):
+            if start > position:
+                yield view[position:start]
+            if replacement:
+                yield replacement
+            position = max(position, end)
+        if position < len(self.data):
+            yield view[position:]
+
+
+# ============================================================================
+# API
+# ============================================================================
+
+def patch_chunks(data, commandes_map, only_orders=None, validate: bool = False, changes: bool = False) -> tuple:
+    """
+    Calcule les corrections d'un document par positions d'octets
+
+    Args:
+        data: Contenu XML (bytes, mmap ou tout objet compatible memoryview)
+        commandes_map: Mapping {numero_commande: {codePoste, codeCycle}}
+        only_orders: Numéros à corriger exclusivement (mode incrémental)
+        validate: Vérifie chaque bloc corrigé (règles de validation.py)
+        changes: Relève les valeurs avant / après (rapport changeset.py)
+
+    Returns:
+        (itérable des morceaux de sortie, stats comme correct_stream)
+
+    Raises:
+        PatchUnsupported si le document sort du périmètre du moteur
+        etree.XMLSyntaxError si le document est mal formé
+    """
+    check_rules()
+    check_well_formed(data)
+    started = time.perf_counter()
+    patcher = _Patcher(data, commandes_map, only_orders, validate, changes).run()
+    record_scan(patcher, time.perf_counter() - started)
+    return patcher.chunks(), patcher.stats
+
+
+def check_rules():
+    """Lève PatchUnsupported si d'autres règles que les historiques sont actives"""
+    if rules.active_rules() != rules.BUILTIN_RULES:
+        raise PatchUnsupported("Règles de correction hors des règles historiques")
+
+
+def record_scan(patcher: _Patcher, seconds: float):
+    """Mesures d'un balayage (durées, violations, balises corrigées)"""
+    METRICS.record_stage('extract', seconds - patcher.validate_seconds)
+    if patcher.validate:
+        METRICS.record_stage('validate', patcher.validate_seconds)
+        for violation in patcher.stats['violations']:
+            METRICS.incr('violations', rule=violation['rule'])
+    for (tag, action), count in patcher.tag_counts.items():
+        METRICS.incr('tags', count, tag=tag, action=action)
+
+
+def record_file(stats: dict, size: int):
+    """Compteurs d'un fichier patché"""
+    METRICS.incr('assignments', stats['contratsCorriges'], result='corrected')
+    METRICS.incr('assignments', stats['contratsIgnores'], result='ignored')
+    METRICS.incr('assignments', stats['assignments'] - stats['contratsCorriges'] - stats['contratsIgnores'],
+                 result='untouched')
+    METRICS.incr('files', result='patched')
+    METRICS.observe_file_size(size)
+
+
+def patch_stream(source, destination, commandes_map, only_orders=None, validate: bool = False,
+                 changes: bool = False) -> dict:
+    """
+    Corrige un fichier par patch d'octets
+
+    Un chemin source est projeté en mémoire (mmap) : les régions non
+    modifiées sont écrites directement depuis la projection.
+
+    Args:
+        source: Chemin, fichier binaire ou bytes
+        destination: Chemin ou fichier binaire de sortie
+        commandes_map: Mapping {numero_commande: {codePoste, codeCycle}}
+        only_orders: Numéros à corriger exclusivement (mode incrémental)
+        validate: Vérifie chaque bloc corrigé (règles de validation.py)
+        changes: Relève les valeurs avant / après (rapport changeset.py)
+
+    Returns:
+        dict de statistiques (mêmes clés que correct_stream)
+
+    Raises:
+        PatchUnsupported si le document sort du périmètre du moteur
+        etree.XMLSyntaxError si le document est mal formé (rien n'est écrit)
+    """
+    owned = []
+    mapped = None
+    chunks = None
+    try:
+        if isinstance(source, (str, os.PathLike)):
+            f = open(source, 'rb')
+            owned.append(f)
+            if os.fstat(f.fileno()).st_size:
+                data = mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            else:
+                data = b''
+        elif isinstance(source, (bytes, bytearray, memoryview, mmap.mmap)):
+            data = source
+        else:
+            source.seek(0)
+            data = source.read()
+
+        chunks, stats = patch_chunks(data, commandes_map, only_orders, validate, changes)
+        size = len(data)
+
+        if isinstance(destination, (str, os.PathLike)):
+            output = open(destination, 'wb')
+            owned.append(output)
+        else:
+            output = destination
+        started = time.perf_counter()
+        for chunk in chunks:
+            output.write(chunk)
+            if isinstance(chunk, memoryview):
+                chunk.release()
+        METRICS.record_stage('serialize', time.perf_counter() - started)
+    finally:
+        # Les tranches (memoryview) doivent être libérées avant le mmap
+        if chunks is not None:
+            chunks.close()
+        if mapped is not None:
+            mapped.close()
+        for f in reversed(owned):
+            f.close()
+
+    record_file(stats, size)
+    return stats
+
+
+def apply_corrections_patch(xml_content: bytes, commandes_map: dict) -> tuple:
+    """
+    Variante de apply_corrections_multi par patch d'octets
+
+    Returns:
+        (XML corrigé en bytes, nombre de corrections appliquées)
+
+    Raises:
+        PatchUnsupported si le document sort du périmètre du moteur
+        etree.XMLSyntaxError si le document est mal formé (rien n'est écrit)
+    """
+    chunks, stats = patch_chunks(xml_content, commandes_map)
+    return b''.join(chunks), stats['corrections']
+
+
+def correct_document(source, destination, commandes_map, only_orders=None, validate: bool = False,
+                     changes: bool = False) -> dict:
+    """
+    Corrige par patch d'octets, ou avec streaming.correct_stream si le
+    document sort du périmètre du patch
+
+    Args:
+        source: Chemin ou fichier binaire du XML original
+        destination: Chemin ou fichier binaire de sortie
+        commandes_map: Mapping {numero_commande: {codePoste, codeCycle}}
+        only_orders: Numéros à corriger exclusivement (mode incrémental)
+        validate: Vérifie chaque bloc corrigé (règles de validation.py)
+        changes: Relève les valeurs avant / après (rapport changeset.py)
+
+    Returns:
+        dict de statistiques (mêmes clés que correct_stream)
+
+    Raises:
+        etree.XMLSyntaxError si le document est mal formé (rien n'est écrit)
+    """
+    try:
+        return patch_stream(source, destination, commandes_map, only_orders, validate, changes)
+    except PatchUnsupported:
+        # Rien n'a encore été écrit : la sortie est produite par lxml
+        METRICS.incr('patch_fallbacks')
+        return correct_stream(source, destination, commandes_map, only_orders=only_orders, validate=validate,
+                              changes=changes)
@@ -0,0 +1,233 @@
+"""
+VERALLIA Modificator - Cache des résultats de correction
+Conserve sur disque les XML corrigés, adressés par le contenu du fichier
+d'entrée et la version de la base de commandes
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+
+from snapshot import DEFAULT_CACHE_DIR
+
+
+# ============================================================================
+# CONFIGURATION
+# ============================================================================
+
+DEFAULT_RESULTS_DIR = os.path.join(DEFAULT_CACHE_DIR, 'results')
+
+# Limites du cache (éviction LRU au-delà)
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024
+DEFAULT_MAX_ENTRIES = 256
+
+CHUNK_SIZE = 1024 * 1024
+
+
+# ============================================================================
+# CLÉS
+# ============================================================================
+
+def sha256_file(fileobj) -> str:
+    """
+    Hash SHA-256 d'un fichier binaire (lu par blocs, position restaurée)
+
+    Args:
+        fileobj: Fichier binaire ou bytes
+    """
+    if isinstance(fileobj, bytes):
+        return hashlib.sha256(fileobj).hexdigest()
+
+    digest = hashlib.sha256()
+    position = fileobj.tell()
+    fileobj.seek(0)
+    for chunk in iter(lambda: fileobj.read(CHUNK_SIZE), b''):
+        digest.update(chunk)
+    fileobj.seek(position)
+    return digest.hexdigest()
+
+
+def make_key(input_sha256: str, snapshot_version: str) -> str:
+    """Clé d'un résultat : (contenu du XML, version de la base de commandes)"""
+    return hashlib.sha256(f'{input_sha256}:{snapshot_version}'.encode('ascii')).hexdigest()
+
+
+# ============================================================================
+# CACHE
+# ============================================================================
+
+class ResultCache:
+    """
+    Cache disque LRU borné en taille et en nombre d'entrées
+
+    Chaque entrée est un couple <clé>.xml (XML corrigé) / <clé>.json
+    (statistiques). La date de modification du .json sert d'horodatage
+    d'accès pour l'éviction LRU ; les écritures sont atomiques, le cache
+    peut donc être partagé entre sessions et processus.
+    """
+
+    def __init__(self, cache_dir: str = None, max_bytes: int = DEFAULT_MAX_BYTES,
+                 max_entries: int = DEFAULT_MAX_ENTRIES):
+        self.cache_dir = cache_dir or DEFAULT_RESULTS_DIR
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def _paths(self, key: str) -> tuple:
+        return (
+            os.path.join(self.cache_dir, f'{key}.xml'),
+            os.path.join(self.cache_dir, f'{key}.json'),
+        )
+
+    def get(self, key: str, as_path: bool = False):
+        """
+        Retourne (xml_corrigé_bytes, stats) ou None si absent
+
+        Args:
+            as_path: Chemin du XML corrigé à la place de son contenu (mode
+                mémoire bornée : le fichier n'est pas relu)
+        """
+        data_path, meta_path = self._paths(key)
+        try:
+            with open(meta_path, 'r', encoding='utf-8') as f:
+                stats = json.load(f)
+            if as_path:
+                os.stat(data_path)
+                data = data_path
+            else:
+                with open(data_path, 'rb') as f:
+                    data = f.read()
+        except (OSError, ValueError):
+            with self._lock:
+                self.misses += 1
+            return None
+
+        # Marque l'entrée comme récemment utilisée
+        try:
+            os.utime(meta_path)
+        except OSError:
+            pass
+        with self._lock:
+            self.hits += 1
+        return data, stats
+
+    def _write_atomic(self, path: str, content: bytes):
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(content)
+        os.replace(tmp_path, path)
+
+    def put(self, key: str, data: bytes, stats: dict):
+        """Enregistre un résultat puis applique l'éviction LRU"""
+        if len(data) > self.max_bytes:
+            return
+        os.makedirs(self.cache_dir, exist_ok=True)
+        data_path, meta_path = self._paths(key)
+        # Données d'abord : une entrée n'est visible qu'une fois son .json écrit
+        self._write_atomic(data_path, data)
+        self._write_atomic(meta_path, json.dumps(stats).encode('utf-8'))
+        self.evict()
+
+    def put_file(self, key: str, path: str, stats: dict, move: bool = True) -> str:
+        """
+        Enregistre un résultat déjà écrit sur disque, sans le charger
+
+        Le fichier est déplacé dans le cache (copié par blocs s'il est sur
+        un autre système de fichiers, ou si move est faux). Trop gros pour
+        le cache, il est laissé en place.
+
+        Returns:
+            Chemin du XML corrigé (dans le cache ou path)
+        """
+        if os.path.getsize(path) > self.max_bytes:
+            return path
+        os.makedirs(self.cache_dir, exist_ok=True)
+        data_path, meta_path = self._paths(key)
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+        os.close(fd)
+        moved = False
+        if move:
+            try:
+                os.replace(path, tmp_path)
+                moved = True
+            except OSError:
+                pass
+        if not moved:
+            shutil.copyfile(path, tmp_path)
+            if move:
+                os.remove(path)
+        os.replace(tmp_path, data_path)
+        self._write_atomic(meta_path, json.dumps(stats).encode('utf-8'))
+        self.evict()
+        return data_path
+
+    def latest_for_input(self, input_sha256: str, as_path: bool = False):
+        """
+        Résultat le plus récent pour ce fichier d'entrée, toutes versions de
+        la base confondues (base d'une correction incrémentale)
+
+        Args:
+            as_path: Chemin du XML corrigé à la place de son contenu
+
+        Returns:
+            (xml_corrigé_bytes, stats) ou None
+        """
+        for _, _, key in reversed(self.entries()):
+            data_path, meta_path = self._paths(key)
+            try:
+                with open(meta_path, 'r', encoding='utf-8') as f:
+                    stats = json.load(f)
+                if stats.get('inputSha256') != input_sha256:
+                    continue
+                if as_path:
+                    os.stat(data_path)
+                    return data_path, stats
+                with open(data_path, 'rb') as f:
+                    return f.read(), stats
+            except (OSError, ValueError):
+                continue
+        return None
+
+    def entries(self) -> list:
+        """Entrées présentes : (dernier accès, taille, clé), plus ancienne d'abord"""
+        entries = []
+        try:
+            names = os.listdir(self.cache_dir)
+        except OSError:
+            return entries
+        for name in names:
+            if not name.endswith('.json'):
+                continue
+            key = name[:-5]
+            data_path, meta_path = self._paths(key)
+            try:
+                accessed = os.path.getmtime(meta_path)
+                size = os.path.getsize(data_path) + os.path.getsize(meta_path)
+            except OSError:
+                continue
+            entries.append((accessed, size, key))
+        entries.sort()
+        return entries
+
+    def evict(self):
+        """Supprime les entrées les moins récemment utilisées au-delà des limites"""
+        entries = self.entries()
+        total = sum(size for _, size, _ in entries)
+        while entries and (total > self.max_bytes or len(entries) > self.max_entries):
+            _, size, key = entries.pop(0)
+            for path in reversed(self._paths(key)):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+            total -= size
+
+    def size(self) -> tuple:
+        """(nombre d'entrées, taille totale en octets)"""
+        entries = self.entries()
+        return len(entries), sum(size for _, size, _ in entries)
@@ -0,0 +1,382 @@
+"""
+VERALLIA Modificator - Règles de correction
+Chaque balise exigée par Pixid est décrite par une règle déclarative :
+chemin de la balise dans <Assignment>, parent et point d'insertion si elle
+doit être créée, attributs posés et champ de la commande qui fournit son
+texte. Les règles actives sont compilées en un plan unique qui résout
+toutes leurs cibles en un seul parcours de chaque bloc, quel que soit le
+nombre de règles
+"""
+
+import functools
+import json
+import os
+import re
+
+from lxml import etree
+
+from utils import HR
+
+
+# ============================================================================
+# CONFIGURATION
+# ============================================================================
+
+# Règles supplémentaires (liste JSON d'objets Rule), chargées à l'import :
+# les workers des pools de processus les lisent aussi
+RULES_FILE = os.environ.get('VERALLIA_RULES_FILE')
+
+# Règles actives (noms séparés par des virgules) ; toutes par défaut
+ACTIVE_RULES = os.environ.get('VERALLIA_RULES')
+
+# Indentation ajoutée après une balise créée (comme le moteur historique)
+CREATED_TAIL = '\n          '
+
+# Nœuds résolus pour les moteurs (numéro de commande, rapport des
+# modifications), en plus des cibles des règles
+TARGETS = {
+    'orderId': '//IdValue[parent::OrderId]',
+    'customerJobCode': '//CustomerJobCode',
+    'customerReportingRequirements': '//CustomerReportingRequirements',
+    'externalOrderNumber': '//CustomerReportingRequirements/ExternalOrderNumber',
+    'staffingShift': '//StaffingShift[@shiftPeriod="weekly"]',
+    'cycleIdValue': '//StaffingShift[@shiftPeriod="weekly"]//IdValue',
+}
+
+_STEP = re.compile(r'(//|/)([A-Za-z_][\w.\-]*)((?:\[[^\]]*\])*)')
+_PREDICATE = re.compile(r'\[(?:@([\w.\-:]+)\s*=\s*(?:"([^"]*)"|\'([^\']*)\')|parent::([A-Za-z_][\w.\-]*))\]')
+
+
+class RuleError(ValueError):
+    """Règle mal formée (chemin, ancre ou champ)"""
+
+
+# ============================================================================
+# RÈGLES
+# ============================================================================
+
+def parse_path(path: str) -> tuple:
+    """
+    Découpe un chemin relatif au bloc <Assignment>
+
+    Sous-ensemble d'XPath, noms HR-XML sans préfixe : « //A » descendant,
+    « /A » enfant, prédicats [@attribut="valeur"] et [parent::Balise].
+    Ex. //StaffingShift[@shiftPeriod="weekly"]//IdValue
+
+    Returns:
+        Étapes (descendant, balise, attributs, balise du parent)
+
+    Raises:
+        RuleError si le chemin n'est pas reconnu
+    """
+    steps = []
+    position = 0
+    for match in _STEP.finditer(path):
+        if match.start() != position:
+            break
+        position = match.end()
+        attributes = []
+        parent_tag = None
+        predicates = match.group(3)
+        end = 0
+        for predicate in _PREDICATE.finditer(predicates):
+            if predicate.start() != end:
+                raise RuleError(f"Prédicat non reconnu dans {path!r}")
+            end = predicate.end()
+            if predicate.group(4):
+                parent_tag = HR + predicate.group(4)
+            else:
+                value = predicate.group(2) if predicate.group(2) is not None else predicate.group(3)
+                attributes.append((predicate.group(1), value))
+        if end != len(predicates):
+            raise RuleError(f"Prédicat non reconnu dans {path!r}")
+        steps.append((match.group(1) == '//', HR + match.group(2), tuple(attributes), parent_tag))
+    if not steps or position != len(path):
+        raise RuleError(f"Chemin non reconnu : {path!r}")
+    return tuple(steps)
+
+
+class Rule:
+    """
+    Correction d'une balise de chaque contrat
+
+    Args:
+        name: Nom de la règle (compteurs de balises, sélection)
+        target: Chemin de la balise à corriger (voir parse_path)
+        field: Champ de la commande écrit comme texte de la balise
+        parent: Chemin de l'élément où créer la balise absente (sans
+            parent, une balise absente est ignorée)
+        anchor: Balise enfant de parent avant laquelle insérer la balise
+            créée (à la fin du parent si absente)
+        attributes: Attributs fixes posés sur la balise {nom: valeur}
+    """
+
+    __slots__ = ('name', 'target', 'field', 'parent', 'anchor', 'attributes', 'tag')
+
+    def __init__(self, name: str, target: str, field: str, parent: str = None, anchor: str = None,
+                 attributes: dict = None):
+        self.name = name
+        self.target = target
+        self.field = field
+        self.parent = parent
+        self.anchor = anchor
+        self.attributes = tuple((attributes or {}).items())
+        # Balise (Clark) créée sous parent quand la cible est absente
+        self.tag = parse_path(target)[-1][1]
+        if parent is not None:
+            parse_path(parent)
+        if anchor is not None and (parent is None or not re.fullmatch(r'[A-Za-z_][\w.\-]*', anchor)):
+            raise RuleError(f"{name} : l'ancre doit être une balise enfant du parent")
+
+    @property
+    def anchor_path(self) -> str:
+        return f'{self.parent}/{self.anchor}' if self.anchor else None
+
+    @classmethod
+    def from_dict(cls, data: dict) -> 'Rule':
+        try:
+            return cls(data['name'], data['target'], data['field'], data.get('parent'), data.get('anchor'),
+                       data.get('attributes'))
+        except KeyError as e:
+            raise RuleError(f"Règle incomplète, clé manquante : {e.args[0]}") from None
+
+    def to_dict(self) -> dict:
+        return {
+            'name': self.name,
+            'target': self.target,
+            'field': self.field,
+            'parent': self.parent,
+            'anchor': self.anchor,
+            'attributes': dict(self.attributes),
+        }
+
+    def __repr__(self) -> str:
+        return f'Rule({self.name!r}, {self.target!r}, {self.field!r})'
+
+
+# Nom → règle, dans l'ordre d'application
+RULES = {}
+
+
+def register(rule: Rule) -> Rule:
+    """Enregistre (ou remplace) une règle"""
+    RULES[rule.name] = rule
+    return rule
+
+
+def load_rules(path: str) -> list:
+    """Enregistre les règles d'un fichier JSON (liste d'objets)"""
+    with open(path, 'r', encoding='utf-8') as f:
+        return [register(Rule.from_dict(data)) for data in json.load(f)]
+
+
+def active_rules() -> tuple:
+    """Règles appliquées aux contrats (VERALLIA_RULES, toutes par défaut)"""
+    if not ACTIVE_RULES:
+        return tuple(RULES.values())
+    names = [name.strip() for name in ACTIVE_RULES.split(',') if name.strip()]
+    unknown = [name for name in names if name not in RULES]
+    if unknown:
+        raise RuleError(f"Règles inconnues : {', '.join(unknown)}")
+    return tuple(RULES[name] for name in names)
+
+
+def fields(rules: tuple = None) -> tuple:
+    """Champs de commande lus par les règles (sans doublon, dans l'ordre)"""
+    return tuple(dict.fromkeys(rule.field for rule in (rules if rules is not None else active_rules())))
+
+
+def order_values(commande: dict, rules: tuple = None) -> dict:
+    """Valeurs d'une commande utiles aux règles, ex. {codePoste, codeCycle}"""
+    return {field: commande.get(field) for field in fields(rules)}
+
+
+# Corrections historiques : CustomerJobCode créé avant ExternalOrderNumber,
+# cycle horaire dans l'IdValue du StaffingShift hebdomadaire
+CUSTOMER_JOB_CODE = register(Rule(
+    'CustomerJobCode',
+    target='//CustomerJobCode',
+    field='codePoste',
+    parent='//CustomerReportingRequirements',
+    anchor='ExternalOrderNumber',
+))
+
+CYCLE_HORAIRE = register(Rule(
+    'CycleHoraire',
+    target='//StaffingShift[@shiftPeriod="weekly"]//IdValue',
+    field='codeCycle',
+    attributes={'name': 'CYCLE'},
+))
+
+BUILTIN_RULES = (CUSTOMER_JOB_CODE, CYCLE_HORAIRE)
+
+if RULES_FILE:
+    load_rules(RULES_FILE)
+
+
+# ============================================================================
+# PLAN D'EXÉCUTION
+# ============================================================================
+
+def _is_descendant(elem, ancestor) -> bool:
+    parent = elem.getparent()
+    while parent is not None:
+        if parent is ancestor:
+            return True
+        parent = parent.getparent()
+    return False
+
+
+class Plan:
+    """
+    Règles compilées pour un bloc <Assignment>
+
+    Les chemins des règles (cibles, parents, ancres) et de TARGETS sont
+    fusionnés en un arbre d'étapes : un préfixe commun n'est résolu qu'une
+    fois. Chaque étape retient le premier élément, dans l'ordre du
+    document, situé sous l'élément retenu par l'étape précédente (comme des
+    find() enchaînés) ; toutes les étapes sont résolues pendant un seul
+    parcours assignment.iter() limité à leurs balises.
+
+    Les étapes sont regroupées par balise (steps) : chaque élément parcouru
+    n'est comparé qu'aux étapes de sa balise.
+
+    Attributs:
+        steps: {balise: ((étape, étape parente ou -1, descendant, attributs
+            ou None, balise du parent), ...)}, dans l'ordre de compilation
+        paths: {chemin: étape}, aliases: {nom de TARGETS: étape}
+    """
+
+    def __init__(self, rules: tuple, targets: dict = None):
+        self.rules = tuple(rules)
+        targets = targets or TARGETS
+        # Étapes : (étape parente ou -1, descendant, balise, attributs, balise du parent)
+        self._nodes = []
+        self._keys = {}
+        self.paths = {}
+        for path in targets.values():
+            self._compile(path)
+        for rule in self.rules:
+            for path in (rule.target, rule.parent, rule.anchor_path):
+                if path is not None:
+                    self._compile(path)
+        self.aliases = {name: self.paths[path] for name, path in targets.items()}
+        self.tags = tuple(dict.fromkeys(node[2] for node in self._nodes))
+        steps = {tag: [] for tag in self.tags}
+        for index, (parent, descendant, tag, attributes, parent_tag) in enumerate(self._nodes):
+            steps[tag].append((index, parent, descendant, attributes or None, parent_tag))
+        self.steps = {tag: tuple(entries) for tag, entries in steps.items()}
+
+    def _compile(self, path: str) -> int:
+        index = self.paths.get(path)
+        if index is not None:
+            return index
+        index = -1
+        for step in parse_path(path):
+            key = (index,) + step
+            found = self._keys.get(key)
+            if found is None:
+                found = self._keys[key] = len(self._nodes)
+                self._nodes.append(key)
+            index = found
+        self.paths[path] = index
+        return index
+
+    def resolve(self, assignment: etree._Element) -> dict:
+        """
+        Résout toutes les étapes en un parcours du bloc
+
+        Returns:
+            dict {chemin ou nom de TARGETS: premier élément trouvé ou None}
+        """
+        found = [None] * len(self._nodes)
+        steps = self.steps
+        for elem in assignment.iter(*self.tags):
+            for index, parent, descendant, attributes, parent_tag in steps[elem.tag]:
+                if found[index] is not None:
+                    continue
+                if parent >= 0:
+                    anchor = found[parent]
+                    if anchor is None:
+                        continue
+                else:
+                    anchor = assignment
+                if parent_tag is not None and elem.getparent().tag != parent_tag:
+                    continue
+                if attributes is not None and any(elem.get(name) != value for name, value in attributes):
+                    continue
+                if descendant:
+                    if parent >= 0 and not _is_descendant(elem, anchor):
+                        continue
+                elif elem.getparent() is not anchor:
+                    continue
+                found[index] = elem
+        targets = {path: found[index] for path, index in self.paths.items()}
+        for name, index in self.aliases.items():
+            targets[name] = found[index]
+        return targets
+
+    def apply(self, assignment: etree._Element, commande: dict, targets: dict = None,
+              counts: dict = None) -> int:
+        """
+        Applique les règles à un bloc <Assignment>
+
+        Args:
+            assignment: Élément hr:Assignment
+            commande: Valeurs de la commande (champs des règles ; une règle
+                dont le champ est absent est ignorée)
+            targets: Résultat de resolve() pour ce bloc (optionnel)
+            counts: Compteurs {(règle, action): n} à incrémenter (optionnel),
+                action parmi created / updated / skipped
+
+        Returns:
+            Nombre de modifications appliquées
+        """
+        if targets is None:
+            targets = self.resolve(assignment)
+
+        corrections_applied = 0
+        for rule in self.rules:
+            # Champ absent de la commande (ex. base .vmdb) : balise laissée telle quelle
+            if rule.field not in commande:
+                if counts is not None:
+                    key = (rule.name, 'skipped')
+                    counts[key] = counts.get(key, 0) + 1
+                continue
+            value = commande[rule.field]
+            elem = targets[rule.target]
+            if elem is not None:
+                for name, attribute in rule.attributes:
+                    elem.set(name, attribute)
+                elem.text = value
+                action = 'updated'
+            else:
+                parent = targets[rule.parent] if rule.parent is not None else None
+                if parent is None:
+                    action = 'skipped'
+                else:
+                    elem = etree.Element(rule.tag, dict(rule.attributes))
+                    elem.text = value
+                    elem.tail = CREATED_TAIL
+                    anchor = targets[rule.anchor_path] if rule.anchor is not None else None
+                    if anchor is not None:
+                        parent.insert(parent.index(anchor), elem)
+                    else:
+                        parent.append(elem)
+                    action = 'created'
+            if action != 'skipped':
+                corrections_applied += 1
+            if counts is not None:
+                key = (rule.name, action)
+                counts[key] = counts.get(key, 0) + 1
+        return corrections_applied
+
+
+@functools.lru_cache(maxsize=8)
+def _plan(rules: tuple) -> Plan:
+    return Plan(rules)
+
+
+def compile_plan(rules: tuple = None) -> Plan:
+    """Plan des règles données (par défaut : règles actives), compilé une fois par jeu de règles"""
+    return _plan(tuple(rules) if rules is not None else active_rules())
@@ -0,0 +1,526 @@
+"""
+VERALLIA Modificator - Service de correction (HTTP local)
+Processus longue durée : pool de workers préchauffé, index des commandes
+chargé une fois (rechargé quand la base change) et file d'attente bornée.
+Utilisable par l'application (VERALLIA_SERVICE_URL) et par tout autre
+outil de la chaîne d'intégration
+
+Usage:
+    python service.py --port 8502 -j 4
+    curl --data-binary @export.xml http://127.0.0.1:8502/correct -o corrige.xml
+    curl --data-binary @export.xml http://127.0.0.1:8502/analyze
+    curl --data-binary @exports.zip http://127.0.0.1:8502/batch -o corriges.zip
+
+Points d'entrée:
+    POST /correct[?validate=1]  XML → XML corrigé (résumé dans X-Verallia-Stats,
+                                version de la base dans X-Verallia-Version)
+    POST /correct?changes=1     XML → ZIP : XML corrigé + rapport des modifications
+    POST /analyze               XML → statistiques, écarts HR-XML et rapport des
+                                modifications en JSON, sans sortie (dry-run)
+    POST /batch[?validate=1]    ZIP de XML → ZIP corrigé (+ rapport.json)
+    POST /reload                recharge la base de commandes
+    GET  /health                état du service (JSON)
+    GET  /metrics               mesures au format texte Prometheus
+"""
+
+import argparse
+import io
+import json
+import multiprocessing
+import os
+import sys
+import threading
+import time
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+import requests
+from lxml import etree
+
+import batch
+import jobs
+import patcher
+import sources
+from metrics import METRICS
+from snapshot import REFRESH_INTERVAL
+
+
+# ============================================================================
+# CONFIGURATION
+# ============================================================================
+
+DEFAULT_HOST = os.environ.get('VERALLIA_SERVICE_HOST', '127.0.0.1')
+DEFAULT_PORT = int(os.environ.get('VERALLIA_SERVICE_PORT', 8502))
+DEFAULT_WORKERS = int(os.environ.get('VERALLIA_SERVICE_WORKERS', os.cpu_count() or 1))
+
+# Requêtes admises en même temps (en cours + en attente d'un worker) ;
+# au-delà, réponse 503 immédiate avec Retry-After
+DEFAULT_QUEUE_FACTOR = 4
+
+# Taille maximale d'un corps de requête
+MAX_BODY_BYTES = int(os.environ.get('VERALLIA_SERVICE_MAX_MB', 512)) * 1024 * 1024
+
+RETRY_AFTER_SECONDS = 1
+
+# Statistiques résumées dans l'en-tête X-Verallia-Stats de /correct
+STATS_HEADER = 'X-Verallia-Stats'
+VERSION_HEADER = 'X-Verallia-Version'
+
+BATCH_REPORT_NAME = 'rapport.json'
+
+# Entrées de la réponse de /correct?changes=1
+CORRECTED_NAME = 'corrige.xml'
+CHANGES_NAME = 'modifications.json'
+
+# Petit document corrigé par chaque worker au démarrage (imports, regex,
+# parsers : la première vraie requête ne paie pas l'initialisation)
+_WARMUP_XML = b'''<?xml version="1.0" encoding="ISO-8859-1"?>
+<Envelope xmlns="http://ns.hr-xml.org/2004-08-02"><Assignment>
+<ReferenceInformation><OrderId><IdValue>000000</IdValue></OrderId></ReferenceInformation>
+<CustomerReportingRequirements/><StaffingShift shiftPeriod="weekly"><Id><IdValue/></Id></StaffingShift>
+</Assignment></Envelope>
+'''
+
+
+class ServiceBusy(Exception):
+    """File d'attente pleine : la requête est refusée (503)"""
+
+
+# ============================================================================
+# TRAVAIL DES WORKERS (processus du pool)
+# ============================================================================
+
+_corrections_map = None
+
+
+class _Discard:
+    """Sortie ignorée (analyse sans écriture)"""
+
+    def write(self, data):
+        return len(data)
+
+
+def _init_worker(corrections_map: dict):
+    global _corrections_map
+    _corrections_map = corrections_map
+
+
+def _warm() -> int:
+    patcher.correct_document(io.BytesIO(_WARMUP_XML), _Discard(), {'000000': {'codePoste': 'P', 'codeCycle': 'C'}},
+                             validate=True)
+    METRICS.reset()
+    return os.getpid()
+
+
+def _run(data: bytes, destination, validate: bool, changes: bool = False) -> dict:
+    try:
+        return patcher.correct_document(io.BytesIO(data), destination, _corrections_map,
+                                        validate=validate, changes=changes)
+    except etree.XMLSyntaxError as e:
+        # Les erreurs lxml ne passent pas d'un processus à l'autre
+        raise ValueError(f"Fichier XML invalide : {e}") from None
+
+
+def _correct(data: bytes, validate: bool = False, changes: bool = False) -> tuple:
+    """Corrige un fichier ; retourne (XML corrigé, stats, mesures)"""
+    METRICS.reset()
+    output = io.BytesIO()
+    stats = _run(data, output, validate, changes)
+    return output.getvalue(), stats, METRICS.snapshot()
+
+
+def _analyze(data: bytes) -> tuple:
+    """Modifications et écarts HR-XML qu'appliquerait /correct ; retourne (stats, mesures)"""
+    METRICS.reset()
+    stats = _run(data, _Discard(), True, True)
+    return stats, METRICS.snapshot()
+
+
+def summarize_stats(stats: dict) -> dict:
+    """Résumé des statistiques (listes remplacées par leur taille)"""
+    return {key: len(value) if isinstance(value, list) else value for key, value in stats.items()}
+
+
+# ============================================================================
+# SERVICE
+# ============================================================================
+
+class CorrectionService:
+    """
+    Pool de correction préchauffé et index des commandes en mémoire
+
+    Chaque worker reçoit le mapping des commandes une fois, à son
+    démarrage. Quand la base change (revalidation périodique ou /reload),
+    un nouveau pool est préchauffé puis substitué à l'ancien, qui termine
+    les requêtes en cours.
+    """
+
+    def __init__(self, snapshot, workers: int = DEFAULT_WORKERS, queue_size: int = None):
+        self.snapshot = snapshot
+        self.workers = max(1, workers)
+        self.queue_size = queue_size or self.workers * DEFAULT_QUEUE_FACTOR
+        self.version = None
+        self.orders = 0
+        self.started = time.time()
+        self._pool = None
+        self._slots = threading.BoundedSemaphore(self.queue_size)
+        self._in_flight = 0
+        self._lock = threading.Lock()
+        self._reload_lock = threading.Lock()
+        self._stopped = threading.Event()
+
+    # ------------------------------------------------------------------
+    # Cycle de vie
+    # ------------------------------------------------------------------
+
+    def start(self, refresh_interval: float = REFRESH_INTERVAL):
+        """Charge la base, préchauffe le pool et lance la revalidation périodique"""
+        self.reload(force=True)
+        if refresh_interval:
+            threading.Thread(target=self._refresh_loop, args=(refresh_interval,), daemon=True).start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._pool is not None:
+            self._pool.shutdown(wait=True, cancel_futures=True)
+
+    def reload(self, force: bool = False) -> bool:
+        """
+        Recharge la base de commandes si sa version a changé
+
+        Returns:
+            True si un nouveau pool a été mis en service
+        """
+        with self._reload_lock:
+            commandes = self.snapshot.get_commandes()
+            version = self.snapshot.version
+            if not force and version == self.version:
+                return False
+
+            corrections_map = batch.build_corrections_map(commandes)
+            # spawn : pas de fork d'un serveur multi-thread
+            pool = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=_init_worker,
+                initargs=(corrections_map,),
+            )
+            for future in [pool.submit(_warm) for _ in range(self.workers)]:
+                future.result()
+
+            previous, self._pool = self._pool, pool
+            self.version = version
+            self.orders = len(corrections_map)
+        if previous is not None:
+            threading.Thread(target=previous.shutdown, kwargs={'wait': True}, daemon=True).start()
+        return True
+
+    def _refresh_loop(self, interval: float):
+        while not self._stopped.wait(interval):
+            try:
+                self.snapshot.refresh()
+                self.reload()
+            except Exception as e:
+                print(f"⚠️ Revalidation de la base impossible : {e}", file=sys.stderr)
+
+    def health(self) -> dict:
+        with self._lock:
+            in_flight = self._in_flight
+        return {
+            'status': 'ok' if self._pool is not None else 'starting',
+            'version': self.version,
+            'commandes': self.orders,
+            'workers': self.workers,
+            'queueSize': self.queue_size,
+            'inFlight': in_flight,
+            'uptime': round(time.time() - self.started, 1),
+        }
+
+    # ------------------------------------------------------------------
+    # Admission (file bornée)
+    # ------------------------------------------------------------------
+
+    @contextmanager
+    def _admitted(self):
+        """Place dans la file ; lève ServiceBusy si elle est pleine"""
+        if not self._slots.acquire(blocking=False):
+            METRICS.incr('service_requests', result='rejected')
+            raise ServiceBusy(f"{self.queue_size} requêtes déjà en cours")
+        with self._lock:
+            self._in_flight += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._in_flight -= 1
+            self._slots.release()
+        METRICS.incr('service_requests', result='ok')
+
+    def _submit(self, function, *args):
+        """Exécute une tâche dans le pool ; retourne son résultat sans les mesures"""
+        with self._admitted():
+            result = self._pool.submit(function, *args).result()
+        METRICS.merge(result[-1])
+        return result[:-1]
+
+    # ------------------------------------------------------------------
+    # Opérations
+    # ------------------------------------------------------------------
+
+    def correct(self, data: bytes, validate: bool = False, changes: bool = False) -> tuple:
+        """(XML corrigé, stats) ; lève ValueError si le XML est mal formé"""
+        return self._submit(_correct, data, validate, changes)
+
+    def analyze(self, data: bytes) -> dict:
+        """Statistiques, écarts HR-XML et rapport des modifications, sans sortie"""
+        stats, = self._submit(_analyze, data)
+        return stats
+
+    def correct_batch(self, archive: bytes, validate: bool = False) -> bytes:
+        """
+        Corrige les fichiers XML d'une archive ZIP
+
+        Une seule place de la file est prise pour toute l'archive ; ses
+        fichiers sont répartis sur les workers.
+
+        Returns:
+            Archive ZIP des fichiers corrigés, avec rapport.json (stats ou
+            erreur par fichier)
+
+        Raises:
+            ValueError si l'archive est illisible
+        """
+        try:
+            with zipfile.ZipFile(io.BytesIO(archive)) as source:
+                names = [name for name in source.namelist() if name.lower().endswith('.xml')]
+                contents = [source.read(name) for name in names]
+        except zipfile.BadZipFile as e:
+            raise ValueError(f"Archive ZIP invalide : {e}") from None
+
+        entries, report = [], []
+        with self._admitted():
+            futures = [self._pool.submit(_correct, data, validate) for data in contents]
+            for name, future in zip(names, futures):
+                try:
+                    corrected, stats, snapshot = future.result()
+                except ValueError as e:
+                    report.append({'fichier': name, 'erreur': str(e)})
+                    continue
+                METRICS.merge(snapshot)
+                entries.append((name, corrected))
+                report.append({'fichier': name, **stats})
+
+        output = io.BytesIO()
+        entries.append((BATCH_REPORT_NAME, json.dumps(report, ensure_ascii=False, indent=2).encode('utf-8')))
+        jobs.write_zip(entries, output)
+        return output.getvalue()
+
+
+# ============================================================================
+# HTTP
+# ============================================================================
+
+class _Handler(BaseHTTPRequestHandler):
+    server_version = 'VeralliaService/1.0'
+    protocol_version = 'HTTP/1.1'
+
+    @property
+    def service(self) -> CorrectionService:
+        return self.server.service
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def _send(self, status: int, body: bytes, content_type: str, headers: dict = None):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        if self.service.version:
+            self.send_header(VERSION_HEADER, self.service.version)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_json(self, status: int, payload, headers: dict = None):
+        self._send(status, json.dumps(payload, ensure_ascii=False).encode('utf-8'),
+                   'application/json; charset=utf-8', headers)
+
+    def _read_body(self) -> bytes:
+        length = int(self.headers.get('Content-Length') or 0)
+        if length > MAX_BODY_BYTES:
+            raise OverflowError(f"corps de {length} octets (maximum {MAX_BODY_BYTES})")
+        return self.rfile.read(length)
+
+    def do_GET(self):
+        path = urlsplit(self.path).path
+        if path == '/health':
+            self._send_json(200, self.service.health())
+        elif path == '/metrics':
+            self._send(200, METRICS.to_prometheus().encode('utf-8'), 'text/plain; version=0.0.4')
+        else:
+            self._send_json(404, {'erreur': f"Chemin inconnu : {path}"})
+
+    def do_POST(self):
+        url = urlsplit(self.path)
+        query = parse_qs(url.query)
+        validate = query.get('validate', ['0'])[0] not in ('0', 'false', '')
+        changes = query.get('changes', ['0'])[0] not in ('0', 'false', '')
+        started = time.perf_counter()
+        try:
+            body = self._read_body()
+            if url.path == '/correct':
+                corrected, stats = self.service.correct(body, validate, changes)
+                headers = {STATS_HEADER: json.dumps(summarize_stats(stats))}
+                if changes:
+                    # Rapport trop volumineux pour un en-tête : XML et rapport en ZIP
+                    output = io.BytesIO()
+                    jobs.write_zip([
+                        (CORRECTED_NAME, corrected),
+                        (CHANGES_NAME, json.dumps(stats['changes'], ensure_ascii=False).encode('utf-8')),
+                    ], output)
+                    self._send(200, output.getvalue(), 'application/zip', headers)
+                else:
+                    self._send(200, corrected, 'application/xml; charset=iso-8859-1', headers)
+            elif url.path == '/analyze':
+                self._send_json(200, self.service.analyze(body))
+            elif url.path == '/batch':
+                self._send(200, self.service.correct_batch(body, validate), 'application/zip')
+            elif url.path == '/reload':
+                self.service.snapshot.refresh()
+                self._send_json(200, {'recharge': self.service.reload(), **self.service.health()})
+            else:
+                self._send_json(404, {'erreur': f"Chemin inconnu : {url.path}"})
+                return
+        except ServiceBusy as e:
+            self._send_json(503, {'erreur': str(e)}, {'Retry-After': str(RETRY_AFTER_SECONDS)})
+            return
+        except OverflowError as e:
+            self.close_connection = True
+            self._send_json(413, {'erreur': str(e)})
+            return
+        except ValueError as e:
+            self._send_json(400, {'erreur': str(e)})
+            return
+        except Exception as e:
+            self._send_json(500, {'erreur': str(e) or type(e).__name__})
+            return
+        METRICS.record_stage('service', time.perf_counter() - started)
+
+
+def make_server(service: CorrectionService, host: str = DEFAULT_HOST, port: int = DEFAULT_PORT,
+                verbose: bool = False) -> ThreadingHTTPServer:
+    """Serveur HTTP (un thread par connexion) adossé au service"""
+    server = ThreadingHTTPServer((host, port), _Handler)
+    server.daemon_threads = True
+    server.service = service
+    server.verbose = verbose
+    return server
+
+
+# ============================================================================
+# CLIENT (utilisé par app.py)
+# ============================================================================
+
+def correct_remote(url: str, data: bytes, validate: bool = False, changes: bool = False,
+                   timeout: float = 600) -> tuple:
+    """
+    Corrige un fichier via le service
+
+    Args:
+        url: Adresse du service (ex. http://127.0.0.1:8502)
+        data: Contenu XML
+        validate: Vérifie les contrats corrigés (règles HR-XML)
+        changes: Renvoie aussi le rapport des modifications
+        timeout: Délai maximal de la requête (secondes)
+
+    Returns:
+        (XML corrigé, statistiques résumées : les listes sont remplacées
+        par leur taille, voir summarize_stats ; avec changes, stats['changes']
+        est la liste complète, version de la base appliquée par le service
+        ou None)
+
+    Raises:
+        ValueError si le service refuse le fichier, RuntimeError s'il est
+        saturé ou en erreur
+    """
+    params = {}
+    if validate:
+        params['validate'] = '1'
+    if changes:
+        params['changes'] = '1'
+    response = requests.post(
+        f"{url.rstrip('/')}/correct",
+        params=params or None,
+        data=data,
+        headers={'Content-Type': 'application/xml'},
+        timeout=timeout,
+    )
+    if response.status_code == 400:
+        raise ValueError(response.json().get('erreur'))
+    if response.status_code != 200:
+        try:
+            message = response.json().get('erreur')
+        except ValueError:
+            message = response.text
+        raise RuntimeError(f"Service de correction : HTTP {response.status_code} — {message}")
+    stats = json.loads(response.headers[STATS_HEADER])
+    version = response.headers.get(VERSION_HEADER)
+    if not changes:
+        return response.content, stats, version
+    with zipfile.ZipFile(io.BytesIO(response.content)) as archive:
+        stats['changes'] = json.loads(archive.read(CHANGES_NAME))
+        return archive.read(CORRECTED_NAME), stats, version
+
+
+# ============================================================================
+# POINT D'ENTRÉE
+# ============================================================================
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Service HTTP local de correction des XML Osmose")
+    parser.add_argument('--host', default=DEFAULT_HOST, help=f"Adresse d'écoute (défaut : {DEFAULT_HOST})")
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT, help=f"Port (défaut : {DEFAULT_PORT})")
+    parser.add_argument('-j', '--workers', type=int, default=DEFAULT_WORKERS,
+                        help="Processus de correction (défaut : nombre de cœurs)")
+    parser.add_argument('--queue', type=int, default=None,
+                        help=f"Requêtes admises en même temps (défaut : {DEFAULT_QUEUE_FACTOR} × workers)")
+    parser.add_argument('--commandes', default=None,
+                        help="Chemin ou URL de commandes_extraites.json (défaut : VERALLIA_COMMANDES_URL(S))")
+    parser.add_argument('--refresh', type=float, default=REFRESH_INTERVAL,
+                        help="Intervalle de revalidation de la base en secondes (0 : jamais)")
+    parser.add_argument('-v', '--verbose', action='store_true', help="Journalise chaque requête")
+    args = parser.parse_args(argv)
+
+    default_source = os.environ.get('VERALLIA_COMMANDES_URL', batch.DEFAULT_COMMANDES)
+    commandes_sources = [args.commandes] if args.commandes else sources.sources_from_env(default_source)
+    service = CorrectionService(sources.MultiSourceSnapshot(commandes_sources), args.workers, args.queue)
+
+    started = time.perf_counter()
+    try:
+        service.start(args.refresh)
+    except Exception as e:
+        print(f"❌ {e}", file=sys.stderr)
+        return 1
+    server = make_server(service, args.host, args.port, args.verbose)
+    print(
+        f"✅ {service.orders} commandes, {service.workers} workers prêts en "
+        f"{time.perf_counter() - started:.2f}s — http://{args.host}:{args.port} "
+        f"(file de {service.queue_size} requêtes)"
+    )
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.stop()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
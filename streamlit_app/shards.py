@@ -0,0 +1,349 @@
+"""
+VERALLIA Modificator - Correction d'un fichier par portions parallèles
+Découpe un export volumineux aux frontières des blocs <Assignment>, calcule
+les corrections de chaque portion dans un pool de processus (moteur par
+patch d'octets, patcher.py), puis écrit le document dans l'ordre d'origine
+
+Les portions ne renvoient que leurs modifications (positions et octets de
+remplacement) : l'enveloppe, la déclaration ISO-8859-1 et tout ce qui
+n'est pas modifié sont recopiés de l'original, si bien que la sortie est
+identique octet pour octet à celle de patcher.correct_document. Un
+découpage qui tomberait à l'intérieur d'un bloc (document inhabituel) est
+détecté par les workers : le fichier est alors corrigé en un seul passage.
+"""
+
+import functools
+import mmap
+import multiprocessing
+import os
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import patcher
+from metrics import METRICS
+from streaming import collector
+
+
+# ============================================================================
+# CONFIGURATION
+# ============================================================================
+
+# En dessous, le coût du pool dépasse le gain : correction en un passage
+MIN_FILE_BYTES = 8 * 1024 * 1024
+
+# Taille minimale d'une portion, et nombre de portions par worker (les
+# portions les plus denses en corrections ne retardent pas tout le lot)
+MIN_SHARD_BYTES = 1024 * 1024
+SHARDS_PER_WORKER = 4
+
+# Ouvertures de commentaires, CDATA et instructions de traitement, et leur fin
+_MARKUP_OPEN = re.compile(rb'<!--|<!\[CDATA\[|<\?')
+_MARKUP_CLOSE = {b'<!--': b'-->', b'<![CDATA[': b']]>', b'<?': b'?>'}
+
+
+@functools.lru_cache(maxsize=16)
+def _assignment_start(hr_prefixes: frozenset):
+    prefixes = b'|'.join(sorted(re.escape(prefix) + b':' if prefix else b'' for prefix in hr_prefixes))
+    return re.compile(rb'<(?:' + prefixes + rb')Assignment[\s/>]')
+
+
+# ============================================================================
+# DÉCOUPAGE
+# ============================================================================
+
+def _markup_end(data, start: int, position: int):
+    """
+    Fin du commentaire / CDATA / instruction qui contient position, ou None
+
+    start doit être hors de tout balisage : seules les ouvertures situées
+    entre start et position sont examinées.
+    """
+    while True:
+        match = _MARKUP_OPEN.search(data, start, position)
+        if match is None:
+            return None
+        end = data.find(_MARKUP_CLOSE[match.group(0)], match.end())
+        end = len(data) if end == -1 else end + len(_MARKUP_CLOSE[match.group(0)])
+        if end > position:
+            return end
+        start = end
+
+
+def split_ranges(data, hr_prefixes: frozenset, count: int) -> list:
+    """
+    Découpe data en au plus count portions contiguës commençant chacune par
+    une balise <Assignment> (sauf la première, qui porte le prologue)
+
+    Seules quelques positions sont examinées : pour chaque cible (tailles
+    égales), la balise <Assignment> suivante, écartée si elle se trouve dans
+    un commentaire, une section CDATA ou une instruction de traitement. Un
+    <Assignment> imbriqué dans un autre n'est pas repéré ici : la portion
+    serait déséquilibrée et son balayage lève PatchUnsupported.
+
+    Returns:
+        Liste de (début, fin) couvrant data
+    """
+    size = len(data)
+    token = _assignment_start(hr_prefixes)
+    boundaries = [0]
+    for k in range(1, count):
+        position = max(size * k // count, boundaries[-1] + 1)
+        while True:
+            match = token.search(data, position)
+            if match is None:
+                break
+            end = _markup_end(data, boundaries[-1], match.start())
+            if end is None:
+                break
+            position = end
+        if match is None:
+            break
+        boundaries.append(match.start())
+    boundaries.append(size)
+    return list(zip(boundaries, boundaries[1:]))
+
+
+# ============================================================================
+# WORKERS
+# ============================================================================
+
+_commandes_map = None
+_only_orders = None
+
+
+def _init_worker(commandes_map, only_orders):
+    global _commandes_map, _only_orders
+    _commandes_map = commandes_map
+    _only_orders = only_orders
+
+
+def _correct_range(source, start: int, end: int, prolog: tuple, validate: bool, changes: bool) -> tuple:
+    """
+    Corrige une portion (exécuté dans un worker)
+
+    Args:
+        source: Chemin du fichier (projeté en mémoire par le worker), ou
+            octets de la portion seule (positions alors relatives à start)
+
+    Returns:
+        (modifications aux positions du fichier, stats, mesures)
+    """
+    METRICS.reset()
+    mapped = None
+    try:
+        if isinstance(source, str):
+            with open(source, 'rb') as f:
+                data = mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            base, scan_start, scan_end = 0, start, end
+        else:
+            data = source
+            base, scan_start, scan_end = start, 0, len(source)
+        started = time.perf_counter()
+        shard = patcher._Patcher(data, _commandes_map, _only_orders, validate, changes, prolog=prolog)
+        shard.run(scan_start, scan_end)
+        patcher.record_scan(shard, time.perf_counter() - started)
+        edits = [(edit_start + base, edit_end + base, bytes(replacement))
+                 for edit_start, edit_end, replacement in shard.edits]
+    finally:
+        if mapped is not None:
+            mapped.close()
+    return edits, shard.stats, METRICS.snapshot()
+
+
+# ============================================================================
+# ASSEMBLAGE
+# ============================================================================
+
+def _renumber(entries: list, offset: int) -> list:
+    """Positions de blocs d'une portion → positions dans le fichier"""
+    if offset:
+        for entry in entries:
+            entry['assignment'] += offset
+            if 'path' in entry:
+                entry['path'] = f"Assignment[{entry['assignment']}]" + entry['path'][entry['path'].index(']') + 1:]
+    return entries
+
+
+def merge_stats(results: list, validate=False, changes=False) -> dict:
+    """
+    Stats du fichier à partir de celles des portions, dans l'ordre : mêmes
+    valeurs (numéros de blocs, ordre des commandes) qu'un passage unique
+    """
+    stats = {
+        'assignments': 0,
+        'contratsCorriges': 0,
+        'contratsIgnores': 0,
+        'corrections': 0,
+        'commandesTrouvees': [],
+        'commandesManquantes': [],
+    }
+    if validate:
+        stats['violations'] = collector(validate)
+    if changes:
+        stats['changes'] = collector(changes)
+    seen_orders = set()
+    for shard in results:
+        for key in ('violations', 'changes'):
+            if key in stats:
+                stats[key].extend(_renumber(shard[key], stats['assignments']))
+        for key in ('assignments', 'contratsCorriges', 'contratsIgnores', 'corrections'):
+            stats[key] += shard[key]
+        for key in ('commandesTrouvees', 'commandesManquantes'):
+            for numero in shard[key]:
+                if numero not in seen_orders:
+                    seen_orders.add(numero)
+                    stats[key].append(numero)
+    return stats
+
+
+# ============================================================================
+# API
+# ============================================================================
+
+def patch_stream_sharded(source, destination, commandes_map, workers: int = None, only_orders=None,
+                         validate: bool = False, changes: bool = False, shard_bytes: int = MIN_SHARD_BYTES) -> dict:
+    """
+    Variante parallèle de patcher.patch_stream (même sortie, mêmes stats)
+
+    Args:
+        source: Chemin, fichier binaire ou bytes
+        destination: Chemin ou fichier binaire de sortie
+        commandes_map: Mapping {numero_commande: {codePoste, codeCycle}}
+            (transmis à chaque worker)
+        workers: Nombre de processus (défaut : nombre de cœurs)
+        only_orders: Numéros à corriger exclusivement (mode incrémental)
+        validate: Vérifie chaque bloc corrigé (règles de validation.py)
+        changes: Relève les valeurs avant / après (rapport changeset.py)
+        shard_bytes: Taille minimale d'une portion
+
+    Returns:
+        dict de statistiques (mêmes clés que correct_stream)
+
+    Raises:
+        PatchUnsupported si le document, ou l'une de ses portions, sort du
+        périmètre du moteur par patch (rien n'a alors été écrit)
+        etree.XMLSyntaxError si le document est mal formé (rien n'est écrit)
+    """
+    patcher.check_rules()
+    workers = max(1, workers or os.cpu_count() or 1)
+    owned = []
+    mapped = None
+    chunks = None
+    try:
+        path = None
+        if isinstance(source, (str, os.PathLike)):
+            path = os.fspath(source)
+            f = open(path, 'rb')
+            owned.append(f)
+            if os.fstat(f.fileno()).st_size:
+                data = mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            else:
+                data = b''
+        elif isinstance(source, (bytes, bytearray, memoryview, mmap.mmap)):
+            data = source
+        else:
+            source.seek(0)
+            data = source.read()
+        size = len(data)
+        # Sur le document entier : une portion isolée n'est pas un document
+        patcher.check_well_formed(data)
+
+        started = time.perf_counter()
+        document = patcher._Patcher(data, commandes_map, only_orders, validate, changes)
+        count = min(workers * SHARDS_PER_WORKER, max(1, size // max(1, shard_bytes)))
+        ranges = split_ranges(data, document.hr_prefixes, count) if document.hr_prefixes else [(0, size)]
+        METRICS.record_stage('extract', time.perf_counter() - started)
+
+        if len(ranges) == 1 or workers == 1:
+            # Rien à répartir : balayage dans ce processus
+            started = time.perf_counter()
+            document.run()
+            patcher.record_scan(document, time.perf_counter() - started)
+            stats = document.stats
+        else:
+            tasks = [
+                (path if path is not None else bytes(data[start:end]), start, end)
+                for start, end in ranges
+            ]
+            # spawn, comme jobs.py et service.py : correct_document peut être
+            # appelé depuis un processus multi-thread (application, service)
+            with ProcessPoolExecutor(max_workers=min(workers, len(ranges)),
+                                     mp_context=multiprocessing.get_context('spawn'),
+                                     initializer=_init_worker, initargs=(commandes_map, only_orders)) as pool:
+                futures = [
+                    pool.submit(_correct_range, shard_source, start, end, document.prolog,
+                                bool(validate), bool(changes))
+                    for shard_source, start, end in tasks
+                ]
+                results = [future.result() for future in futures]
+            for edits, _, snapshot in results:
+                document.edits.extend(edits)
+                METRICS.merge(snapshot)
+            stats = merge_stats([shard_stats for _, shard_stats, _ in results], validate, changes)
+        METRICS.incr('shards', len(ranges))
+
+        chunks = document.chunks()
+        if isinstance(destination, (str, os.PathLike)):
+            output = open(destination, 'wb')
+            owned.append(output)
+        else:
+            output = destination
+        started = time.perf_counter()
+        for chunk in chunks:
+            output.write(chunk)
+            if isinstance(chunk, memoryview):
+                chunk.release()
+        METRICS.record_stage('serialize', time.perf_counter() - started)
+    finally:
+        # Les tranches (memoryview) doivent être libérées avant le mmap
+        if chunks is not None:
+            chunks.close()
+        if mapped is not None:
+            mapped.close()
+        for f in reversed(owned):
+            f.close()
+
+    patcher.record_file(stats, size)
+    return stats
+
+
+def correct_document(source, destination, commandes_map, workers: int = None, only_orders=None,
+                     validate: bool = False, changes: bool = False) -> dict:
+    """
+    patcher.correct_document, réparti sur plusieurs processus pour les
+    fichiers volumineux
+
+    Les petits fichiers, un seul worker, ou un document hors du périmètre
+    du découpage passent par patcher.correct_document (même sortie).
+
+    Args:
+        source: Chemin ou fichier binaire du XML original
+        destination: Chemin ou fichier binaire de sortie
+        commandes_map: Mapping {numero_commande: {codePoste, codeCycle}}
+        workers: Nombre de processus (défaut : nombre de cœurs)
+        only_orders: Numéros à corriger exclusivement (mode incrémental)
+        validate: Vérifie chaque bloc corrigé (règles de validation.py)
+        changes: Relève les valeurs avant / après (rapport changeset.py)
+
+    Returns:
+        dict de statistiques (mêmes clés que correct_stream)
+
+    Raises:
+        etree.XMLSyntaxError si le document est mal formé (rien n'est écrit)
+    """
+    workers = max(1, workers or os.cpu_count() or 1)
+    if isinstance(source, (str, os.PathLike)):
+        size = os.path.getsize(source)
+    elif isinstance(source, (bytes, bytearray, memoryview, mmap.mmap)):
+        size = len(source)
+    else:
+        size = None
+    if workers > 1 and size is not None and size >= MIN_FILE_BYTES:
+        try:
+            return patch_stream_sharded(source, destination, commandes_map, workers, only_orders, validate,
+                                        changes)
+        except patcher.PatchUnsupported:
+            # Rien n'a encore été écrit : passage unique (ou lxml)
+            METRICS.incr('shard_fallbacks')
+    return patcher.correct_document(source, destination, commandes_map, only_orders, validate, changes)
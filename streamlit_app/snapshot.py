@@ -0,0 +1,281 @@
+"""
+VERALLIA Modificator - Cache local des commandes
+Conserve sur disque la dernière copie valide de commandes_extraites.json et
+la revalide de façon conditionnelle (ETag / If-Modified-Since)
+"""
+
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from datetime import datetime
+from urllib.parse import urlparse
+from urllib.request import url2pathname
+
+from metrics import METRICS
+
+
+# ============================================================================
+# CONFIGURATION
+# ============================================================================
+
+DEFAULT_CACHE_DIR = os.environ.get(
+    'VERALLIA_CACHE_DIR',
+    os.path.join(os.path.expanduser('~'), '.cache', 'verallia_modificator'),
+)
+
+# Délai au-delà duquel la copie locale est revalidée
+REFRESH_INTERVAL = 300
+
+# Statuts de revalidation
+STATUS_UPDATED = 'updated'
+STATUS_UNCHANGED = 'unchanged'
+STATUS_NOT_MODIFIED = 'not_modified'
+STATUS_ERROR = 'error'
+
+
+# ============================================================================
+# OUTILS
+# ============================================================================
+
+def _local_path(source: str):
+    """Chemin local d'une source fichier (chemin ou file://), sinon None"""
+    if source.startswith(('http://', 'https://')):
+        return None
+    if source.startswith('file://'):
+        return url2pathname(urlparse(source).path)
+    return source
+
+
+def parse_commandes(content: bytes) -> list:
+    """
+    Décode le contenu JSON des commandes
+
+    Raises:
+        ValueError si le contenu n'est pas une liste JSON
+    """
+    data = json.loads(content)
+    if not isinstance(data, list):
+        raise ValueError("Le fichier des commandes doit contenir une liste JSON")
+    return [c for c in data if c is not None and isinstance(c, dict)]
+
+
+# ============================================================================
+# CACHE
+# ============================================================================
+
+class SnapshotCache:
+    """
+    Copie locale persistante d'une source de commandes
+
+    - load() sert immédiatement la dernière copie valide (disque)
+    - refresh() revalide la source : requête conditionnelle en HTTP,
+      date/taille pour un fichier local ; la copie n'est remplacée que si le
+      hash SHA-256 du contenu change
+    - en cas d'erreur réseau, la dernière copie valide reste servie
+    """
+
+    def __init__(self, source: str, cache_dir: str = None, timeout: float = 10,
+                 session: 'requests.Session' = None):
+        self.source = source
+        self.cache_dir = cache_dir or DEFAULT_CACHE_DIR
+        self.timeout = timeout
+        # Session partagée (pool de connexions) entre plusieurs sources
+        self.session = session
+
+        key = hashlib.sha1(source.encode('utf-8')).hexdigest()[:16]
+        self.data_path = os.path.join(self.cache_dir, f'commandes_{key}.json')
+        self.meta_path = os.path.join(self.cache_dir, f'commandes_{key}.meta.json')
+
+        self.meta = {}
+        self.last_error = None
+        self.last_checked = 0.0
+        self._commandes = None
+        self._commandes_version = None
+        self._lock = threading.Lock()
+        self._refresh_thread = None
+
+        self._read_meta()
+
+    # ------------------------------------------------------------------
+    # Lecture de la copie locale
+    # ------------------------------------------------------------------
+
+    def _read_meta(self):
+        try:
+            with open(self.meta_path, 'r', encoding='utf-8') as f:
+                self.meta = json.load(f)
+        except (OSError, ValueError):
+            self.meta = {}
+
+    @property
+    def version(self) -> str:
+        """Hash SHA-256 du contenu courant (None si aucune copie)"""
+        if not os.path.exists(self.data_path):
+            return None
+        return self.meta.get('sha256')
+
+    @property
+    def fetched_at(self) -> str:
+        """Date de la dernière mise à jour effective de la copie locale"""
+        return self.meta.get('updatedAt')
+
+    def load(self) -> list:
+        """
+        Retourne les commandes de la copie locale (sans accès réseau)
+
+        Returns:
+            Liste des commandes, ou None si aucune copie n'existe
+        """
+        return self.load_versioned()[1]
+
+    def load_versioned(self) -> tuple:
+        """
+        Commandes de la copie locale et leur version, lues ensemble
+
+        Une revalidation peut remplacer la copie entre la lecture de version
+        et celle de load() ; la version retournée ici est toujours celle des
+        commandes retournées.
+
+        Returns:
+            (hash SHA-256 du contenu, liste des commandes), ou (None, None)
+            si aucune copie n'existe
+        """
+        with self._lock:
+            if self._commandes is None:
+                try:
+                    with open(self.data_path, 'rb') as f:
+                        content = f.read()
+                    self._commandes = parse_commandes(content)
+                except (OSError, ValueError):
+                    return None, None
+                self._commandes_version = hashlib.sha256(content).hexdigest()
+            return self._commandes_version, self._commandes
+
+    # ------------------------------------------------------------------
+    # Revalidation
+    # ------------------------------------------------------------------
+
+    def _fetch(self):
+        """
+        Interroge la source
+
+        Returns:
+            (contenu ou None si non modifié, nouvelles méta-données)
+        """
+        path = _local_path(self.source)
+
+        if path is not None:
+            stat = os.stat(path)
+            validator = f'{stat.st_mtime_ns}-{stat.st_size}'
+            if validator == self.meta.get('fileValidator') and self.version:
+                return None, {}
+            with open(path, 'rb') as f:
+                return f.read(), {'fileValidator': validator}
+
+        headers = {}
+        if self.version:
+            if self.meta.get('etag'):
+                headers['If-None-Match'] = self.meta['etag']
+            if self.meta.get('lastModified'):
+                headers['If-Modified-Since'] = self.meta['lastModified']
+
+        # requests n'est importé qu'à la première requête HTTP
+        import requests
+
+        response = (self.session or requests).get(self.source, headers=headers, timeout=self.timeout)
+        if response.status_code == 304:
+            return None, {}
+        if response.status_code != 200:
+            raise RuntimeError(f"HTTP {response.status_code}")
+
+        return response.content, {
+            'etag': response.headers.get('ETag'),
+            'lastModified': response.headers.get('Last-Modified'),
+        }
+
+    def _write_atomic(self, path: str, content: bytes):
+        # Fichier temporaire propre à chaque écriture : deux revalidations
+        # simultanées (threads, processus) n'écrivent jamais le même
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(content)
+        os.replace(tmp_path, path)
+
+    def refresh(self) -> str:
+        """
+        Revalide la copie locale auprès de la source
+
+        Returns:
+            STATUS_UPDATED, STATUS_UNCHANGED, STATUS_NOT_MODIFIED ou
+            STATUS_ERROR (voir last_error)
+        """
+        self.last_checked = time.time()
+        try:
+            with METRICS.stage('fetch'):
+                content, validators = self._fetch()
+        except Exception as e:
+            self.last_error = str(e)
+            METRICS.incr('fetches', result='error')
+            return STATUS_ERROR
+
+        self.last_error = None
+        if content is None:
+            METRICS.incr('fetches', result='not_modified')
+            return STATUS_NOT_MODIFIED
+        METRICS.incr('fetches', result='downloaded')
+
+        digest = hashlib.sha256(content).hexdigest()
+        meta = dict(self.meta, **validators, source=self.source, sha256=digest)
+
+        if digest == self.version:
+            status = STATUS_UNCHANGED
+        else:
+            try:
+                commandes = parse_commandes(content)
+            except ValueError as e:
+                self.last_error = f"Contenu invalide : {e}"
+                return STATUS_ERROR
+
+            os.makedirs(self.cache_dir, exist_ok=True)
+            self._write_atomic(self.data_path, content)
+            meta['updatedAt'] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+            with self._lock:
+                self._commandes, self._commandes_version = commandes, digest
+            status = STATUS_UPDATED
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self._write_atomic(self.meta_path, json.dumps(meta, indent=2).encode('utf-8'))
+        self.meta = meta
+        return status
+
+    def refresh_in_background(self):
+        """Lance une revalidation dans un thread si aucune n'est en cours"""
+        with self._lock:
+            if self._refresh_thread is not None and self._refresh_thread.is_alive():
+                return
+            self.last_checked = time.time()
+            self._refresh_thread = threading.Thread(target=self.refresh, daemon=True)
+            self._refresh_thread.start()
+
+    def get_commandes(self, max_age: float = REFRESH_INTERVAL) -> list:
+        """
+        Retourne les commandes en privilégiant la copie locale
+
+        - aucune copie locale : revalidation synchrone
+        - copie plus ancienne que max_age : servie immédiatement, revalidée
+          en arrière-plan
+
+        Returns:
+            Liste des commandes (vide si aucune copie n'a jamais pu être
+            obtenue)
+        """
+        commandes = self.load()
+        if commandes is None:
+            self.refresh()
+            commandes = self.load()
+        elif time.time() - self.last_checked > max_age:
+            self.refresh_in_background()
+        return commandes or []
@@ -0,0 +1,304 @@
+"""
+VERALLIA Modificator - Sources multiples de commandes
+Revalide en parallèle les extractions de plusieurs agences / usines et les
+fusionne en une seule liste de commandes dédoublonnée
+"""
+
+import asyncio
+import hashlib
+import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from snapshot import (
+    REFRESH_INTERVAL,
+    STATUS_ERROR,
+    STATUS_NOT_MODIFIED,
+    STATUS_UNCHANGED,
+    STATUS_UPDATED,
+    SnapshotCache,
+    _local_path,
+)
+
+
+# ============================================================================
+# CONFIGURATION
+# ============================================================================
+
+# Liste des sources (URL, chemin local ou file://), séparées par des
+# virgules, points-virgules ou retours à la ligne
+SOURCES_ENV = 'VERALLIA_COMMANDES_URLS'
+
+# Délai maximal accordé à chaque source (secondes)
+DEFAULT_TIMEOUT = float(os.environ.get('VERALLIA_COMMANDES_TIMEOUT', 10))
+
+# Nouvel essai d'une source sans copie locale : délai doublé à chaque échec
+# (secondes), plafonné à REFRESH_INTERVAL
+RETRY_DELAY = 5
+
+
+def sources_from_env(default: str) -> list:
+    """Sources configurées par VERALLIA_COMMANDES_URLS, sinon [default]"""
+    raw = os.environ.get(SOURCES_ENV, '')
+    sources = [s.strip() for s in re.split(r'[,;\n]', raw) if s.strip()]
+    return sources or [default]
+
+
+def make_session(pool_size: int) -> 'requests.Session':
+    """Session HTTP dont le pool de connexions couvre toutes les sources"""
+    import requests
+    from requests.adapters import HTTPAdapter
+
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+# ============================================================================
+# FUSION
+# ============================================================================
+
+def merge_commandes(sources_commandes: list) -> list:
+    """
+    Fusionne les commandes de plusieurs sources
+
+    Un même email (emailId) extrait par plusieurs sources n'est conservé
+    qu'une fois : l'extraction la plus récente (dateExtraction), la première
+    source l'emportant à égalité. La précédence entre emails d'un même
+    numéro de commande reste assurée par OrderIndex.
+
+    Args:
+        sources_commandes: Listes de commandes, dans l'ordre des sources
+
+    Returns:
+        Liste fusionnée
+    """
+    by_email = {}
+    merged = []
+    for commandes in sources_commandes:
+        for commande in commandes:
+            email_id = commande.get('emailId')
+            if not email_id:
+                merged.append(commande)
+                continue
+            current = by_email.get(email_id)
+            if current is None or (commande.get('dateExtraction') or '') > (current.get('dateExtraction') or ''):
+                by_email[email_id] = commande
+    merged.extend(by_email.values())
+    return merged
+
+
+# ============================================================================
+# SOURCES MULTIPLES
+# ============================================================================
+
+class MultiSourceSnapshot:
+    """
+    Copies locales de plusieurs sources de commandes, vues comme une seule
+
+    Même interface que SnapshotCache (load, refresh, get_commandes,
+    version, fetched_at, last_error). Chaque source garde son propre
+    SnapshotCache ; les revalidations sont lancées en parallèle (asyncio,
+    une requête bloquante par thread, connexions HTTP mutualisées) avec un
+    délai par source : une source lente ou injoignable est signalée dans
+    report et sa dernière copie valide reste utilisée, sans retarder les
+    autres.
+    """
+
+    def __init__(self, sources: list, cache_dir: str = None,
+                 timeout: float = DEFAULT_TIMEOUT, timeouts: dict = None):
+        self.sources = list(sources)
+        self.timeouts = {source: (timeouts or {}).get(source, timeout) for source in self.sources}
+        # Session HTTP créée à la première revalidation (hors du premier
+        # affichage quand les copies locales existent)
+        self.session = None
+        self.caches = [SnapshotCache(source, cache_dir, self.timeouts[source]) for source in self.sources]
+
+        # Résultat de la dernière revalidation, par source
+        self.report = {
+            source: {'status': None, 'latency': None, 'error': None, 'commandes': 0}
+            for source in self.sources
+        }
+        self.last_checked = 0.0
+        # Sources sans copie locale : échecs consécutifs et prochain essai
+        self.failures = {source: 0 for source in self.sources}
+        self.retry_at = {source: 0.0 for source in self.sources}
+
+        self._executor = ThreadPoolExecutor(max_workers=len(self.sources), thread_name_prefix='commandes')
+        self._pending = {}
+        self._merged = None
+        self._merged_version = None
+        self._lock = threading.Lock()
+        self._refresh_thread = None
+
+    # ------------------------------------------------------------------
+    # État agrégé
+    # ------------------------------------------------------------------
+
+    @property
+    def version(self) -> str:
+        """Hash des versions des sources (None si aucune copie)"""
+        return self._combine_versions([cache.version for cache in self.caches])
+
+    def _combine_versions(self, versions: list) -> str:
+        if not any(versions):
+            return None
+        if len(self.caches) == 1:
+            return versions[0]
+        combined = '\n'.join(f'{cache.source}={v or ""}' for cache, v in zip(self.caches, versions))
+        return hashlib.sha256(combined.encode('utf-8')).hexdigest()
+
+    @property
+    def fetched_at(self) -> str:
+        """Date de la mise à jour la plus récente parmi les sources"""
+        dates = [cache.fetched_at for cache in self.caches if cache.fetched_at]
+        return max(dates) if dates else None
+
+    @property
+    def last_error(self) -> str:
+        """Erreurs de la dernière revalidation, par source (None si aucune)"""
+        errors = [
+            f"{source} : {entry['error']}" if len(self.sources) > 1 else entry['error']
+            for source, entry in self.report.items() if entry['error']
+        ]
+        return ' ; '.join(errors) or None
+
+    def load(self) -> list:
+        """
+        Commandes fusionnées des copies locales (sans accès réseau)
+
+        Returns:
+            Liste fusionnée, ou None si aucune source n'a de copie
+        """
+        return self.load_versioned()[1]
+
+    def load_versioned(self) -> tuple:
+        """
+        Commandes fusionnées et leur version, lues ensemble (voir
+        SnapshotCache.load_versioned)
+
+        Returns:
+            (version, liste fusionnée), ou (None, None) si aucune source n'a
+            de copie
+        """
+        version = self.version
+        with self._lock:
+            if version is not None and version == self._merged_version:
+                return version, self._merged
+
+        loaded = [cache.load_versioned() for cache in self.caches]
+        if all(commandes is None for _, commandes in loaded):
+            return None, None
+        version = self._combine_versions([v for v, _ in loaded])
+        merged = merge_commandes([commandes for _, commandes in loaded if commandes])
+
+        with self._lock:
+            self._merged, self._merged_version = merged, version
+        return version, merged
+
+    # ------------------------------------------------------------------
+    # Revalidation
+    # ------------------------------------------------------------------
+
+    async def _refresh_source(self, cache: SnapshotCache):
+        timeout = self.timeouts[cache.source]
+        started = time.perf_counter()
+
+        # Une revalidation restée bloquée au passage précédent n'est pas relancée
+        future = self._pending.get(cache.source)
+        if future is None or future.done():
+            future = self._executor.submit(cache.refresh)
+            self._pending[cache.source] = future
+
+        try:
+            # Au-delà du délai, seule l'attente est abandonnée : le thread
+            # termine sa requête (bornée par le timeout HTTP) et la copie
+            # locale sera à jour au passage suivant
+            status = await asyncio.wait_for(asyncio.wrap_future(future), timeout)
+            error = cache.last_error
+        except asyncio.TimeoutError:
+            status, error = STATUS_ERROR, f"délai dépassé ({timeout:g}s)"
+
+        commandes = cache.load()
+        if commandes is None:
+            failures = self.failures[cache.source] = self.failures[cache.source] + 1
+            self.retry_at[cache.source] = time.time() + min(RETRY_DELAY * 2 ** (failures - 1), REFRESH_INTERVAL)
+        else:
+            self.failures[cache.source] = 0
+        self.report[cache.source] = {
+            'status': status,
+            'latency': time.perf_counter() - started,
+            'error': error,
+            'commandes': len(commandes) if commandes else 0,
+        }
+        return status
+
+    async def refresh_async(self, caches: list = None) -> list:
+        """Revalide les sources (toutes par défaut) en parallèle ; retourne leurs statuts"""
+        return await asyncio.gather(*(self._refresh_source(cache) for cache in caches or self.caches))
+
+    def refresh(self, caches: list = None) -> str:
+        """
+        Revalide les sources
+
+        Args:
+            caches: Sources à revalider (par défaut toutes)
+
+        Returns:
+            STATUS_UPDATED si au moins une source a changé, STATUS_ERROR si
+            toutes ont échoué, sinon STATUS_UNCHANGED / STATUS_NOT_MODIFIED
+        """
+        if caches is None:
+            self.last_checked = time.time()
+        with self._lock:
+            if self.session is None and any(_local_path(cache.source) is None for cache in self.caches):
+                self.session = make_session(len(self.sources))
+                for cache in self.caches:
+                    cache.session = self.session
+        statuses = asyncio.run(self.refresh_async(caches))
+        if STATUS_UPDATED in statuses:
+            return STATUS_UPDATED
+        if all(status == STATUS_ERROR for status in statuses):
+            return STATUS_ERROR
+        return STATUS_UNCHANGED if STATUS_UNCHANGED in statuses else STATUS_NOT_MODIFIED
+
+    def refresh_in_background(self, caches: list = None):
+        """Lance une revalidation (voir refresh) dans un thread si aucune n'est en cours"""
+        with self._lock:
+            if self._refresh_thread is not None and self._refresh_thread.is_alive():
+                return
+            if caches is None:
+                self.last_checked = time.time()
+            self._refresh_thread = threading.Thread(target=self.refresh, args=(caches,), daemon=True)
+            self._refresh_thread.start()
+
+    def revalidate(self, max_age: float = REFRESH_INTERVAL):
+        """
+        Revalide les sources si nécessaire, sans charger les commandes
+
+        - premier passage sans aucune copie locale : revalidation synchrone
+          (bornée par les délais par source)
+        - copies plus anciennes que max_age : revalidées en arrière-plan
+        - sinon, sources encore sans copie : nouvel essai en arrière-plan,
+          après un délai doublé à chaque échec (RETRY_DELAY) ; les sources
+          qui ont une copie sont servies sans attendre
+        """
+        now = time.time()
+        missing = [cache for cache in self.caches if cache.version is None]
+        if not self.last_checked and len(missing) == len(self.caches):
+            self.refresh()
+        elif now - self.last_checked > max_age:
+            self.refresh_in_background()
+        else:
+            due = [cache for cache in missing if now >= self.retry_at[cache.source]]
+            if due:
+                self.refresh_in_background(due)
+
+    def get_commandes(self, max_age: float = REFRESH_INTERVAL) -> list:
+        """Commandes fusionnées des copies locales, revalidées si nécessaire (voir revalidate)"""
+        self.revalidate(max_age)
+        return self.load() or []
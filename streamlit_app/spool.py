@@ -0,0 +1,339 @@
+"""
+VERALLIA Modificator - Mode mémoire bornée
+Pour les fichiers trop gros pour être corrigés en mémoire (octets reçus,
+sortie BytesIO, rapports et tampon de téléchargement : 4 à 6 fois la
+taille du fichier), l'entrée et la sortie passent par des fichiers
+temporaires, la correction se fait en flux (chaque <Assignment> est libéré
+une fois écrit), les rapports sont écrits sur disque au fil de l'eau et le
+téléchargement est servi depuis le disque
+"""
+
+import ipaddress
+import json
+import os
+import secrets
+import shutil
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import quote, urlsplit
+
+import incremental
+
+
+# ============================================================================
+# CONFIGURATION
+# ============================================================================
+
+# Budget mémoire (Mo) : au-delà, les fichiers sont traités en mode borné
+MEMORY_BUDGET_MB = os.environ.get('VERALLIA_MEMORY_BUDGET_MB')
+
+# Mémoire du traitement en mémoire, en multiple de la taille du fichier
+IN_MEMORY_FACTOR = 6
+
+# Répertoire des fichiers temporaires (entrées, sorties, rapports)
+SPOOL_DIR = os.environ.get('VERALLIA_SPOOL_DIR') or os.path.join(tempfile.gettempdir(), 'verallia_spool')
+
+# Téléchargements servis depuis le disque
+DOWNLOAD_HOST = os.environ.get('VERALLIA_DOWNLOAD_HOST', '127.0.0.1')
+DOWNLOAD_PORT = int(os.environ.get('VERALLIA_DOWNLOAD_PORT', 8503))
+# Adresse publique du serveur de téléchargement (proxy), sinon http://hôte:port
+DOWNLOAD_URL = os.environ.get('VERALLIA_DOWNLOAD_URL')
+# Durée de validité d'un lien (et des fichiers temporaires associés)
+DOWNLOAD_TTL = 3600
+
+CHUNK_SIZE = 1024 * 1024
+
+
+def memory_budget() -> int:
+    """Budget mémoire en octets, ou None si le mode borné n'est pas configuré"""
+    if not MEMORY_BUDGET_MB:
+        return None
+    return int(float(MEMORY_BUDGET_MB) * 1024 * 1024)
+
+
+def needs_spooling(size: int, budget: int = None) -> bool:
+    """Vrai si un fichier de cette taille dépasserait le budget en mémoire"""
+    budget = budget if budget is not None else memory_budget()
+    return budget is not None and size * IN_MEMORY_FACTOR > budget
+
+
+# ============================================================================
+# MESURES
+# ============================================================================
+
+def current_rss() -> int:
+    """Mémoire résidente actuelle du processus, en octets (None si inconnue)"""
+    try:
+        with open('/proc/self/statm', 'rb') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def peak_rss() -> int:
+    """Pic de mémoire résidente du processus, en octets (None si inconnu)"""
+    try:
+        import resource
+    except ImportError:
+        return None
+    # ru_maxrss est en Ko sous Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+# ============================================================================
+# FICHIERS TEMPORAIRES
+# ============================================================================
+
+def temp_path(suffix: str = '') -> str:
+    """Chemin d'un nouveau fichier temporaire dans SPOOL_DIR (à supprimer par l'appelant)"""
+    os.makedirs(SPOOL_DIR, exist_ok=True)
+    fd, path = tempfile.mkstemp(dir=SPOOL_DIR, suffix=suffix)
+    os.close(fd)
+    return path
+
+
+def spool_input(fileobj, suffix: str = '.xml') -> str:
+    """
+    Recopie un fichier reçu (upload, corps de requête) sur disque par blocs
+
+    Args:
+        fileobj: Fichier binaire (position restaurée)
+
+    Returns:
+        Chemin du fichier temporaire
+    """
+    path = temp_path(suffix)
+    position = fileobj.tell()
+    fileobj.seek(0)
+    with open(path, 'wb') as f:
+        shutil.copyfileobj(fileobj, f, CHUNK_SIZE)
+    fileobj.seek(position)
+    return path
+
+
+def purge(max_age: float = DOWNLOAD_TTL):
+    """Supprime les fichiers temporaires plus anciens que max_age secondes"""
+    limit = time.time() - max_age
+    try:
+        names = os.listdir(SPOOL_DIR)
+    except OSError:
+        return
+    for name in names:
+        path = os.path.join(SPOOL_DIR, name)
+        try:
+            if os.path.getmtime(path) < limit:
+                os.remove(path)
+        except OSError:
+            pass
+
+
+class SpooledRecords:
+    """
+    Collecteur de violations ou de modifications écrit sur disque (une
+    ligne JSON par entrée), à passer aux moteurs de correction à la place
+    de validate=True / changes=True
+
+    Seul le nombre d'entrées reste en mémoire ; la relecture se fait en
+    flux. Pas de __len__ : un collecteur vide reste « activé ».
+    """
+
+    def __init__(self, suffix: str = '.jsonl'):
+        self.path = temp_path(suffix)
+        self.count = 0
+        self._file = open(self.path, 'w', encoding='utf-8')
+
+    def append(self, record: dict):
+        self._file.write(json.dumps(record, ensure_ascii=False))
+        self._file.write('\n')
+        self.count += 1
+
+    def extend(self, records):
+        for record in records:
+            self.append(record)
+
+    def __iter__(self):
+        self._file.flush()
+        with open(self.path, 'r', encoding='utf-8') as f:
+            for line in f:
+                yield json.loads(line)
+
+    def close(self, remove: bool = True):
+        self._file.close()
+        if remove:
+            try:
+                os.remove(self.path)
+            except OSError:
+                pass
+
+
+# ============================================================================
+# CORRECTION
+# ============================================================================
+
+def correct_file(source, destination: str, commandes_map, manifest: incremental.Manifest = None,
+                 validate: bool = False, changes: bool = False) -> tuple:
+    """
+    Corrige un fichier dans le budget mémoire
+
+    Correction en flux (streaming.correct_stream) : le patch d'octets
+    projette tout le fichier en mémoire (mmap) et garde ses modifications
+    jusqu'à l'écriture, sa mémoire résidente croît avec la taille du
+    fichier. Violations et modifications sont écrites sur disque.
+
+    Args:
+        source: Chemin ou fichier binaire du XML (original, ou déjà corrigé
+            si manifest)
+        destination: Chemin du XML corrigé
+        commandes_map: Mapping {numero_commande: {codePoste, codeCycle}}
+        manifest: Manifeste du passage précédent (correction incrémentale)
+        validate: Relève les écarts HR-XML (SpooledRecords dans stats)
+        changes: Relève le rapport des modifications (SpooledRecords)
+
+    Returns:
+        (stats, nouveau manifeste) ; stats['violations'] et
+        stats['changes'] sont des SpooledRecords à fermer par l'appelant
+    """
+    violations = SpooledRecords() if validate else False
+    records = SpooledRecords() if changes else False
+    try:
+        return incremental.correct_incremental(
+            source, destination, commandes_map, manifest, patch=False, validate=violations, changes=records
+        )
+    except BaseException:
+        for collected in (violations, records):
+            if collected:
+                collected.close()
+        raise
+
+
+# ============================================================================
+# TÉLÉCHARGEMENTS
+# ============================================================================
+
+class _DownloadHandler(BaseHTTPRequestHandler):
+    server_version = 'VeralliaDownload/1.0'
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        token = urlsplit(self.path).path.strip('/')
+        entry = self.server.downloads.lookup(token)
+        if entry is None:
+            self.send_error(404, "Lien de téléchargement inconnu ou expiré")
+            return
+        path, filename, content_type = entry
+        try:
+            f = open(path, 'rb')
+        except OSError:
+            self.send_error(410, "Fichier supprimé")
+            return
+        with f:
+            self.send_response(200)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(os.fstat(f.fileno()).st_size))
+            self.send_header('Content-Disposition', f"attachment; filename*=UTF-8''{quote(filename)}")
+            self.end_headers()
+            shutil.copyfileobj(f, self.wfile, CHUNK_SIZE)
+
+
+def _is_local_address(host: str) -> bool:
+    """Vrai si http://hôte n'est pas joignable depuis un autre poste (boucle locale, 0.0.0.0)"""
+    if host == 'localhost':
+        return True
+    try:
+        address = ipaddress.ip_address(host)
+    except ValueError:
+        return False
+    return address.is_loopback or address.is_unspecified
+
+
+class DownloadServer:
+    """
+    Serveur HTTP local des fichiers produits en mode borné
+
+    Streamlit garde en mémoire les données de st.download_button : les
+    fichiers volumineux sont servis depuis le disque par ce serveur, sous
+    un jeton aléatoire valable DOWNLOAD_TTL secondes.
+
+    Les liens pointent vers public_url (VERALLIA_DOWNLOAD_URL), sinon vers
+    http://hôte:port : sans adresse publique, l'hôte doit être joignable
+    par les navigateurs des utilisateurs.
+    """
+
+    def __init__(self, host: str = DOWNLOAD_HOST, port: int = DOWNLOAD_PORT, public_url: str = DOWNLOAD_URL):
+        self.host = host
+        self.port = port
+        self.public_url = public_url
+        self._entries = {}
+        self._lock = threading.Lock()
+        self._server = None
+
+    def start(self, local_only: bool = False) -> 'DownloadServer':
+        """
+        Démarre le serveur dans un thread
+
+        Args:
+            local_only: Liens ouverts depuis cette machine seulement
+                (vérifications) : l'adresse publique n'est pas exigée
+
+        Raises:
+            RuntimeError si les liens ne seraient pas joignables (ni
+            VERALLIA_DOWNLOAD_URL ni hôte public) ou si le port est pris
+        """
+        if not local_only and not self.public_url and _is_local_address(self.host):
+            raise RuntimeError(
+                f"VERALLIA_DOWNLOAD_URL non défini : les liens http://{self.host}:{self.port} "
+                "ne seraient joignables que depuis le serveur"
+            )
+        try:
+            server = ThreadingHTTPServer((self.host, self.port), _DownloadHandler)
+        except OSError as e:
+            raise RuntimeError(
+                f"Serveur de téléchargement indisponible sur {self.host}:{self.port} ({e.strerror or e})"
+            ) from None
+        server.daemon_threads = True
+        server.downloads = self
+        self._server = server
+        self.port = server.server_address[1]
+        threading.Thread(target=server.serve_forever, name='verallia-downloads', daemon=True).start()
+        return self
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    @property
+    def base_url(self) -> str:
+        return (self.public_url or f'http://{self.host}:{self.port}').rstrip('/')
+
+    def publish(self, path: str, filename: str, content_type: str = 'application/xml') -> str:
+        """
+        Rend un fichier téléchargeable
+
+        Args:
+            path: Fichier sur disque (non supprimé par le serveur)
+            filename: Nom proposé au navigateur
+            content_type: Type MIME de la réponse
+
+        Returns:
+            URL de téléchargement
+        """
+        token = secrets.token_urlsafe(24)
+        now = time.monotonic()
+        with self._lock:
+            self._entries = {t: e for t, e in self._entries.items() if e[0] > now}
+            self._entries[token] = (now + DOWNLOAD_TTL, path, filename, content_type)
+        return f'{self.base_url}/{token}'
+
+    def lookup(self, token: str):
+        """(chemin, nom, type MIME) d'un lien valide, ou None"""
+        with self._lock:
+            entry = self._entries.get(token)
+        if entry is None or entry[0] < time.monotonic():
+            return None
+        return entry[1:]
@@ -0,0 +1,627 @@
+"""
+VERALLIA Modificator - Moteur de correction en flux
+Lit le XML Osmose une seule fois (iterparse) et écrit le XML corrigé au fil
+de l'eau (xmlfile), un bloc <Assignment> à la fois
+"""
+
+import io
+import os
+import threading
+import time
+from lxml import etree
+from xml.sax.saxutils import quoteattr
+
+import changeset
+import rules
+from metrics import METRICS
+from utils import NAMESPACES, resolve_assignment_targets
+from validation import validate_assignment
+
+
+# ============================================================================
+# CONSTANTES
+# ============================================================================
+
+HR_NS = NAMESPACES['hr']
+ASSIGNMENT_TAG = f'{{{HR_NS}}}Assignment'
+ORDER_ID_TAG = f'{{{HR_NS}}}OrderId'
+ID_VALUE_TAG = f'{{{HR_NS}}}IdValue'
+
+# Aperçu des contrats (mêmes chemins que utils.get_contract_info)
+CONTRACT_ID_PATH = 'hr:AssignmentId/hr:IdValue'
+GIVEN_NAME_PATH = './/hr:HumanResource//hr:GivenName'
+FAMILY_NAME_PATH = './/hr:HumanResource//hr:FamilyName'
+
+XML_ENCODING = 'iso-8859-1'
+XML_DECLARATION = b"<?xml version='1.0' encoding='ISO-8859-1'?>\n"
+
+
+# ============================================================================
+# OUTILS
+# ============================================================================
+
+def _open_source(source):
+    """Retourne (fichier binaire, doit_être_fermé)"""
+    if isinstance(source, (str, os.PathLike)):
+        return open(source, 'rb'), True
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        # Contenu déjà en mémoire (repli de patcher.correct_document)
+        return io.BytesIO(source), False
+    if hasattr(source, 'seek'):
+        source.seek(0)
+    return source, False
+
+
+def _open_destination(destination):
+    """Retourne (fichier binaire, doit_être_fermé)"""
+    if isinstance(destination, (str, os.PathLike)):
+        return open(destination, 'wb'), True
+    return destination, False
+
+
+def collector(option) -> list:
+    """
+    Liste des violations ou des modifications d'un passage : le collecteur
+    fourni (tout objet avec append/extend, ex. spool.SpooledRecords) ou une
+    nouvelle liste si l'option est simplement activée
+    """
+    return option if hasattr(option, 'extend') else []
+
+
+def _iterparse(source, events, tag=None):
+    return etree.iterparse(
+        source,
+        events=events,
+        tag=tag,
+        encoding=XML_ENCODING,
+        remove_blank_text=False,
+        huge_tree=True,
+    )
+
+
+def _ns_declarations(nsmap: dict) -> list:
+    """Déclarations xmlns telles que lxml les sérialise"""
+    declarations = []
+    for prefix, uri in nsmap.items():
+        name = 'xmlns' if prefix is None else f'xmlns:{prefix}'
+        declarations.append(f' {name}={quoteattr(uri)}'.encode(XML_ENCODING))
+    return declarations
+
+
+def _serialize_fragment(elem: etree._Element, inherited: list) -> bytes:
+    """
+    Sérialise un élément sans sa queue, en retirant les déclarations de
+    namespace déjà émises par ses ancêtres (lxml les recopie sinon sur
+    chaque fragment)
+    """
+    data = etree.tostring(elem, encoding=XML_ENCODING, xml_declaration=False, with_tail=False)
+    if not inherited or not isinstance(elem.tag, str):
+        return data
+
+    end = data.index(b'>')
+    start_tag = data[:end]
+    for declaration in inherited:
+        start_tag = start_tag.replace(declaration, b'', 1)
+    return start_tag + data[end:]
+
+
+def _serialize_doctype(root: etree._Element, prolog: bytes) -> bytes:
+    """
+    Déclaration <!DOCTYPE …> du document, sous-ensemble interne compris
+    (b'' sans DOCTYPE)
+
+    lxml n'expose pas le sous-ensemble interne : il est repris de la
+    sérialisation de l'arbre partiel (enveloppe et premier bloc seulement),
+    dont on retire les nœuds de premier niveau (prolog, puis la racine).
+    """
+    tree = root.getroottree()
+    if not tree.docinfo.doctype:
+        return b''
+    data = etree.tostring(tree, encoding=XML_ENCODING, xml_declaration=False)
+    nodes = prolog + etree.tostring(root, encoding=XML_ENCODING, xml_declaration=False, with_tail=False)
+    return data[:-len(nodes)] if data.endswith(nodes) else tree.docinfo.doctype.encode(XML_ENCODING) + b'\n'
+
+
+# ============================================================================
+# DÉTECTION DES COMMANDES
+# ============================================================================
+
+def scan_order_numbers(source) -> list:
+    """
+    Extrait TOUS les numéros de commande (OrderId/IdValue) sans construire
+    l'arbre complet
+
+    Args:
+        source: Chemin ou fichier binaire
+
+    Returns:
+        Liste ordonnée et dédoublonnée des numéros de commande
+
+    Raises:
+        etree.XMLSyntaxError si le XML est mal formé
+    """
+    stream, owned = _open_source(source)
+    orders = []
+    seen = set()
+    started = time.perf_counter()
+
+    try:
+        for _, elem in _iterparse(stream, ('end',)):
+            if elem.tag == ID_VALUE_TAG:
+                parent = elem.getparent()
+                if parent is not None and parent.tag == ORDER_ID_TAG and elem.text and elem.text.strip():
+                    numero = elem.text.strip()
+                    if numero not in seen:
+                        orders.append(numero)
+                        seen.add(numero)
+            elif elem.tag == ASSIGNMENT_TAG:
+                elem.clear(keep_tail=True)
+                while elem.getprevious() is not None:
+                    del elem.getparent()[0]
+        METRICS.record_stage('extract', time.perf_counter() - started)
+    finally:
+        if owned:
+            stream.close()
+
+    return orders
+
+
+# ============================================================================
+# APERÇU DES CONTRATS
+# ============================================================================
+
+def _text(elem) -> str:
+    return elem.text.strip() if elem is not None and elem.text else ''
+
+
+def iter_contract_summaries(source):
+    """
+    Résumé de chaque contrat, au fil de la lecture (sans arbre complet)
+
+    Les blocs <Assignment> sont vidés dès qu'ils ont été résumés : le premier
+    résumé est disponible après la lecture du premier contrat, quelle que
+    soit la taille du fichier.
+
+    Args:
+        source: Chemin ou fichier binaire
+
+    Yields:
+        dict {index, numeroCommande, numeroContrat, ressource,
+        customerJobCodeActuel, cycleHoraireActuel}
+
+    Raises:
+        etree.XMLSyntaxError si le XML est mal formé
+    """
+    stream, owned = _open_source(source)
+    depth = 0
+    index = 0
+
+    try:
+        for event, elem in _iterparse(stream, ('start', 'end'), tag=ASSIGNMENT_TAG):
+            if event == 'start':
+                depth += 1
+                continue
+            depth -= 1
+            if depth:
+                # Assignment imbriqué : résumé avec son parent
+                continue
+
+            targets = resolve_assignment_targets(elem)
+            given_name = elem.find(GIVEN_NAME_PATH, NAMESPACES)
+            family_name = elem.find(FAMILY_NAME_PATH, NAMESPACES)
+            index += 1
+            yield {
+                'index': index,
+                'numeroCommande': _text(targets['orderId']),
+                'numeroContrat': _text(elem.find(CONTRACT_ID_PATH, NAMESPACES)),
+                'ressource': f"{_text(given_name)} {_text(family_name)}".strip(),
+                'customerJobCodeActuel': _text(targets['customerJobCode']),
+                'cycleHoraireActuel': _text(targets['cycleIdValue']),
+            }
+
+            elem.clear(keep_tail=True)
+            while elem.getprevious() is not None:
+                del elem.getparent()[0]
+    finally:
+        if owned:
+            stream.close()
+
+
+class ContractSummaryIndex:
+    """
+    Résumés de contrats lus à la demande, page par page
+
+    Seuls les contrats nécessaires à la page demandée sont lus ; les pages
+    déjà vues restent en mémoire (quelques centaines d'octets par contrat).
+    """
+
+    def __init__(self, source):
+        self._summaries = []
+        self._iterator = iter_contract_summaries(source)
+        self._lock = threading.Lock()
+        self.complete = False
+
+    def _read_until(self, count: int):
+        with self._lock:
+            while not self.complete and len(self._summaries) < count:
+                try:
+                    self._summaries.append(next(self._iterator))
+                except StopIteration:
+                    self.complete = True
+
+    def page(self, number: int, size: int) -> list:
+        """
+        Contrats de la page demandée (numérotée à partir de 1)
+
+        Raises:
+            etree.XMLSyntaxError si le XML est mal formé
+        """
+        start = (max(1, number) - 1) * size
+        self._read_until(start + size + 1)
+        return self._summaries[start:start + size]
+
+    @property
+    def loaded(self) -> int:
+        """Nombre de contrats lus jusqu'ici"""
+        return len(self._summaries)
+
+    def close(self):
+        self._iterator.close()
+
+
+# ============================================================================
+# CORRECTION EN FLUX
+# ============================================================================
+
+class _EnvelopeWriter:
+    """
+    Recopie l'enveloppe du document (tout ce qui n'est pas un <Assignment>)
+    au fil de la lecture
+
+    iterparse ne signale que la fin des blocs <Assignment> : à chacun, tout ce
+    qui le précède dans le document est déjà construit dans l'arbre. Le
+    writer ouvre les ancêtres du bloc qui ne le sont pas encore, recopie les
+    frères précédents puis retire de l'arbre ce qui a été écrit.
+    """
+
+    def __init__(self, xf, output):
+        self.xf = xf
+        self.output = output
+        # Ancêtres ouverts : [élément, contexte xf.element, déclarations xmlns]
+        self.stack = []
+        # Dernier nœud écrit dont la queue (tail) reste à recopier
+        self.pending = None
+        self.started = False
+
+    def _flush_pending(self):
+        pending = self.pending
+        if pending is None:
+            return
+        if pending.tail and self.stack:
+            self.xf.write(pending.tail)
+        parent = pending.getparent()
+        if parent is not None:
+            parent.remove(pending)
+        self.pending = None
+
+    def _write_fragment(self, elem):
+        self._flush_pending()
+        if not self.stack and isinstance(elem.tag, str):
+            # Élément racine : écrit par xmlfile lui-même, qui exige
+            # d'avoir produit le contenu du document
+            self.xf.write(elem)
+        else:
+            self.xf.flush()
+            self.output.write(_serialize_fragment(elem, self.stack[-1][2] if self.stack else []))
+        self.pending = elem
+
+    def _write_children_until(self, parent, stop):
+        """Recopie les enfants de parent jusqu'à stop (exclu)"""
+        self._flush_pending()
+        while len(parent):
+            child = parent[0]
+            if child is stop:
+                break
+            self._write_fragment(child)
+            self._flush_pending()
+
+    def _write_prolog(self, root):
+        self.started = True
+        prolog = b''.join(
+            _serialize_fragment(sibling, []) for sibling in reversed(list(root.itersiblings(preceding=True)))
+        )
+        self.xf.flush()
+        self.output.write(_serialize_doctype(root, prolog) + prolog)
+
+    def _open(self, elem):
+        parent_nsmap = self.stack[-1][0].nsmap if self.stack else {}
+        new_ns = {p: u for p, u in elem.nsmap.items() if parent_nsmap.get(p) != u}
+        context = self.xf.element(elem.tag, dict(elem.attrib), nsmap=new_ns or None)
+        context.__enter__()
+        self.stack.append([elem, context, _ns_declarations(elem.nsmap)])
+        if elem.text:
+            self.xf.write(elem.text)
+
+    def _close(self):
+        elem, context, _ = self.stack[-1]
+        self._write_children_until(elem, None)
+        context.__exit__(None, None, None)
+        self.stack.pop()
+        self.pending = elem if self.stack else None
+
+    def write_block(self, block):
+        """Écrit un bloc <Assignment> et tout ce qui le précède"""
+        path = list(block.iterancestors())
+        path.reverse()
+        if not self.started:
+            self._write_prolog(path[0] if path else block)
+
+        common = 0
+        while common < len(self.stack) and common < len(path) and self.stack[common][0] is path[common]:
+            common += 1
+        while len(self.stack) > common:
+            self._close()
+
+        for ancestor in path[common:]:
+            if self.stack:
+                self._write_children_until(self.stack[-1][0], ancestor)
+            self._open(ancestor)
+
+        if self.stack:
+            self._write_children_until(self.stack[-1][0], block)
+        self._write_fragment(block)
+
+    def finish(self, root):
+        """Termine le document : fin de l'enveloppe et épilogue"""
+        if root is None:
+            return
+        if not self.started:
+            # Aucun bloc <Assignment> : recopie intégrale
+            self._write_prolog(root)
+            self._write_fragment(root)
+        while self.stack:
+            self._close()
+        self.pending = None
+        for sibling in root.itersiblings():
+            self.xf.flush()
+            self.output.write(_serialize_fragment(sibling, []))
+
+
+def _change(assignment, number: int, numero: str, commande: dict, targets: dict) -> dict:
+    """Entrée du rapport des modifications, relevée avant correction du bloc"""
+    job_code = targets['customerJobCode']
+    if job_code is not None:
+        job_code_action = changeset.ACTION_UPDATED
+    elif targets['customerReportingRequirements'] is not None:
+        job_code_action = changeset.ACTION_CREATED
+    else:
+        job_code_action = changeset.ACTION_SKIPPED
+    cycle = targets['cycleIdValue']
+    return changeset.make_change(
+        number, numero, _text(assignment.find(CONTRACT_ID_PATH, NAMESPACES)) or None, commande,
+        job_code.text if job_code is not None else None, job_code_action,
+        cycle.text if cycle is not None else None,
+        cycle.get('name') if cycle is not None else None,
+        cycle is not None,
+    )
+
+
+def correct_stream(source, destination, commandes_map, only_orders=None, validate: bool = False,
+                   changes: bool = False) -> dict:
+    """
+    Applique les corrections multi-commandes en un seul passage
+
+    Chaque bloc <Assignment> est corrigé (règles actives de rules.py)
+    puis écrit dès sa balise fermante lue, puis libéré : la mémoire reste
+    bornée à un Assignment à la fois. Le reste du document (enveloppe,
+    commentaires, indentation) est recopié tel quel, en ISO-8859-1.
+
+    Args:
+        source: Chemin ou fichier binaire du XML original
+        destination: Chemin ou fichier binaire de sortie
+        commandes_map: Mapping {numero_commande: {codePoste, codeCycle}}
+            (dict ou OrderIndex ; champs des règles, voir rules.order_values)
+        only_orders: Numéros de commande à corriger exclusivement (mode
+            incrémental) ; les autres contrats sont recopiés tels quels
+        validate: Vérifie chaque bloc corrigé avec les règles HR-XML de
+            validation.py avant de l'écrire (booléen ou collecteur, voir
+            collector)
+        changes: Relève les valeurs avant / après de chaque contrat
+            corrigé, rapport changeset.py (booléen ou collecteur)
+
+    Returns:
+        dict de statistiques (assignments, contrats corrigés / ignorés,
+        corrections, commandes trouvées / manquantes, violations si
+        validate, changes si changes)
+
+    Raises:
+        etree.XMLSyntaxError si le XML source est mal formé
+    """
+    stream, owned_in = _open_source(source)
+    output, owned_out = _open_destination(destination)
+
+    stats = {
+        'assignments': 0,
+        'contratsCorriges': 0,
+        'contratsIgnores': 0,
+        'corrections': 0,
+        'commandesTrouvees': [],
+        'commandesManquantes': [],
+    }
+    if validate:
+        stats['violations'] = collector(validate)
+    if changes:
+        stats['changes'] = collector(changes)
+    seen_orders = set()
+    # Règles actives, compilées en un plan par bloc <Assignment>
+    plan = rules.compile_plan()
+
+    # Mesures accumulées localement, reportées une fois en fin de fichier
+    clock = time.perf_counter
+    t_parse = t_extract = t_match = t_rewrite = t_serialize = t_validate = 0.0
+    tag_counts = {}
+
+    try:
+        with etree.xmlfile(output, encoding=XML_ENCODING) as xf:
+            # Même déclaration que tree.write(encoding='iso-8859-1')
+            output.write(XML_DECLARATION)
+            writer = _EnvelopeWriter(xf, output)
+
+            # Filtrage des événements côté C : seul la fin de chaque bloc
+            # <Assignment> remonte jusqu'à Python
+            events = _iterparse(stream, ('end',), tag=ASSIGNMENT_TAG)
+            mark = clock()
+            for _, elem in events:
+                now = clock()
+                t_parse += now - mark
+                mark = now
+                if next(elem.iterancestors(ASSIGNMENT_TAG), None) is not None:
+                    # Assignment imbriqué : traité avec son bloc englobant
+                    continue
+
+                stats['assignments'] += 1
+                targets = plan.resolve(elem)
+                order_elem = targets['orderId']
+                numero = order_elem.text.strip() if order_elem is not None and order_elem.text else None
+                t1 = clock()
+                commande = commandes_map.get(numero) if numero is not None else None
+                if numero is not None and numero not in seen_orders:
+                    seen_orders.add(numero)
+                    stats['commandesTrouvees' if commande else 'commandesManquantes'].append(numero)
+                t2 = clock()
+                if only_orders is not None and numero not in only_orders:
+                    stats['contratsIgnores'] += 1
+                elif commande:
+                    if changes:
+                        stats['changes'].append(_change(elem, stats['assignments'], numero, commande, targets))
+                    nb = plan.apply(elem, commande, targets, tag_counts)
+                    stats['corrections'] += nb
+                    stats['contratsCorriges'] += 1 if nb else 0
+                t3 = clock()
+                if validate:
+                    stats['violations'].extend(validate_assignment(elem, stats['assignments'], numero))
+                t4 = clock()
+
+                writer.write_block(elem)
+                mark = clock()
+                t_extract += t1 - now
+                t_match += t2 - t1
+                t_rewrite += t3 - t2
+                t_validate += t4 - t3
+                t_serialize += mark - t4
+
+            t_parse += clock() - mark
+            mark = clock()
+            writer.finish(events.root)
+            t_serialize += clock() - mark
+            size = stream.tell() if hasattr(stream, 'tell') else None
+    finally:
+        if owned_in:
+            stream.close()
+        if owned_out:
+            output.close()
+
+    for stage, seconds in (
+        ('parse', t_parse), ('extract', t_extract), ('match', t_match),
+        ('rewrite', t_rewrite), ('serialize', t_serialize),
+    ):
+        METRICS.record_stage(stage, seconds)
+    if validate:
+        METRICS.record_stage('validate', t_validate)
+        for violation in stats['violations']:
+            METRICS.incr('violations', rule=violation['rule'])
+    for (tag, action), count in tag_counts.items():
+        METRICS.incr('tags', count, tag=tag, action=action)
+    untouched = stats['assignments'] - stats['contratsCorriges'] - stats['contratsIgnores']
+    METRICS.incr('assignments', stats['contratsCorriges'], result='corrected')
+    METRICS.incr('assignments', stats['contratsIgnores'], result='ignored')
+    METRICS.incr('assignments', untouched, result='untouched')
+    METRICS.incr('files', result='rewritten')
+    if size is not None:
+        METRICS.observe_file_size(size)
+
+    return stats
+
+
+# ============================================================================
+# VALIDATION EN FLUX
+# ============================================================================
+
+def validate_stream(source) -> list:
+    """
+    Vérifie un document sans le corriger, bloc par bloc (règles de
+    validation.py), en un seul passage et sans construire l'arbre complet
+
+    Args:
+        source: Chemin ou fichier binaire
+
+    Returns:
+        Liste des violations (voir validation.validate_assignment)
+
+    Raises:
+        etree.XMLSyntaxError si le XML est mal formé
+    """
+    stream, owned = _open_source(source)
+    violations = []
+    number = 0
+
+    try:
+        with METRICS.stage('validate'):
+            for _, elem in _iterparse(stream, ('end',), tag=ASSIGNMENT_TAG):
+                if next(elem.iterancestors(ASSIGNMENT_TAG), None) is not None:
+                    continue
+                number += 1
+                order_elem = resolve_assignment_targets(elem)['orderId']
+                numero = order_elem.text.strip() if order_elem is not None and order_elem.text else None
+                violations.extend(validate_assignment(elem, number, numero))
+                # Bloc traité : libère la mémoire
+                elem.clear(keep_tail=True)
+                while elem.getprevious() is not None:
+                    del elem.getparent()[0]
+    finally:
+        if owned:
+            stream.close()
+
+    for violation in violations:
+        METRICS.incr('violations', rule=violation['rule'])
+    return violations
+
+
+# ============================================================================
+# API EN MÉMOIRE (bytes)
+# ============================================================================
+
+def extract_all_order_numbers_from_xml(xml_content) -> list:
+    """
+    Extrait TOUS les numéros de commande du XML (lecture en flux)
+
+    Lève etree.XMLSyntaxError si le fichier est mal formé : ce passage
+    tient aussi lieu de validation du fichier chargé.
+    """
+    if isinstance(xml_content, bytes):
+        xml_content = io.BytesIO(xml_content)
+    return scan_order_numbers(xml_content)
+
+
+def apply_corrections_multi(xml_content, commandes_map: dict) -> tuple:
+    """
+    Applique les corrections pour plusieurs commandes dans le même XML
+
+    Le fichier est lu une seule fois et réécrit au fil de l'eau (voir
+    correct_stream) : la sortie est produite par lxml à partir
+    d'une entrée bien formée, sans re-parse de validation.
+
+    Args:
+        xml_content: Contenu XML original (bytes ou fichier binaire)
+        commandes_map: Dict {numero_commande: {codePoste, codeCycle}}
+
+    Returns:
+        (XML corrigé en bytes, nombre de corrections appliquées)
+    """
+    if isinstance(xml_content, bytes):
+        xml_content = io.BytesIO(xml_content)
+
+    output = io.BytesIO()
+    stats = correct_stream(xml_content, output, commandes_map)
+
+    return output.getvalue(), stats['corrections']
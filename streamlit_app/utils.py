@@ -5,6 +5,12 @@ Fonctions pour modifier les fichiers XML Osmose
 
 from lxml import etree
 import io
+import logging
+import threading
+
+from metrics import METRICS
+
+logger = logging.getLogger(__name__)
 
 
 # ============================================================================
@@ -15,11 +21,38 @@ NAMESPACES = {
     'hr': 'http://ns.hr-xml.org/2004-08-02'
 }
 
+HR = '{http://ns.hr-xml.org/2004-08-02}'
+
+# Balises des corrections et de la validation
+TAG_ORDER_ID = HR + 'OrderId'
+TAG_ID_VALUE = HR + 'IdValue'
+TAG_CUSTOMER_JOB_CODE = HR + 'CustomerJobCode'
+TAG_CUSTOMER_REPORTING = HR + 'CustomerReportingRequirements'
+TAG_EXTERNAL_ORDER = HR + 'ExternalOrderNumber'
+TAG_STAFFING_SHIFT = HR + 'StaffingShift'
+
 
 # ============================================================================
 # LECTURE XML
 # ============================================================================
 
+_parsers = threading.local()
+
+
+def get_parser() -> etree.XMLParser:
+    """
+    Parser ISO-8859-1 réutilisé d'un appel à l'autre
+
+    Un parser lxml ne doit pas servir à deux threads en même temps : une
+    instance est donc conservée par thread.
+    """
+    parser = getattr(_parsers, 'parser', None)
+    if parser is None:
+        parser = etree.XMLParser(encoding='iso-8859-1', remove_blank_text=False)
+        _parsers.parser = parser
+    return parser
+
+
 def parse_xml(xml_content: bytes) -> etree._Element:
     """
     Parse un fichier XML en préservant l'encodage ISO-8859-1
@@ -30,8 +63,7 @@ def parse_xml(xml_content: bytes) -> etree._Element:
     Returns:
         Arbre XML parsé
     """
-    parser = etree.XMLParser(encoding='iso-8859-1', remove_blank_text=False)
-    return etree.parse(io.BytesIO(xml_content), parser)
+    return etree.parse(io.BytesIO(xml_content), get_parser())
 
 
 # ============================================================================
@@ -75,9 +107,28 @@ def get_contract_info(tree: etree._Element) -> dict:
 # MODIFICATION XML
 # ============================================================================
 
+def _apply_rule(tree: etree._Element, rule, value: str) -> bool:
+    """
+    Applique une règle de rules.py au document (premier élément trouvé pour
+    chacun de ses chemins, comme des find('.//…') depuis la racine)
+
+    Returns:
+        True si la balise a été mise à jour ou créée
+    """
+    import rules
+
+    counts = {}
+    rules.compile_plan((rule,)).apply(tree.getroot(), {rule.field: value}, counts=counts)
+    for (name, action), count in counts.items():
+        logger.debug("%s : %s (%r)", name, action, value)
+        METRICS.incr('tags', count, tag=name, action=action)
+    return (rule.name, 'skipped') not in counts
+
+
 def update_customer_job_code(tree: etree._Element, code_poste: str) -> bool:
     """
-    Met à jour ou CRÉE la balise <CustomerJobCode>
+    Met à jour ou CRÉE la balise <CustomerJobCode> (règle CustomerJobCode
+    de rules.py)
     
     Args:
         tree: Arbre XML
@@ -86,52 +137,15 @@ def update_customer_job_code(tree: etree._Element, code_poste: str) -> bool:
     Returns:
         True si modification réussie
     """
-    root = tree.getroot()
-    
-    # Chercher la balise CustomerJobCode
-    job_code_elem = root.find('.//hr:CustomerJobCode', NAMESPACES)
-    
-    if job_code_elem is None:
-        # La balise n'existe pas, il faut la CRÉER
-        print("⚠️ Balise CustomerJobCode introuvable, CRÉATION...")
-        
-        # Chercher le bloc CustomerReportingRequirements
-        cust_req = root.find('.//hr:CustomerReportingRequirements', NAMESPACES)
-        
-        if cust_req is None:
-            print("❌ Bloc CustomerReportingRequirements introuvable")
-            return False
-        
-        # Chercher ExternalOrderNumber pour insérer AVANT
-        external_order = cust_req.find('hr:ExternalOrderNumber', NAMESPACES)
-        
-        # CRÉER la balise CustomerJobCode
-        job_code_elem = etree.Element('{http://ns.hr-xml.org/2004-08-02}CustomerJobCode')
-        job_code_elem.text = code_poste
-        job_code_elem.tail = '\n          '  # Formatage avec indentation
-        
-        if external_order is not None:
-            # Insérer AVANT ExternalOrderNumber
-            index = list(cust_req).index(external_order)
-            cust_req.insert(index, job_code_elem)
-        else:
-            # Si pas de ExternalOrderNumber, ajouter à la fin
-            cust_req.append(job_code_elem)
-        
-        print(f"✅ CustomerJobCode CRÉÉE : '{code_poste}'")
-        return True
-    
-    # La balise existe, mettre à jour la valeur
-    old_value = job_code_elem.text
-    job_code_elem.text = code_poste
-    
-    print(f"✅ CustomerJobCode : '{old_value}' → '{code_poste}'")
-    return True
+    import rules
+
+    return _apply_rule(tree, rules.CUSTOMER_JOB_CODE, code_poste)
 
 
 def update_cycle_horaire(tree: etree._Element, code_cycle: str) -> bool:
     """
-    Met à jour la balise <IdValue name="CYCLE">
+    Met à jour la balise <IdValue name="CYCLE"> (règle CycleHoraire de
+    rules.py)
     
     Args:
         tree: Arbre XML
@@ -140,32 +154,23 @@ def update_cycle_horaire(tree: etree._Element, code_cycle: str) -> bool:
     Returns:
         True si modification réussie
     """
-    root = tree.getroot()
-    
-    # Chercher le bloc StaffingShift
-    staffing_shift = root.find('.//hr:StaffingShift[@shiftPeriod="weekly"]', NAMESPACES)
-    
-    if staffing_shift is None:
-        print("⚠️ Balise StaffingShift introuvable")
-        return False
-    
-    # Chercher IdValue dans ce bloc
-    id_value_elem = staffing_shift.find('.//hr:IdValue', NAMESPACES)
-    
-    if id_value_elem is None:
-        print("⚠️ Balise IdValue introuvable dans StaffingShift")
-        return False
-    
-    # Mettre à jour l'attribut name et la valeur
-    old_name = id_value_elem.get('name', '')
-    old_value = id_value_elem.text
-    
-    id_value_elem.set('name', 'CYCLE')
-    id_value_elem.text = code_cycle
-    
-    print(f"✅ Cycle horaire : name='{old_name}' → 'CYCLE'")
-    print(f"✅ Cycle horaire : '{old_value}' → '{code_cycle}'")
-    return True
+    import rules
+
+    return _apply_rule(tree, rules.CYCLE_HORAIRE, code_cycle)
+
+
+def resolve_assignment_targets(assignment: etree._Element) -> dict:
+    """
+    Résout en un seul parcours les nœuds utiles d'un bloc <Assignment>
+    (plan des règles actives, voir rules.Plan.resolve)
+
+    Returns:
+        dict des éléments trouvés (None si absent), clés de rules.TARGETS
+        (orderId, customerJobCode, cycleIdValue…) et chemins des règles
+    """
+    import rules
+
+    return rules.compile_plan().resolve(assignment)
 
 
 def apply_corrections(xml_content: bytes, code_poste: str, code_cycle: str) -> tuple[bytes, dict]:
@@ -181,7 +186,9 @@ def apply_corrections(xml_content: bytes, code_poste: str, code_cycle: str) -> t
         (xml_corrigé_bytes, dict_stats)
     """
     # Parser le XML
-    tree = parse_xml(xml_content)
+    METRICS.observe_file_size(len(xml_content))
+    with METRICS.stage('parse'):
+        tree = parse_xml(xml_content)
     
     stats = {
         'customerJobCode': False,
@@ -189,17 +196,19 @@ def apply_corrections(xml_content: bytes, code_poste: str, code_cycle: str) -> t
     }
     
     # Appliquer les corrections
-    stats['customerJobCode'] = update_customer_job_code(tree, code_poste)
-    stats['cycleHoraire'] = update_cycle_horaire(tree, code_cycle)
+    with METRICS.stage('rewrite'):
+        stats['customerJobCode'] = update_customer_job_code(tree, code_poste)
+        stats['cycleHoraire'] = update_cycle_horaire(tree, code_cycle)
     
     # Convertir en bytes avec encodage ISO-8859-1
     output = io.BytesIO()
-    tree.write(
-        output,
-        encoding='iso-8859-1',
-        xml_declaration=True,
-        pretty_print=False  # Préserver le formatage original
-    )
+    with METRICS.stage('serialize'):
+        tree.write(
+            output,
+            encoding='iso-8859-1',
+            xml_declaration=True,
+            pretty_print=False  # Préserver le formatage original
+        )
     
     return output.getvalue(), stats
 
@@ -216,12 +225,40 @@ def validate_xml(xml_content: bytes) -> tuple[bool, str]:
         (is_valid, error_message)
     """
     try:
-        tree = parse_xml(xml_content)
+        with METRICS.stage('validate'):
+            tree = parse_xml(xml_content)
         return True, "XML valide"
     except Exception as e:
         return False, str(e)
 
 
+def validate_hrxml(xml_content: bytes) -> tuple[bool, str]:
+    """
+    Valide le XML : bien formé et conforme aux règles HR-XML des blocs
+    <Assignment> (validation.py), en un seul passage en flux
+
+    Après une correction, préférer l'option validate des moteurs de
+    correction, qui vérifie chaque bloc pendant l'écriture sans relire
+    le document.
+
+    Returns:
+        (is_valid, error_message)
+    """
+    # Import local : streaming et validation dépendent de ce module
+    from streaming import validate_stream
+    from validation import SEVERITY_ERROR
+
+    try:
+        violations = validate_stream(io.BytesIO(xml_content))
+    except Exception as e:
+        return False, str(e)
+    errors = [v for v in violations if v['severity'] == SEVERITY_ERROR]
+    if errors:
+        first = errors[0]
+        return False, f"{len(errors)} violation(s) HR-XML, dont {first['path']} : {first['message']}"
+    return True, "XML valide"
+
+
 # ============================================================================
 # COMPARAISON AVANT/APRÈS
 # ============================================================================
@@ -0,0 +1,212 @@
+"""
+VERALLIA Modificator - Validation HR-XML des contrats corrigés
+Règles HR-XML 2004-08-02 sur <Assignment>, <CustomerReportingRequirements>
+et <StaffingShift>, vérifiées bloc par bloc pendant la correction (sans
+re-parse du document)
+"""
+
+from utils import (
+    HR,
+    TAG_CUSTOMER_JOB_CODE,
+    TAG_CUSTOMER_REPORTING,
+    TAG_EXTERNAL_ORDER,
+    TAG_ID_VALUE,
+    TAG_ORDER_ID,
+    TAG_STAFFING_SHIFT,
+)
+
+
+# ============================================================================
+# CONFIGURATION
+# ============================================================================
+
+TAG_ASSIGNMENT = HR + 'Assignment'
+TAG_ASSIGNMENT_ID = HR + 'AssignmentId'
+TAG_ID = HR + 'Id'
+
+SEVERITY_ERROR = 'erreur'
+SEVERITY_WARNING = 'avertissement'
+
+
+# ============================================================================
+# OUTILS
+# ============================================================================
+
+def _local(tag: str) -> str:
+    return tag.rsplit('}', 1)[-1]
+
+
+def _has_text(elem) -> bool:
+    return elem is not None and bool(elem.text and elem.text.strip())
+
+
+def element_path(elem, assignment, number: int) -> str:
+    """
+    Chemin d'un élément depuis son bloc, ex. Assignment[3]/StaffingShift[2]/Id/IdValue
+
+    Les positions ne sont indiquées que si plusieurs frères portent le
+    même nom.
+    """
+    steps = []
+    while elem is not None and elem is not assignment:
+        parent = elem.getparent()
+        step = _local(elem.tag)
+        if parent is not None:
+            same = [sibling for sibling in parent if sibling.tag == elem.tag]
+            if len(same) > 1:
+                step += f'[{same.index(elem) + 1}]'
+        steps.append(step)
+        elem = parent
+    steps.append(f'Assignment[{number}]')
+    return '/'.join(reversed(steps))
+
+
+# ============================================================================
+# RÈGLES
+# ============================================================================
+
+# Balise → [(code, gravité, message, contrôle)] ; un contrôle reçoit
+# l'élément et retourne False en cas de violation
+RULES = {}
+
+
+def rule(code: str, tag: str, severity: str, message: str):
+    """Enregistre une règle portant sur les éléments de cette balise"""
+    def register(check):
+        RULES.setdefault(tag, []).append((code, severity, message, check))
+        return check
+    return register
+
+
+@rule('ASSIGNMENT_ID', TAG_ASSIGNMENT, SEVERITY_ERROR,
+      "AssignmentId/IdValue obligatoire et non vide")
+def _assignment_id(elem):
+    return any(_has_text(assignment_id.find(TAG_ID_VALUE)) for assignment_id in elem.iterchildren(TAG_ASSIGNMENT_ID))
+
+
+@rule('ORDER_ID', TAG_ASSIGNMENT, SEVERITY_WARNING,
+      "Aucun OrderId/IdValue : le contrat ne peut pas être rapproché d'une commande")
+def _order_id(elem):
+    return any(_has_text(order_id.find(TAG_ID_VALUE)) for order_id in elem.iter(TAG_ORDER_ID))
+
+
+@rule('REPORTING_UNIQUE', TAG_ASSIGNMENT, SEVERITY_WARNING,
+      "Plusieurs CustomerReportingRequirements : seul le premier est corrigé")
+def _reporting_unique(elem):
+    return len(elem.findall(TAG_CUSTOMER_REPORTING)) <= 1
+
+
+@rule('JOB_CODE_UNIQUE', TAG_CUSTOMER_REPORTING, SEVERITY_ERROR,
+      "CustomerJobCode présent plusieurs fois")
+def _job_code_unique(elem):
+    return len(elem.findall(TAG_CUSTOMER_JOB_CODE)) <= 1
+
+
+@rule('JOB_CODE_ORDER', TAG_CUSTOMER_REPORTING, SEVERITY_ERROR,
+      "CustomerJobCode doit précéder ExternalOrderNumber")
+def _job_code_order(elem):
+    seen_external = False
+    for child in elem:
+        if child.tag == TAG_EXTERNAL_ORDER:
+            seen_external = True
+        elif child.tag == TAG_CUSTOMER_JOB_CODE and seen_external:
+            return False
+    return True
+
+
+@rule('JOB_CODE_PARENT', TAG_CUSTOMER_JOB_CODE, SEVERITY_ERROR,
+      "CustomerJobCode hors de CustomerReportingRequirements")
+def _job_code_parent(elem):
+    return elem.getparent().tag == TAG_CUSTOMER_REPORTING
+
+
+@rule('JOB_CODE_EMPTY', TAG_CUSTOMER_JOB_CODE, SEVERITY_ERROR,
+      "CustomerJobCode vide")
+def _job_code_empty(elem):
+    return _has_text(elem)
+
+
+@rule('EXTERNAL_ORDER_PARENT', TAG_EXTERNAL_ORDER, SEVERITY_WARNING,
+      "ExternalOrderNumber hors de CustomerReportingRequirements")
+def _external_order_parent(elem):
+    return elem.getparent().tag == TAG_CUSTOMER_REPORTING
+
+
+@rule('SHIFT_PERIOD', TAG_STAFFING_SHIFT, SEVERITY_ERROR,
+      "Attribut shiftPeriod obligatoire sur StaffingShift")
+def _shift_period(elem):
+    return bool(elem.get('shiftPeriod'))
+
+
+@rule('SHIFT_ID', TAG_STAFFING_SHIFT, SEVERITY_ERROR,
+      "StaffingShift hebdomadaire sans Id/IdValue (cycle horaire)")
+def _shift_id(elem):
+    if elem.get('shiftPeriod') != 'weekly':
+        return True
+    return any(_has_text(id_value) for shift_id in elem.iterchildren(TAG_ID) for id_value in shift_id.iterchildren(TAG_ID_VALUE))
+
+
+@rule('SHIFT_ID_NAME', TAG_STAFFING_SHIFT, SEVERITY_WARNING,
+      "IdValue du cycle horaire sans attribut name")
+def _shift_id_name(elem):
+    return all(
+        id_value.get('name')
+        for shift_id in elem.iterchildren(TAG_ID)
+        for id_value in shift_id.iterchildren(TAG_ID_VALUE)
+    )
+
+
+# Balises parcourues dans chaque bloc (hors Assignment, contrôlé directement)
+_WALKED_TAGS = tuple(tag for tag in RULES if tag != TAG_ASSIGNMENT)
+
+# Balises lues par les règles : éléments contrôlés et éléments qu'elles
+# examinent. Le moteur par patch (patcher.py) ne relève que celles-ci dans
+# chaque bloc ; une règle qui en lit d'autres doit les ajouter ici.
+READ_TAGS = frozenset(RULES) | {TAG_ASSIGNMENT_ID, TAG_ID, TAG_ID_VALUE, TAG_ORDER_ID}
+
+
+# ============================================================================
+# VALIDATION D'UN BLOC
+# ============================================================================
+
+def validate_assignment(assignment, number: int, numero: str = None, path=element_path) -> list:
+    """
+    Applique les règles à un bloc <Assignment> (en un seul parcours)
+
+    Args:
+        assignment: Élément <Assignment> (corrigé) : lxml, ou les éléments
+            relevés par le moteur par patch (même sous-ensemble d'API)
+        number: Position du bloc dans le fichier (à partir de 1)
+        numero: Numéro de commande du bloc, repris dans le rapport
+        path: Chemin d'un élément en violation, fn(elem, assignment, number)
+
+    Returns:
+        Liste de violations {assignment, numeroCommande, path, rule,
+        severity, message}, vide si le bloc est conforme
+    """
+    violations = []
+
+    def check(elem):
+        for code, severity, message, rule_check in RULES[elem.tag]:
+            if not rule_check(elem):
+                violations.append({
+                    'assignment': number,
+                    'numeroCommande': numero,
+                    'path': path(elem, assignment, number),
+                    'rule': code,
+                    'severity': severity,
+                    'message': message,
+                })
+
+    check(assignment)
+    for elem in assignment.iter(*_WALKED_TAGS):
+        check(elem)
+    return violations
+
+
+def summarize(violations: list) -> dict:
+    """Nombre de violations par règle"""
+    counts = {}
+    for violation in violations:
+        counts[violation['rule']] = counts.get(violation['rule'], 0) + 1
+    return counts